@@ -1,66 +1,163 @@
 # fashion-shop/app.py
 
+import click
 from flask import Flask
 from config import Config
-from models import db, User
+from models import db, User, Category
 from flask_login import LoginManager
 from datetime import datetime
 from flask_wtf.csrf import CSRFProtect
+from compression import init_compression
+from querybudget import init_query_budget
+from profiling import init_profiling
+from search import init_search
+from facets import init_facets
+from images import init_images
+from cache import init_cache
+from identity import identity_cache
+from dbpool import init_pool_metrics
+from benchmark import init_benchmark
+from migrations import init_migrations
+from catalog_io import init_catalog_io
+from recommendations import init_recommendations
+from jobs import init_jobs
+from sales import init_sales
+from guest_cart import init_guest_cart
+from assets import init_assets
+from snapshot import init_snapshot
+from warmup import init_warmup
+from passwords import init_passwords
+from routes import init_routes
 
-# Create the Flask application instance
-app = Flask(__name__)
-# Load configuration from Config class
-app.config.from_object(Config)
-
-# Initialize CSRFProtect with the Flask app
-csrf = CSRFProtect(app)
-
-# Initialize SQLAlchemy with the Flask app
-# REMOVED: engine_options argument
-db.init_app(app) # Should be just this line now
-
-# Setup Flask-Login
+# Extensions are created once and bound to each application by create_app()
+csrf = CSRFProtect()
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login' # The route name for the login page
 
 # This function tells Flask-Login how to load a user from their ID
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity_cache.load(int(user_id))
+
+def create_app(config=Config):
+    # Application factory: `flask` finds it on its own, gunicorn loads it once in the
+    # master with preload_app (see gunicorn.conf.py) and forks the workers from there
+    app = Flask(__name__)
+    # Load configuration from Config class
+    app.config.from_object(config)
+
+    # Initialize CSRFProtect with the Flask app
+    csrf.init_app(app)
+
+    # Initialize SQLAlchemy with the Flask app
+    db.init_app(app)
+
+    # Track pool checkouts, wait time, timeouts and connection age for /internal/metrics
+    init_pool_metrics(app, db)
+
+    # Setup Flask-Login
+    login_manager.init_app(app)
+
+    # Capped password hashing, shared by all workers, and login/registration throttling
+    init_passwords(app)
+
+    # gzip/brotli responses and precompressed static files. Registered before every other
+    # after_request hook, since those run in reverse order and this one must see the final body.
+    init_compression(app)
+
+    # Count SQL queries per request and check them against each view's @query_budget
+    init_query_budget(app)
+
+    # Per-endpoint wall/SQL/template timings for /internal/metrics/prometheus
+    init_profiling(app)
+
+    # Keep the in-memory product search index in sync with Product writes
+    init_search(app)
+
+    # In-process facet counts (category / price band / in stock) for the catalog listings
+    init_facets(app)
+
+    # Read-only catalog snapshot (categories, slug -> id maps), refreshed on a version check
+    init_snapshot(app)
+
+    # Responsive image derivatives: worker pool, `product_image` template helper and CLI backfill
+    init_images(app)
+
+    # `flask upgrade-db` adds new columns/indexes to an existing database
+    init_migrations(app)
 
-# Make datetime.utcnow available in Jinja2 templates for the footer
-app.jinja_env.globals.update(now=datetime.utcnow)
+    # `flask bench seed` / `flask bench run` load-testing commands
+    init_benchmark(app)
 
-# Import routes AFTER app and db are initialized to avoid circular imports
-from routes import *
+    # `flask import-products` / `flask export-products` streaming catalog feeds
+    init_catalog_io(app)
+
+    # `flask recommendations update`: related products and bestsellers from order history
+    init_recommendations(app)
+
+    # Durable job queue for post-checkout work (`flask jobs work`), with pluggable email delivery
+    init_jobs(app)
+
+    # Daily sales rollups (`flask sales update` / `flask sales rebuild`) behind the admin dashboard
+    init_sales(app)
+
+    # Page cache for anonymous catalog pages, invalidated on Product/Category commits
+    init_cache(app)
+
+    # Session-backed cart for visitors who are not logged in, merged into CartItem on login
+    init_guest_cart(app)
+
+    # Fingerprinted static assets (`flask assets build`) with immutable caching
+    init_assets(app)
+
+    # Snapshot cache in front of the user loader (see identity.py)
+    identity_cache.init_app(app)
+
+    # `flask warm-up` and the pre-fork warm-up used by gunicorn.conf.py
+    init_warmup(app)
+
+    # Make datetime.utcnow available in Jinja2 templates for the footer
+    app.jinja_env.globals.update(now=datetime.utcnow)
+
+    # The views in routes.py, under their plain endpoint names
+    init_routes(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the tables, the default categories and the admin user."""
+        seed_defaults()
+
+    return app
+
+def seed_defaults():
+    db.create_all() # This will create tables in your MySQL database
+
+    # Optional: Add some initial categories if they don't exist
+    if not Category.query.first():
+        click.echo("Adding initial categories...")
+        db.session.add(Category(name='Men\'s Wear', slug='mens-wear'))
+        db.session.add(Category(name='Women\'s Wear', slug='womens-wear'))
+        db.session.add(Category(name='Accessories', slug='accessories'))
+        db.session.add(Category(name='Footwear', slug='footwear'))
+        db.session.commit()
+        click.echo("Categories added.")
+
+    # Check if an admin user already exists before creating one
+    admin_email = 'Thiru@gmail.com'
+    if not User.query.filter_by(email=admin_email).first():
+        click.echo(f"Creating admin user with email {admin_email}...")
+        admin_user = User(username='admin', email=admin_email, is_admin=True)
+        admin_user.set_password('741852963') # IMPORTANT: Change this to a strong password!
+        db.session.add(admin_user)
+        db.session.commit()
+        click.echo("Admin user created successfully!")
+    else:
+        click.echo(f"Admin user with email {admin_email} already exists. Skipping creation.")
 
 # This block runs the application when you execute app.py
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all() # This will create tables in your MySQL database
-
-        # Optional: Add some initial categories if they don't exist
-        from models import Category
-        if not Category.query.first():
-            print("Adding initial categories...")
-            db.session.add(Category(name='Men\'s Wear', slug='mens-wear'))
-            db.session.add(Category(name='Women\'s Wear', slug='womens-wear'))
-            db.session.add(Category(name='Accessories', slug='accessories'))
-            db.session.add(Category(name='Footwear', slug='footwear'))
-            db.session.commit()
-            print("Categories added.")
-
-        # Check if an admin user already exists before creating one
-        admin_email = 'Thiru@gmail.com'
-        if not User.query.filter_by(email=admin_email).first():
-            print(f"Creating admin user with email {admin_email}...")
-            admin_user = User(username='admin', email=admin_email, is_admin=True)
-            admin_user.set_password('741852963') # IMPORTANT: Change this to a strong password!
-            db.session.add(admin_user)
-            db.session.commit()
-            print("Admin user created successfully!")
-        else:
-            print(f"Admin user with email {admin_email} already exists. Skipping creation.")
-
-    app.run(debug=True) # Run the app in debug mode (auto-reloads on code changes)
\ No newline at end of file
+        seed_defaults()
+
+    app.run(debug=True) # Run the app in debug mode (auto-reloads on code changes)
@@ -0,0 +1,155 @@
+# fashion-shop/assets.py
+
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import click
+from flask import request
+from flask.sessions import SecureCookieSessionInterface
+from compression import precompress
+
+try:
+    import rjsmin
+except ImportError:  # rjsmin is optional; without it main.js is only stripped of comments/indentation
+    rjsmin = None
+
+# Static asset pipeline.
+# `flask assets build` turns the source CSS/JS under static/ into minified copies with the
+# content hash in their names (static/dist/app.<hash>.css, ...) and records them in
+# static/dist/manifest.json. url_for('static', filename='css/app.css') then resolves to the
+# fingerprinted file, which is served with a long-lived immutable Cache-Control (and from
+# its precompressed .br/.gz variant when the browser accepts one, see compression.py). Files not
+# in the manifest (no build yet, development) are served unhashed, as before.
+#
+# The build needs no network: CSS goes through a locally installed Tailwind CLI
+# (TAILWIND_BIN), which purges unused utilities using tailwind.config.js.
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# Source path (relative to static/) -> how it is built
+BUNDLES = {
+    'css/app.css': 'tailwind',
+    'js/main.js': 'js',
+}
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+def minify_js(source):
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+    # Conservative fallback: drop whole-line comments, indentation and blank lines only
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+def build_css(app, source_path):
+    command = shlex.split(app.config['TAILWIND_BIN'])
+    if shutil.which(command[0]) is None:
+        raise click.ClickException(
+            f'Tailwind CLI not found ({command[0]}). Install the standalone binary or set TAILWIND_BIN.')
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'app.css')
+        subprocess.run(command + ['-c', os.path.join(app.root_path, 'tailwind.config.js'),
+                                  '-i', source_path, '-o', output, '--minify'],
+                       cwd=app.root_path, check=True)
+        with open(output, 'rb') as f:
+            return f.read()
+
+class AssetManifest:
+    def __init__(self):
+        self.static_folder = None
+        self.max_age = 0
+        self.files = {}  # source path -> fingerprinted path, both relative to static/
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.max_age = app.config.get('ASSET_MAX_AGE', 365 * 24 * 3600)
+        self.load()
+        app.url_defaults(self._fingerprint_url)
+        app.after_request(self._cache_headers)
+        app.jinja_env.globals.update(asset_built=self.built)
+
+    @property
+    def path(self):
+        return os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def built(self, filename):
+        return filename in self.files
+
+    def _fingerprint_url(self, endpoint, values):
+        # url_for('static', filename=...) hook: swap in the fingerprinted name when there is one
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def _cache_headers(self, response):
+        filename = (request.view_args or {}).get('filename', '')
+        if request.endpoint == 'static' and filename.startswith(DIST_DIR + '/') \
+                and response.status_code in (200, 304):
+            # The name changes whenever the content does, so browsers never need to revalidate
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+    def build(self, app):
+        dist = os.path.join(self.static_folder, DIST_DIR)
+        os.makedirs(dist, exist_ok=True)
+        files = {}
+        for source, kind in BUNDLES.items():
+            source_path = os.path.join(self.static_folder, source)
+            if kind == 'tailwind':
+                data = build_css(app, source_path)
+            else:
+                with open(source_path, encoding='utf-8') as f:
+                    data = minify_js(f.read()).encode('utf-8')
+            stem, ext = os.path.splitext(os.path.basename(source))
+            built = f'{DIST_DIR}/{stem}.{content_hash(data)}{ext}'
+            with open(os.path.join(self.static_folder, built), 'wb') as f:
+                f.write(data)
+            variants = precompress(os.path.join(self.static_folder, built))
+            files[source] = built
+            sizes = ''.join(f', {encoding} {size}' for encoding, size in variants.items())
+            click.echo(f'  {source} -> {built} ({os.path.getsize(source_path)} -> {len(data)} bytes{sizes})')
+
+        # Earlier builds stay in place, so pages rendered before a deploy can still load their assets
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(files, f, indent=2, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+        self.files = files
+
+asset_manifest = AssetManifest()
+
+class StaticSessionInterface(SecureCookieSessionInterface):
+    # Flask-Login looks at the session after every request, which makes Flask add
+    # `Vary: Cookie` and re-sign the cookie even for static files. Their content never
+    # depends on the session, and the Vary header would keep shared caches from storing them.
+    def save_session(self, app, session, response):
+        if request.endpoint == 'static' and not session.modified:
+            return
+        super().save_session(app, session, response)
+
+def init_assets(app):
+    asset_manifest.init_app(app)
+    app.session_interface = StaticSessionInterface()
+
+    @app.cli.group('assets')
+    def assets():
+        """Build fingerprinted, minified static assets."""
+
+    @assets.command('build')
+    def build_command():
+        """Compile purged/minified CSS and minified JS into static/dist, precompressed, with a manifest."""
+        asset_manifest.build(app)
+        click.echo(f'Manifest written to {asset_manifest.path}')
@@ -0,0 +1,1832 @@
+# fashion-shop/benchmark.py
+
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.cookiejar import CookieJar
+import click
+from sqlalchemy import delete, event, func, insert, select, update
+from werkzeug.security import generate_password_hash
+from models import db, User, Category, Product, CartItem, Order, OrderItem, Job
+from orders import backfill_order_summaries
+from money import to_money, total
+from cache import bump_catalog_version
+
+# Load-testing and benchmark suite for the shop's critical flows.
+#
+#   flask bench seed --products 100000 --users 10000
+#   flask bench run --mode client --requests 500 --concurrency 8 --output results.json
+#   flask bench run --mode gunicorn --workers 4 --baseline bench_baseline.json
+#   flask bench checkout-latency --handler-delay 0.5
+#   flask bench facets --synthetic 500000
+#   flask bench sales-dashboard --days 90
+#   flask bench repeat-visits --pages 50
+#   flask bench startup --workers 4
+#   flask bench login-flood --flood-concurrency 16 --max-slowdown 2
+#   flask bench oversell --stock 200 --buyers 1 --buyers 8 --buyers 32
+#   flask bench catalog-scaling --size 1000 --size 10000 --size 100000 --size 500000
+#   flask bench search --samples 500
+#   flask bench page-cache --backend lru --requests 2000
+#   flask bench identity --requests 1000 --concurrency 8
+#   flask bench pool-load --threads 8 --concurrency 32
+#   flask bench profiler-overhead --rounds 20 --max-overhead 5
+#   flask bench order-history --orders 5000
+#   flask bench page-weight --samples 50
+#   flask bench recommendations --lines 10000000
+#
+# `seed` fills the configured database with a synthetic catalog, users, carts and orders.
+# `run` drives the real app (in-process test client, or gunicorn on localhost) through
+# each flow, reports throughput, p50/p95/p99 latency and SQL queries/writes per request, writes
+# a JSON results file and compares it with a stored baseline.
+
+BENCH_PASSWORD = 'bench-password'
+BENCH_USER_PREFIX = 'bench_user_'
+BATCH_SIZE = 5000
+
+FLOWS = ['home', 'products', 'products_by_category', 'product_detail',
+         'add_to_cart', 'cart', 'checkout', 'order_history',
+         'guest_add_to_cart', 'guest_cart']
+
+WORDS = ['classic', 'slim', 'linen', 'cotton', 'denim', 'silk', 'wool', 'summer', 'winter', 'vintage',
+         'casual', 'formal', 'striped', 'floral', 'oversized', 'cropped', 'relaxed', 'tailored', 'knit', 'leather']
+ITEMS = ['shirt', 'dress', 'jeans', 'jacket', 'skirt', 'sneakers', 'boots', 'scarf', 'handbag', 'hoodie',
+         'blazer', 'shorts', 'sweater', 'coat', 'belt', 'sandals', 'cap', 'tee', 'chinos', 'cardigan']
+
+# --- Seeding ---
+
+def _batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _insert_batches(model, rows, label):
+    inserted = 0
+    for batch in _batched(rows):
+        db.session.execute(insert(model), batch)
+        db.session.commit()
+        inserted += len(batch)
+        click.echo(f'\r  {label}: {inserted}', nl=False)
+    click.echo(f'\r  {label}: {inserted}')
+
+def seed(products, users, categories, carts, orders_per_user, seed_value):
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+
+    existing = {c.slug for c in Category.query.all()}
+    new_categories = [{'name': f'Bench Category {i}', 'slug': f'bench-category-{i}'}
+                      for i in range(categories) if f'bench-category-{i}' not in existing]
+    if new_categories:
+        db.session.execute(insert(Category), new_categories)
+        db.session.commit()
+    category_ids = [c.id for c in Category.query.filter(Category.slug.like('bench-category-%')).all()]
+
+    product_offset = db.session.scalar(select(func.count()).select_from(Product)) or 0
+    _insert_batches(Product, ({
+        'name': f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(ITEMS)} {i}',
+        'slug': f'bench-product-{product_offset + i}',
+        'description': ' '.join(rng.choice(WORDS + ITEMS) for _ in range(20)),
+        'price': to_money(round(rng.uniform(5, 300), 2)),
+        'stock': 1_000_000,
+        'available': True,
+        'category_id': rng.choice(category_ids),
+        'created_at': now - timedelta(minutes=i),
+        'updated_at': now,
+    } for i in range(products)), 'products')
+    if products:
+        # Bulk inserts skip the ORM hooks; tell running processes the catalog changed
+        bump_catalog_version()
+        db.session.commit()
+
+    # Hashing is deliberately slow, so every bench user shares one precomputed hash
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    user_offset = db.session.scalar(select(func.count()).select_from(User)) or 0
+    _insert_batches(User, ({
+        'username': f'{BENCH_USER_PREFIX}{user_offset + i}',
+        'email': f'{BENCH_USER_PREFIX}{user_offset + i}@example.com',
+        'password_hash': password_hash,
+        'is_admin': False,
+    } for i in range(users)), 'users')
+
+    product_ids = db.session.scalars(select(Product.id).where(Product.slug.like('bench-product-%'))).all()
+    user_ids = db.session.scalars(select(User.id).where(User.username.like(f'{BENCH_USER_PREFIX}%'))).all()
+    if not product_ids or not user_ids:
+        return
+
+    cart_users = rng.sample(user_ids, min(carts, len(user_ids)))
+    _insert_batches(CartItem, ({
+        'user_id': user_id, 'product_id': product_id, 'quantity': rng.randint(1, 3), 'added_at': now,
+    } for user_id in cart_users for product_id in rng.sample(product_ids, min(3, len(product_ids)))), 'cart items')
+
+    if not orders_per_user:
+        return
+    # Orders and their items are generated a chunk of users at a time to keep memory flat
+    next_order_id = (db.session.scalar(select(func.max(Order.id))) or 0) + 1
+    placed = 0
+    for user_chunk in _batched(user_ids, 1000):
+        orders, items = [], []
+        for user_id in user_chunk:
+            for _ in range(orders_per_user):
+                lines = [(product_id, rng.randint(1, 3), to_money(round(rng.uniform(5, 300), 2)))
+                         for product_id in rng.sample(product_ids, min(rng.randint(1, 4), len(product_ids)))]
+                orders.append({
+                    'id': next_order_id, 'user_id': user_id, 'status': 'Delivered',
+                    'order_date': now - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86400)),
+                    'total_amount': total((p, q) for _, q, p in lines),
+                    'shipping_address': '1 Bench Street, Testville, 00000',
+                })
+                items.extend({'order_id': next_order_id, 'product_id': product_id, 'quantity': quantity, 'price': price}
+                             for product_id, quantity, price in lines)
+                next_order_id += 1
+        db.session.execute(insert(Order), orders)
+        db.session.execute(insert(OrderItem), items)
+        db.session.commit()
+        placed += len(orders)
+        click.echo(f'\r  orders: {placed}', nl=False)
+    click.echo(f'\r  orders: {placed}')
+    backfill_order_summaries()
+
+# --- HTTP sessions ---
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+class ClientSession:
+    # Drives the app in-process through Flask's test client
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data()
+        return response.status_code, body
+
+class HTTPSession:
+    # Drives a running server over real HTTP, keeping cookies like a browser
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(_NoRedirect, urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Each flow is timed as a single request, so redirects are not followed
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+def _csrf_token(session):
+    status, body = session.request('GET', '/login')
+    match = CSRF_RE.search(body.decode('utf-8', 'replace'))
+    return match.group(1) if match else ''
+
+class ShopperBot:
+    # One logged-in bench user walking through the flows, plus an anonymous visitor
+    # session for the guest_* flows
+    def __init__(self, session, guest_session, username, targets):
+        self.session = session
+        self.guest_session = guest_session
+        self.targets = targets
+        self.csrf_token = _csrf_token(session)
+        self.guest_csrf_token = _csrf_token(guest_session)
+        for _ in range(10):
+            status, _ = session.request('POST', '/login', {
+                'csrf_token': self.csrf_token, 'username': username, 'password': BENCH_PASSWORD})
+            if status != 503:
+                break
+            time.sleep(0.5)  # every password hashing slot was taken (see passwords.py)
+        if status >= 400:
+            raise click.ClickException(f'Could not log in as {username} (HTTP {status}). Did you run `flask bench seed`?')
+
+    def _add_one(self):
+        return self.session.request('POST', '/cart/add', {
+            'csrf_token': self.csrf_token, 'product_id': random.choice(self.targets['product_ids']), 'quantity': 1})
+
+    def _guest_add_one(self):
+        return self.guest_session.request('POST', '/cart/add', {
+            'csrf_token': self.guest_csrf_token, 'product_id': random.choice(self.targets['product_ids']), 'quantity': 1})
+
+    def prepare(self, flow):
+        # Untimed setup a flow needs (checkout needs something in the cart)
+        if flow == 'checkout':
+            self._add_one()
+
+    def run(self, flow):
+        request = self.session.request
+        if flow == 'home':
+            return request('GET', '/')
+        if flow == 'products':
+            return request('GET', '/products')
+        if flow == 'products_by_category':
+            return request('GET', f"/products/category/{random.choice(self.targets['category_slugs'])}")
+        if flow == 'product_detail':
+            return request('GET', f"/product/{random.choice(self.targets['product_slugs'])}")
+        if flow == 'add_to_cart':
+            return self._add_one()
+        if flow == 'cart':
+            return request('GET', '/cart')
+        if flow == 'checkout':
+            return request('POST', '/checkout', {
+                'csrf_token': self.csrf_token, 'first_name': 'Bench', 'last_name': 'User',
+                'email': 'bench@example.com', 'address': '1 Bench Street', 'postal_code': '00000', 'city': 'Testville'})
+        if flow == 'order_history':
+            return request('GET', '/orders')
+        if flow == 'guest_add_to_cart':
+            return self._guest_add_one()
+        if flow == 'guest_cart':
+            return self.guest_session.request('GET', '/cart')
+        raise ValueError(flow)
+
+# --- Running ---
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def _load_targets():
+    product_rows = db.session.execute(
+        select(Product.id, Product.slug).where(Product.available.is_(True)).limit(5000)).all()
+    category_slugs = db.session.scalars(
+        select(Category.slug).where(Category.products.any())).all()
+    usernames = db.session.scalars(
+        select(User.username).where(User.username.like(f'{BENCH_USER_PREFIX}%')).limit(1000)).all()
+    if not product_rows or not category_slugs or not usernames:
+        raise click.ClickException('The database has no bench data. Run `flask bench seed` first.')
+    return {
+        'product_ids': [row.id for row in product_rows],
+        'product_slugs': [row.slug for row in product_rows],
+        'category_slugs': category_slugs,
+        'usernames': usernames,
+    }
+
+def _sql_totals(profiler):
+    # endpoint -> (total statements, total writes, requests) from the in-process profiler
+    writes = profiler.sql_writes.series
+    return {endpoint: (series[-2], writes[endpoint][-2], series[-1])
+            for endpoint, series in profiler.sql_queries.series.items()}
+
+# Endpoint each flow's timed request lands on, where it differs from the flow name
+FLOW_ENDPOINTS = {'guest_add_to_cart': 'add_to_cart', 'guest_cart': 'cart'}
+
+def run_flow(bots, flow, requests_per_flow):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests_per_flow]
+
+    def worker(bot):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            bot.prepare(flow)
+            started = time.perf_counter()
+            status, _ = bot.run(flow)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(bot,)) for bot in bots]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _start_gunicorn(workers, threads, extra_env=None):
+    port = _free_port()
+    env = dict(os.environ, WEB_THREADS=str(threads), **(extra_env or {}))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers), '--threads', str(threads),
+         '-b', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/login', timeout=1).close()
+            return process, base_url
+        except OSError:
+            if process.poll() is not None:
+                raise click.ClickException('gunicorn exited during startup.')
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException('gunicorn did not start within 30 seconds.')
+
+def _make_bots(make_session, targets, concurrency):
+    # Bots log in from fresh threads: the CLI's app context (and its `g`, where Flask-Login
+    # keeps the current user) must not be shared between their requests
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(
+            lambda i: ShopperBot(make_session(), make_session(),
+                                 targets['usernames'][i % len(targets['usernames'])], targets),
+            range(concurrency)))
+
+def run(app, mode, flows, requests_per_flow, concurrency, workers, threads):
+    from profiling import request_profiler
+
+    targets = _load_targets()
+    process = None
+    if mode == 'gunicorn':
+        process, base_url = _start_gunicorn(workers, threads)
+        make_session = lambda: HTTPSession(base_url)
+    else:
+        make_session = lambda: ClientSession(app)
+
+    try:
+        bots = _make_bots(make_session, targets, concurrency)
+        results = {}
+        for flow in flows:
+            before = _sql_totals(request_profiler)
+            click.echo(f'  {flow} ...', nl=False)
+            results[flow] = run_flow(bots, flow, requests_per_flow)
+            # SQL counts come from the in-process profiler, so they are only known in client mode
+            after = _sql_totals(request_profiler)
+            endpoint = FLOW_ENDPOINTS.get(flow, flow)
+            queries, writes, served = [a - b for a, b in zip(after.get(endpoint, (0, 0, 0)),
+                                                             before.get(endpoint, (0, 0, 0)))]
+            measured = mode == 'client' and served
+            results[flow]['sql_queries_per_request'] = round(queries / served, 2) if measured else None
+            results[flow]['sql_writes_per_request'] = round(writes / served, 2) if measured else None
+            click.echo(f" {results[flow]['throughput_rps']} req/s, p95 {results[flow]['p95_ms']} ms")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    return {
+        'meta': {
+            'mode': mode,
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'requests_per_flow': requests_per_flow,
+            'concurrency': concurrency,
+            'workers': workers if mode == 'gunicorn' else None,
+            'threads': threads if mode == 'gunicorn' else None,
+            'python': platform.python_version(),
+            'database': db.engine.url.get_backend_name(),
+            'products': db.session.scalar(select(func.count()).select_from(Product)),
+            'users': db.session.scalar(select(func.count()).select_from(User)),
+        },
+        'flows': results,
+    }
+
+# --- Catalog scaling: listing latency as the catalog grows ---
+
+@contextmanager
+def _page_cache(backend):
+    # Swaps the page cache for a while, e.g. for a NullCache to time the views themselves
+    import cache
+    previous, cache.page_cache = cache.page_cache, backend
+    try:
+        yield backend
+    finally:
+        cache.page_cache = previous
+
+def _in_fresh_thread(fn, *args):
+    # Test client requests made from the CLI's thread share its app context, and so `g`
+    # (query counts, the current user); a fresh thread gets a context per request
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(fn, *args).result()
+
+def _time_requests(session, path, samples):
+    latencies = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        status, _ = session.request('GET', path)
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise click.ClickException(f'GET {path} answered {status}')
+    return _latency_summary(latencies)
+
+def _scaling_paths():
+    # Listing pages at the start and 90% of the way through the catalog, by name
+    from pagination import encode_cursor
+    available = Product.available.is_(True)
+    count = db.session.scalar(select(func.count()).select_from(Product).where(available))
+    deep = db.session.execute(select(Product.name, Product.id).where(available)
+                              .order_by(Product.name, Product.id).offset(int(count * 0.9)).limit(1)).one()
+    category = db.session.execute(
+        select(Category.slug).join(Product, Product.category_id == Category.id).where(available)
+        .group_by(Category.id).order_by(func.count().desc()).limit(1)).scalar_one()
+    return {
+        'home': '/',
+        'products': '/products',
+        'products_deep': '/products?' + urllib.parse.urlencode({'after': encode_cursor(tuple(deep))}),
+        'category': f'/products/category/{category}',
+        'products_filtered': '/products?price=25-50&in_stock=1',
+    }
+
+def catalog_scaling(app, sizes, samples, seed_value):
+    # Grows the bench catalog to each size in turn (never shrinks it) and times the listing
+    # pages with the page cache off, so every request runs its queries and renders
+    from cache import NullCache
+    session = ClientSession(app)
+    results = {}
+    for size in sorted(sizes):
+        current = db.session.scalar(select(func.count()).select_from(Product))
+        if current > size:
+            click.echo(f'  {size} products: the catalog already has {current}, skipped')
+            continue
+        if current < size:
+            seed(size - current, 0, 12, 0, 0, seed_value + size)
+        paths = _scaling_paths()
+        with _page_cache(NullCache()):
+            for path in paths.values():
+                _in_fresh_thread(session.request, 'GET', path)  # loads the per-process catalog data
+            results[size] = {page: _in_fresh_thread(_time_requests, session, path, samples)
+                             for page, path in paths.items()}
+        click.echo(f'  {size:>7} products: ' + ', '.join(
+            f"{page} p50 {r['p50_ms']} / p99 {r['p99_ms']} ms" for page, r in results[size].items()))
+    if len(results) > 1:
+        smallest, largest = results[min(results)], results[max(results)]
+        click.echo(f'  p50 growth from {min(results)} to {max(results)} products: ' + ', '.join(
+            f"{page} {largest[page]['p50_ms'] / max(smallest[page]['p50_ms'], 0.001):.2f}x" for page in largest))
+    return {'samples': samples, 'sizes': results}
+
+# --- Page cache: anonymous browsing with the cache on and off ---
+
+def _anonymous_visits(app, paths, weights, requests_total, concurrency, seed_value):
+    # Anonymous visitors picking pages by popularity; returns latencies and non-200 answers
+    latencies, errors, lock = [], [0], threading.Lock()
+
+    def visitor(i):
+        rng = random.Random(seed_value + i)
+        session = ClientSession(app)
+        for path in rng.choices(paths, weights=weights, k=requests_total // concurrency):
+            started = time.perf_counter()
+            status, _ = session.request('GET', path)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += status != 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(visitor, range(concurrency)))
+    return latencies, errors[0]
+
+def page_cache_latency(app, backend, pages, requests_total, concurrency, seed_value):
+    # The same popularity-weighted anonymous browsing with the page cache off (NullCache)
+    # and on (an empty cache of the chosen backend): hit ratio and latency percentiles
+    import tempfile
+    from cache import LRUCache, NullCache, SQLiteCache
+    targets = _load_targets()
+    rng = random.Random(seed_value)
+    paths = ['/', '/products'] + [f'/products/category/{slug}' for slug in targets['category_slugs']]
+    paths += [f'/product/{slug}' for slug in rng.sample(targets['product_slugs'], min(pages, len(targets['product_slugs'])))]
+    # Zipf-like popularity: a few pages get most of the traffic, as in a real shop
+    weights = [1 / (rank + 1) for rank in range(len(paths))]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        caches = {'off': NullCache()}
+        if backend == 'sqlite':
+            caches['on'] = SQLiteCache(os.path.join(scratch, 'page_cache.sqlite3'),
+                                       max_entries=app.config['CACHE_MAX_ENTRIES'], ttl=app.config['CACHE_TTL'])
+        else:
+            caches['on'] = LRUCache(max_entries=app.config['CACHE_MAX_ENTRIES'], ttl=app.config['CACHE_TTL'])
+        for mode, page_cache in caches.items():
+            with _page_cache(page_cache):
+                started = time.perf_counter()
+                latencies, errors = _anonymous_visits(app, paths, weights, requests_total, concurrency, seed_value)
+                wall = time.perf_counter() - started
+            stats = page_cache.stats()
+            results[mode] = dict(_latency_summary(latencies), requests=len(latencies), errors=errors,
+                                 throughput_rps=round(len(latencies) / wall, 1),
+                                 hit_ratio=round(stats['hit_ratio'], 3) if mode == 'on' else 0.0)
+            r = results[mode]
+            click.echo(f"  cache {mode:3}  hit ratio {r['hit_ratio']:.1%}  p50 {r['p50_ms']:8.3f} ms  "
+                       f"p99 {r['p99_ms']:8.3f} ms  {r['throughput_rps']} req/s  {errors} errors")
+    return {'backend': backend, 'pages': len(paths), 'concurrency': concurrency, 'modes': results}
+
+# --- Identity cache: the user loader with and without its cache ---
+
+def identity_lookups(app, requests_per_mode, concurrency):
+    # /cart for logged-in shoppers with the identity cache off (a NullCache: the loader
+    # queries the user row on every request, as before identity.py) and on
+    from cache import NullCache
+    from identity import identity_cache
+    from profiling import request_profiler
+
+    targets = _load_targets()
+    bots = _make_bots(lambda: ClientSession(app), targets, concurrency)
+    results = {}
+    original = identity_cache.cache
+    try:
+        for mode, user_cache in (('before', NullCache()), ('after', original)):
+            identity_cache.cache = user_cache
+            run_flow(bots, 'cart', concurrency)  # fills the cache with the shoppers' snapshots
+            before = _sql_totals(request_profiler).get('cart', (0, 0, 0))
+            results[mode] = run_flow(bots, 'cart', requests_per_mode)
+            queries, _, served = [a - b for a, b in zip(_sql_totals(request_profiler)['cart'], before)]
+            results[mode]['sql_queries_per_request'] = round(queries / served, 2) if served else None
+            r = results[mode]
+            click.echo(f"  {mode:6}  {r['sql_queries_per_request']} queries per request  "
+                       f"{r['throughput_rps']} req/s  p50 {r['p50_ms']} ms  p99 {r['p99_ms']} ms")
+    finally:
+        identity_cache.cache = original
+    return {'requests': requests_per_mode, 'concurrency': concurrency, 'modes': results}
+
+# --- Cart totals ---
+
+def cart_totals(limit):
+    # Times four ways of totalling every open cart and checks them against the exact
+    # vectorised result: per-cart ORM load with float arithmetic (the old way), one SUM
+    # query per cart, one GROUP BY over all carts, and carts.all_cart_totals()
+    from sqlalchemy.orm import joinedload
+    from carts import all_cart_totals
+
+    user_ids = db.session.scalars(select(CartItem.user_id).distinct().limit(limit)).all()
+    if not user_ids:
+        raise click.ClickException('No carts to total. Run `flask bench seed --carts N` first.')
+
+    def per_cart_orm_float():
+        totals = {}
+        for user_id in user_ids:
+            items = CartItem.query.options(joinedload(CartItem.product)).filter_by(user_id=user_id).all()
+            totals[user_id] = sum(float(item.product.price) * item.quantity for item in items)
+            db.session.expunge_all()
+        return totals
+
+    def per_cart_sql():
+        return {user_id: db.session.scalar(
+                    select(func.sum(Product.price * CartItem.quantity))
+                    .select_from(CartItem).join(Product, Product.id == CartItem.product_id)
+                    .where(CartItem.user_id == user_id))
+                for user_id in user_ids}
+
+    def grouped_sql():
+        return dict(db.session.execute(
+            select(CartItem.user_id, func.sum(Product.price * CartItem.quantity))
+            .join(Product, Product.id == CartItem.product_id)
+            .group_by(CartItem.user_id)).all())
+
+    results = {}
+    exact = None
+    for name, method in (('vectorized', all_cart_totals), ('grouped_sql', grouped_sql),
+                         ('per_cart_sql', per_cart_sql), ('per_cart_orm_float', per_cart_orm_float)):
+        started = time.perf_counter()
+        totals = method()
+        elapsed = time.perf_counter() - started
+        if exact is None:
+            exact = totals
+        # Compared as-is, without rounding: a float total like 59.970000000000006 counts as inexact
+        mismatches = sum(1 for user_id in user_ids
+                         if Decimal(repr(totals[user_id]) if isinstance(totals[user_id], float)
+                                    else totals[user_id]) != exact[user_id])
+        results[name] = {'seconds': round(elapsed, 4), 'carts_per_second': round(len(user_ids) / elapsed, 1),
+                         'inexact_totals': mismatches}
+        click.echo(f"  {name:20} {elapsed:8.3f}s  {results[name]['carts_per_second']:>10} carts/s  "
+                   f"{mismatches} inexact")
+    return {'carts': len(user_ids), 'methods': results}
+
+# --- Search: inverted index against LIKE ---
+
+def _search_queries(rng, samples):
+    # Whole words, two-word phrases and type-ahead prefixes over the seeded vocabulary
+    vocabulary = WORDS + ITEMS
+    queries = []
+    for _ in range(samples):
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append((rng.choice(vocabulary), False))
+        elif kind < 0.7:
+            queries.append((f'{rng.choice(WORDS)} {rng.choice(ITEMS)}', False))
+        else:
+            word = rng.choice(vocabulary)
+            queries.append((word[:rng.randint(2, max(2, len(word) - 1))], True))
+    return queries
+
+def _like_search(query, limit):
+    # The naive baseline: every word must appear somewhere in the name or description.
+    # With a limit it stops at the first matches, unranked; ranking them needs every match.
+    condition = Product.available.is_(True)
+    for word in query.split():
+        pattern = f'%{word}%'
+        condition = condition & (Product.name.like(pattern) | Product.description.like(pattern))
+    return db.session.scalars(select(Product.id).where(condition).limit(limit)).all()
+
+def search_latency(samples, limit, seed_value):
+    # Times the in-memory index (search.SearchIndex, built from the database) against
+    # LIKE '%word%' queries over the same products, for the same random queries
+    from search import SearchIndex
+    rng = random.Random(seed_value)
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.rebuild(db.session)
+    build_seconds = time.perf_counter() - started
+    queries = _search_queries(rng, samples)
+
+    methods = {
+        'index': lambda query, prefix: index.search(query, limit=limit, prefix=prefix),
+        'like_first_page': lambda query, prefix: _like_search(query, limit),
+        'like_all_matches': lambda query, prefix: _like_search(query, None),
+    }
+    timings = {name: [] for name in methods}
+    hits = dict.fromkeys(methods, 0)
+    for query, prefix in queries:
+        for name, method in methods.items():
+            started = time.perf_counter()
+            hits[name] += len(method(query, prefix))
+            timings[name].append(time.perf_counter() - started)
+
+    results = {name: dict(_latency_summary(values), hits_per_query=round(hits[name] / len(queries), 1))
+               for name, values in timings.items()}
+    for name, r in results.items():
+        click.echo(f"  {name:16} p50 {r['p50_ms']:8.3f} ms  p99 {r['p99_ms']:8.3f} ms  "
+                   f"{r['hits_per_query']} results per query")
+    return {'products': len(index), 'build_seconds': round(build_seconds, 2), 'queries': len(queries),
+            'limit': limit, 'methods': results}
+
+# --- Checkout latency with and without the job queue ---
+
+class SlowMailer:
+    # Stands in for a slow mail server: every message takes `delay` seconds
+    def __init__(self, delay):
+        self.delay = delay
+
+    def send(self, message, key):
+        time.sleep(self.delay)
+
+def checkout_latency(app, requests_per_mode, concurrency, handler_delay):
+    # Times the checkout flow with the post-checkout jobs run inside the request (JOBS_INLINE)
+    # and with checkout only enqueuing them, while email delivery is slow
+    import notifications
+
+    targets = _load_targets()
+    last_job_id = db.session.scalar(select(func.max(Job.id))) or 0
+    original_mailer, original_inline = notifications.mailer, app.config['JOBS_INLINE']
+    notifications.mailer = SlowMailer(handler_delay)
+    results = {}
+    try:
+        bots = _make_bots(lambda: ClientSession(app), targets, concurrency)
+        for mode, inline in (('inline', True), ('queued', False)):
+            app.config['JOBS_INLINE'] = inline
+            click.echo(f'  checkout ({mode}) ...', nl=False)
+            results[mode] = run_flow(bots, 'checkout', requests_per_mode)
+            click.echo(f" p50 {results[mode]['p50_ms']} ms, p95 {results[mode]['p95_ms']} ms")
+    finally:
+        notifications.mailer, app.config['JOBS_INLINE'] = original_mailer, original_inline
+        # Jobs queued by the bench would email bench users once a worker runs; drop them
+        db.session.execute(delete(Job).where(Job.id > last_job_id))
+        db.session.commit()
+    return {'handler_delay_s': handler_delay, 'requests': requests_per_mode,
+            'concurrency': concurrency, 'modes': results}
+
+# --- Facet counts ---
+
+def _latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3)}
+
+def facet_latency(app, synthetic, samples, seed_value):
+    # Times facet counts over random filter combinations, against the index built from the
+    # database or from `synthetic` generated products. With the database it also times the
+    # listing's own page query for the same filters (the index only counts; listings filter
+    # in SQL) and the GROUP BY the index replaces.
+    from facets import FacetIndex, CategoryFacet, PRICE_BANDS, apply_filters
+    from sqlalchemy.orm import joinedload
+    from routes import paginate_products
+    rng = random.Random(seed_value)
+    index = FacetIndex()
+    started = time.perf_counter()
+    if synthetic:
+        categories = [CategoryFacet(i, f'Category {i}', f'category-{i}') for i in range(1, 13)]
+        index.load((product_id, rng.randint(1, 12), Decimal(rng.randint(500, 30000)) / 100, rng.randint(0, 50))
+                   for product_id in range(1, synthetic + 1))
+        index.set_categories(categories)
+    else:
+        index.rebuild(db.session)
+    build_seconds = time.perf_counter() - started
+    category_ids = [None] + [c.id for c in index.categories()]
+    combos = [(rng.choice(category_ids), rng.choice([None] + [b.key for b in PRICE_BANDS]), rng.random() < 0.5)
+              for _ in range(samples)]
+
+    timings = {'counts': [], 'update_one_product': []}
+    for category_id, price, in_stock in combos:
+        started = time.perf_counter()
+        index.counts(category_id, price, in_stock)
+        timings['counts'].append(time.perf_counter() - started)
+        product_id = rng.randint(1, max(len(index), 1))
+        started = time.perf_counter()
+        index.add(product_id, rng.choice(category_ids[1:] or [None]), Decimal('42.00'), rng.randint(0, 5), True)
+        timings['update_one_product'].append(time.perf_counter() - started)
+
+    results = {name: _latency_summary(values) for name, values in timings.items()}
+    if not synthetic:
+        # The page query render_listing runs for the same filters
+        listing = []
+        for category_id, price, in_stock in combos:
+            query = Product.query.options(joinedload(Product.category)).filter_by(available=True)
+            if category_id is not None:
+                query = query.filter_by(category_id=category_id)
+            with app.test_request_context('/products'):
+                started = time.perf_counter()
+                paginate_products(apply_filters(query, price, in_stock))
+                listing.append(time.perf_counter() - started)
+        results['listing_page_query'] = _latency_summary(listing)
+        # What each listing request would cost without the index: per-facet GROUP BY queries
+        group_by = []
+        for category_id, price, in_stock in combos[:min(samples, 50)]:
+            started = time.perf_counter()
+            base = apply_filters(Product.query.filter_by(available=True), price, in_stock)
+            base.with_entities(Product.category_id, func.count()).group_by(Product.category_id).all()
+            scoped = base.filter_by(category_id=category_id) if category_id else base
+            scoped.with_entities(func.count()).scalar()
+            group_by.append(time.perf_counter() - started)
+        results['sql_group_by'] = _latency_summary(group_by)
+    for name, summary in results.items():
+        click.echo(f"  {name:20} p50 {summary['p50_ms']:8.3f} ms   p99 {summary['p99_ms']:8.3f} ms")
+    return {'products': len(index), 'build_seconds': round(build_seconds, 2), 'samples': samples,
+            'timings': results}
+
+# --- Repeat visits: validators and compression ---
+
+def _visit_paths(app, targets, pages, rng):
+    # A browsing session: home, listings, some product pages and the pages' CSS/JS
+    from flask import url_for
+    paths = ['/', '/products'] + [f'/products/category/{slug}' for slug in targets['category_slugs'][:3]]
+    paths += [f'/product/{slug}' for slug in rng.sample(targets['product_slugs'], min(pages, len(targets['product_slugs'])))]
+    with app.test_request_context():
+        paths += [url_for('static', filename='css/app.css'), url_for('static', filename='js/main.js')]
+    return paths
+
+def _fetch(client, path, headers):
+    # (response, body, CPU seconds); the response is closed, its headers still readable
+    started = time.process_time()
+    response = client.get(path, headers=headers)
+    body = response.get_data()
+    cpu = time.process_time() - started
+    response.close()
+    return response, body, cpu
+
+def _browser_state(client, paths, accept):
+    # What a browser keeps from a first visit: validators per page, and the files it
+    # may reuse without asking (immutable assets)
+    validators, cached = {}, set()
+    for path in paths:
+        response, _, _ = _fetch(client, path, accept)
+        if response.cache_control.immutable:
+            cached.add(path)
+            continue
+        validators[path] = {name: response.headers[header]
+                            for name, header in (('If-None-Match', 'ETag'), ('If-Modified-Since', 'Last-Modified'))
+                            if header in response.headers}
+    return validators, cached
+
+def repeat_visits(app, pages, rounds, seed_value):
+    # Bytes sent and server CPU per page for the same browsing session fetched three ways:
+    #   plain        no Accept-Encoding and no validators (what every visit cost before)
+    #   compressed   a first visit from a browser accepting br/gzip
+    #   repeat       a returning browser: conditional requests with the ETag/Last-Modified it
+    #                was given, and no request at all for files it may cache (immutable assets)
+    targets = _load_targets()
+    paths = _visit_paths(app, targets, pages, random.Random(seed_value))
+    bot = _make_bots(lambda: ClientSession(app), targets, 1)[0]
+    accept = {'Accept-Encoding': 'br, gzip'}
+    results = {}
+
+    def visit(visitor, client):
+        _fetch(client, '/', accept)  # shows (and so clears) the flash message left by logging in
+        validators, cached = _browser_state(client, paths, accept)  # also warms the page cache
+        for mode in ('plain', 'compressed', 'repeat'):
+            requests = not_modified = sent = 0
+            cpu = 0.0
+            for _ in range(rounds):
+                for path in paths:
+                    if mode == 'repeat' and path in cached:
+                        continue
+                    headers = {} if mode == 'plain' else dict(accept, **(validators[path] if mode == 'repeat' else {}))
+                    response, body, seconds = _fetch(client, path, headers)
+                    requests += 1
+                    not_modified += response.status_code == 304
+                    sent += len(body) + sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+                    cpu += seconds
+            visits = len(paths) * rounds
+            summary = results.setdefault(visitor, {})[mode] = {
+                'requests': requests, 'not_modified': not_modified,
+                'bytes_per_page': round(sent / visits), 'cpu_ms_per_page': round(cpu * 1000 / visits, 3)}
+            click.echo(f"  {visitor:10} {mode:11} {summary['bytes_per_page']:>8} bytes  "
+                       f"{summary['cpu_ms_per_page']:8.3f} ms CPU per page  ({requests} requests, {not_modified} x 304)")
+
+    # In a fresh thread, like the bots: requests must not share the CLI's app context (and `g`)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for visitor, session in (('anonymous', bot.guest_session), ('logged_in', bot.session)):
+            executor.submit(visit, visitor, session.client).result()
+    return {'paths': len(paths), 'rounds': rounds, 'visitors': results}
+
+# --- Sales dashboard ---
+
+def sales_dashboard(days, samples):
+    # Times the dashboard's reports from the rollup tables against the same figures
+    # aggregated from Order/OrderItem on every request, which is what the rollup replaces
+    import sales
+
+    started = time.perf_counter()
+    caught_up = sales.catch_up()
+    catch_up_seconds = time.perf_counter() - started
+    start = sales.period_start(days)
+    since = datetime.combine(start, datetime.min.time())
+
+    def from_rollups():
+        sales.daily_totals(start)
+        sales.category_totals(start)
+        sales.category_daily(start)
+        sales.top_products(start)
+
+    def from_orders():
+        day = func.date(Order.order_date)
+        revenue = func.sum(OrderItem.price * OrderItem.quantity)
+        lines = select(OrderItem.quantity).join(Order, Order.id == OrderItem.order_id) \
+            .where(Order.order_date >= since)
+        db.session.execute(select(day, func.count(func.distinct(Order.id)), func.sum(OrderItem.quantity), revenue)
+                           .select_from(Order).join(OrderItem, OrderItem.order_id == Order.id)
+                           .where(Order.order_date >= since).group_by(day)).all()
+        db.session.execute(lines.with_only_columns(day, Product.category_id, func.sum(OrderItem.quantity), revenue)
+                           .outerjoin(Product, Product.id == OrderItem.product_id)
+                           .group_by(day, Product.category_id)).all()
+        db.session.execute(lines.with_only_columns(OrderItem.product_id, func.sum(OrderItem.quantity), revenue)
+                           .group_by(OrderItem.product_id).order_by(func.sum(OrderItem.quantity).desc())
+                           .limit(10)).all()
+
+    results = {}
+    for name, method in (('rollups', from_rollups), ('raw_orders', from_orders)):
+        latencies = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            method()
+            latencies.append(time.perf_counter() - started)
+        results[name] = _latency_summary(latencies)
+        click.echo(f"  {name:20} p50 {results[name]['p50_ms']:8.3f} ms   p99 {results[name]['p99_ms']:8.3f} ms")
+    return {'orders': db.session.scalar(select(func.count(Order.id))), 'days': days, 'samples': samples,
+            'caught_up_orders': caught_up, 'catch_up_seconds': round(catch_up_seconds, 2), 'timings': results}
+
+# --- Worker startup: preloaded vs. cold workers ---
+
+WORKER_READY_RE = re.compile(r'Worker (\d+) ready in ([\d.]+) ms')
+FIRST_REQUEST_RE = re.compile(r'Worker (\d+) first request \S+ in ([\d.]+) ms')
+
+def _memory_kb(pid):
+    # RSS, PSS (shared pages divided among the processes sharing them) and private memory
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup', encoding='ascii') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                fields[name] = int(rest.split()[0])
+    return {'rss_kb': fields['Rss'], 'pss_kb': fields['Pss'],
+            'private_kb': fields['Private_Clean'] + fields['Private_Dirty']}
+
+def _median(values):
+    return round(percentile(sorted(values), 0.5), 1)
+
+def worker_startup(workers, preload, paths, warm_requests, timeout=60):
+    # Starts gunicorn (gunicorn.conf.py) with `workers` sync workers and reads the startup
+    # figures its hooks log: how long each worker took from fork to ready, and how long
+    # its first request took. Then sends `warm_requests` more requests and measures the
+    # memory of every worker.
+    port = _free_port()
+    env = dict(os.environ, WEB_PRELOAD=str(preload), WEB_THREADS='1')
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers), '--threads', '1',
+         '-b', f'127.0.0.1:{port}', '--log-level', 'info'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stderr=subprocess.PIPE, text=True)
+    ready, first_request = {}, {}
+    all_ready = threading.Event()
+
+    def read_log():
+        for line in process.stderr:
+            if match := WORKER_READY_RE.search(line):
+                ready[int(match.group(1))] = float(match.group(2))
+                if len(ready) == workers:
+                    all_ready.set()
+            elif match := FIRST_REQUEST_RE.search(line):
+                first_request[int(match.group(1))] = float(match.group(2))
+
+    reader = threading.Thread(target=read_log, daemon=True)
+    reader.start()
+    base_url = f'http://127.0.0.1:{port}'
+    fetch = lambda path: HTTPSession(base_url).request('GET', path)
+    try:
+        if not all_ready.wait(timeout):
+            raise click.ClickException(f'gunicorn did not start {workers} workers within {timeout} seconds.')
+        ready_seconds = time.monotonic() - started
+        # Waves of one request per worker until each has served its first one
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            sent = 0
+            deadline = time.monotonic() + timeout
+            while len(first_request) < workers and time.monotonic() < deadline:
+                list(executor.map(fetch, [paths[(sent + i) % len(paths)] for i in range(workers)]))
+                sent += workers
+                time.sleep(0.05)  # the hook logs after the response is sent
+            list(executor.map(fetch, [paths[(sent + i) % len(paths)] for i in range(warm_requests)]))
+        memory = {pid: _memory_kb(pid) for pid in ready}
+        master = _memory_kb(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    return {
+        'preload': preload,
+        'all_workers_ready_s': round(ready_seconds, 2),
+        'worker_ready_ms': {'median': _median(ready.values()), 'max': round(max(ready.values()), 1)},
+        'first_request_ms': {'median': _median(first_request.values()),
+                             'max': round(max(first_request.values(), default=0.0), 1)},
+        'worker_rss_kb': round(sum(m['rss_kb'] for m in memory.values()) / len(memory)),
+        'worker_pss_kb': round(sum(m['pss_kb'] for m in memory.values()) / len(memory)),
+        'worker_private_kb': round(sum(m['private_kb'] for m in memory.values()) / len(memory)),
+        # What the whole server really costs: PSS counts each shared page once overall
+        'total_pss_kb': master['pss_kb'] + sum(m['pss_kb'] for m in memory.values()),
+    }
+
+def startup(workers, warm_requests, seed_value):
+    targets = _load_targets()
+    rng = random.Random(seed_value)
+    paths = ['/products', '/search?q=shirt'] + [f'/products/category/{slug}' for slug in targets['category_slugs']]
+    paths += [f'/product/{slug}' for slug in rng.sample(targets['product_slugs'], min(50, len(targets['product_slugs'])))]
+    rng.shuffle(paths)
+    results = {}
+    for name, preload in (('cold', False), ('preload', True)):
+        click.echo(f'  {name} ...', nl=False)
+        results[name] = worker_startup(workers, preload, paths, warm_requests)
+        r = results[name]
+        click.echo(f" ready in {r['all_workers_ready_s']}s, worker {r['worker_ready_ms']['median']} ms, "
+                   f"first request {r['first_request_ms']['median']} ms (max {r['first_request_ms']['max']}), "
+                   f"RSS {r['worker_rss_kb'] // 1024} MB / PSS {r['worker_pss_kb'] // 1024} MB per worker, "
+                   f"total PSS {r['total_pss_kb'] // 1024} MB")
+    return {'workers': workers, 'warm_requests': warm_requests, 'modes': results}
+
+# --- Login flood: catalog latency while passwords are being guessed ---
+
+# gunicorn environment per mode: "unbounded" is every worker free to hash and no throttling
+# (how login worked before passwords.py), then the hashing cap alone, then the cap plus
+# throttling. The flood comes from one address, so throttling soon refuses it outright.
+FLOOD_MODES = {
+    'unbounded': lambda workers: {'PASSWORD_HASH_CONCURRENCY': str(workers), 'LOGIN_FAILURES_PER_IP': '0',
+                                  'LOGIN_FAILURES_PER_USERNAME': '0'},
+    'hash_cap': lambda workers: {'LOGIN_FAILURES_PER_IP': '0', 'LOGIN_FAILURES_PER_USERNAME': '0'},
+    'hash_cap_throttled': lambda workers: {},
+}
+
+def _timed_loop(fetch, stop, latencies, statuses, lock):
+    while not stop.is_set():
+        started = time.perf_counter()
+        status = fetch()
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+def _catalog_phase(base_url, paths, concurrency, duration, flood=None):
+    # Catalog latencies over `duration` seconds; `flood` (bots, fetch) runs alongside
+    stop, lock = threading.Event(), threading.Lock()
+    latencies, statuses, flood_latencies, flood_statuses = [], {}, [], {}
+    rng = random.Random(7)
+    catalog = lambda: HTTPSession(base_url).request('GET', rng.choice(paths))[0]
+    threads = [threading.Thread(target=_timed_loop, args=(catalog, stop, latencies, statuses, lock))
+               for _ in range(concurrency)]
+    if flood:
+        threads += [threading.Thread(target=_timed_loop, args=(fetch, stop, flood_latencies, flood_statuses, lock))
+                    for fetch in flood]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    result = {'catalog': dict(_latency_summary(latencies), requests=len(latencies))}
+    if flood:
+        result['logins'] = {'attempts_per_s': round(len(flood_latencies) / duration, 1),
+                            'p50_ms': _latency_summary(flood_latencies)['p50_ms'],
+                            'statuses': {str(k): v for k, v in sorted(flood_statuses.items())}}
+    return result
+
+def _flood_bot(base_url, usernames, rng):
+    session = HTTPSession(base_url)
+    token = _csrf_token(session)
+    return lambda: session.request('POST', '/login', {
+        'csrf_token': token, 'username': rng.choice(usernames), 'password': f'guess-{rng.random()}'})[0]
+
+# Modes expected to keep the catalog stable during a flood; "unbounded" is the reference
+# for how bad it gets without them, so it is reported but never checked
+STABLE_FLOOD_MODES = ('hash_cap', 'hash_cap_throttled')
+
+def flood_failures(results, max_slowdown):
+    # Catalog p99 under flood against the quiet p99, for the modes that should hold it steady
+    failures = []
+    for mode, result in results['modes'].items():
+        if mode not in STABLE_FLOOD_MODES:
+            continue
+        quiet, flood = result['quiet']['p99_ms'], result['flood']['p99_ms']
+        if flood > quiet * max_slowdown:
+            failures.append(f'{mode}: catalog p99 {quiet} ms quiet -> {flood} ms under flood '
+                            f'(allowed {max_slowdown}x)')
+    return failures
+
+def login_flood(workers, catalog_concurrency, flood_concurrency, duration, modes):
+    targets = _load_targets()
+    rng = random.Random(42)
+    paths = ['/products', '/search?q=shirt'] + [f'/products/category/{slug}' for slug in targets['category_slugs']]
+    paths += [f'/product/{slug}' for slug in targets['product_slugs']]
+    results = {}
+    for mode in modes:
+        process, base_url = _start_gunicorn(workers, 1, FLOOD_MODES[mode](workers))
+        try:
+            quiet = _catalog_phase(base_url, paths, catalog_concurrency, duration)
+            bots = [_flood_bot(base_url, targets['usernames'], random.Random(i)) for i in range(flood_concurrency)]
+            flooded = _catalog_phase(base_url, paths, catalog_concurrency, duration, flood=bots)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+        results[mode] = {'quiet': quiet['catalog'], 'flood': flooded['catalog'], 'logins': flooded['logins']}
+        click.echo(f"  {mode:20} catalog p99 {quiet['catalog']['p99_ms']:8.1f} ms quiet, "
+                   f"{flooded['catalog']['p99_ms']:8.1f} ms under flood (p50 {quiet['catalog']['p50_ms']:.1f} -> "
+                   f"{flooded['catalog']['p50_ms']:.1f} ms); logins {flooded['logins']['attempts_per_s']}/s "
+                   f"{flooded['logins']['statuses']}")
+    return {'workers': workers, 'catalog_concurrency': catalog_concurrency,
+            'flood_concurrency': flood_concurrency, 'duration_s': duration, 'modes': results}
+
+# --- Profiler overhead ---
+
+def _timed_round(session, paths):
+    started = time.perf_counter()
+    for path in paths:
+        session.request('GET', path)
+    return time.perf_counter() - started
+
+def profiler_overhead(app, rounds, requests_per_round, seed_value):
+    # Times the same catalog requests with the request profiler off, recording metrics, and
+    # recording metrics while sampling stacks. Each round times off and metrics back to back
+    # (in alternating order) and the overhead is the median of the per-round ratios, so
+    # drift hits both alike. Sampling runs last, as its thread keeps running once started,
+    # and is compared with the off rounds.
+    import statistics
+    import tempfile
+    from cache import NullCache
+    from profiling import request_profiler, StackSampler
+
+    targets = _load_targets()
+    rng = random.Random(seed_value)
+    paths = ['/products', '/search?q=shirt'] + [f'/products/category/{slug}' for slug in targets['category_slugs']]
+    paths += [f'/product/{slug}' for slug in targets['product_slugs'][:50]]
+    paths = rng.choices(paths, k=requests_per_round)
+    session = ClientSession(app)
+    timings = {'off': [], 'metrics': [], 'sampling': []}
+    original_enabled, original_sampler = request_profiler.enabled, request_profiler.sampler
+    try:
+        with _page_cache(NullCache()), tempfile.TemporaryDirectory() as dump_dir:
+            _in_fresh_thread(_timed_round, session, paths)  # warm up
+            for i in range(rounds):
+                for mode in (('off', 'metrics') if i % 2 == 0 else ('metrics', 'off')):
+                    request_profiler.enabled = mode != 'off'
+                    timings[mode].append(_in_fresh_thread(_timed_round, session, paths))
+            request_profiler.enabled = True
+            request_profiler.sampler = StackSampler(app.config['PROFILING_INTERVAL'],
+                                                    app.config['PROFILING_KEEP_SLOWEST'], dump_dir)
+            for _ in range(rounds):
+                timings['sampling'].append(_in_fresh_thread(_timed_round, session, paths))
+    finally:
+        request_profiler.enabled, request_profiler.sampler = original_enabled, original_sampler
+
+    results = {}
+    for mode, values in timings.items():
+        overhead = statistics.median(value / off for value, off in zip(values, timings['off'])) - 1
+        results[mode] = {'ms_per_request': round(statistics.median(values) / requests_per_round * 1000, 3),
+                         'overhead_pct': round(overhead * 100, 2)}
+        click.echo(f"  {mode:9} {results[mode]['ms_per_request']:8.3f} ms per request  "
+                   f"{results[mode]['overhead_pct']:+6.2f}%")
+    return {'rounds': rounds, 'requests_per_round': requests_per_round, 'modes': results}
+
+# --- Order history for a long-time customer ---
+
+HISTORY_USERNAME = 'bench_history'
+
+@contextmanager
+def _counting_queries():
+    count = [0]
+    def counter(*args):
+        count[0] += 1
+    event.listen(db.engine, 'before_cursor_execute', counter)
+    try:
+        yield count
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', counter)
+
+def _load_every_order(user_id):
+    # What /orders did before it was paginated: every order, then each one's items and products
+    orders = Order.query.filter_by(user_id=user_id).order_by(Order.order_date.desc()).all()
+    return sum(len(item.product.name) for order in orders for item in order.order_items)
+
+def _add_history_user(orders_count, seed_value):
+    from orders import build_summary
+    rng = random.Random(seed_value)
+    products = db.session.execute(select(Product.id, Product.name, Product.price).limit(1000)).all()
+    if not products:
+        raise click.ClickException('The database has no products. Run `flask bench seed` first.')
+    user = User(username=HISTORY_USERNAME, email=f'{HISTORY_USERNAME}@example.com',
+                password_hash=generate_password_hash(BENCH_PASSWORD))
+    db.session.add(user)
+    db.session.flush()
+    now = datetime.utcnow()
+    next_order_id = (db.session.scalar(select(func.max(Order.id))) or 0) + 1
+    for chunk in _batched(range(orders_count), 1000):
+        orders, items = [], []
+        for i in chunk:
+            lines = rng.sample(products, min(rng.randint(1, 4), len(products)))
+            quantities = [rng.randint(1, 3) for _ in lines]
+            orders.append({
+                'id': next_order_id + i, 'user_id': user.id, 'status': 'Delivered',
+                'order_date': now - timedelta(days=i // 5, seconds=rng.randint(0, 86400)),
+                'total_amount': total((line.price, quantity) for line, quantity in zip(lines, quantities)),
+                'shipping_address': '1 Bench Street, Testville, 00000',
+                'item_count': sum(quantities), 'items_summary': build_summary([line.name for line in lines]),
+            })
+            items.extend({'order_id': next_order_id + i, 'product_id': line.id, 'quantity': quantity,
+                          'price': line.price} for line, quantity in zip(lines, quantities))
+        db.session.execute(insert(Order), orders)
+        db.session.execute(insert(OrderItem), items)
+    db.session.commit()
+    return user.id
+
+def _remove_history_user():
+    user_ids = select(User.id).where(User.username == HISTORY_USERNAME)
+    order_ids = select(Order.id).where(Order.user_id.in_(user_ids))
+    db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+    db.session.execute(delete(Order).where(Order.user_id.in_(user_ids)))
+    db.session.execute(delete(CartItem).where(CartItem.user_id.in_(user_ids)))
+    db.session.execute(delete(User).where(User.username == HISTORY_USERNAME))
+    db.session.commit()
+
+def order_history(app, orders_count, samples, seed_value):
+    # A shopper with `orders_count` orders: the first and a deep page of /orders (by cursor)
+    # and an order's detail page, against loading every order with its items and products
+    # the way the page did before. The shopper and their orders are removed afterwards.
+    from pagination import encode_cursor
+    from profiling import request_profiler
+
+    _remove_history_user()  # left over from an interrupted run
+    user_id = _add_history_user(orders_count, seed_value)
+    results = {}
+    try:
+        newest_first = select(Order.order_date, Order.id).where(Order.user_id == user_id) \
+            .order_by(Order.order_date.desc(), Order.id.desc())
+        deep = db.session.execute(newest_first.offset(int(orders_count * 0.9)).limit(1)).one()
+        order_id = db.session.execute(newest_first.limit(1)).one().id
+        paths = {
+            'history_first_page': ('order_history', '/orders'),
+            'history_deep_page': ('order_history', '/orders?' + urllib.parse.urlencode(
+                {'after': encode_cursor(tuple(deep))})),
+            'order_detail': ('order_detail', f'/orders/{order_id}'),
+        }
+        session = ClientSession(app)
+        token = _in_fresh_thread(_csrf_token, session)
+        status, _ = _in_fresh_thread(session.request, 'POST', '/login', {
+            'csrf_token': token, 'username': HISTORY_USERNAME, 'password': BENCH_PASSWORD})
+        if status >= 400:
+            raise click.ClickException(f'Could not log in as {HISTORY_USERNAME} (HTTP {status}).')
+        for name, (endpoint, path) in paths.items():
+            before = _sql_totals(request_profiler).get(endpoint, (0, 0, 0))
+            results[name] = _in_fresh_thread(_time_requests, session, path, samples)
+            queries, _, served = [a - b for a, b in zip(_sql_totals(request_profiler)[endpoint], before)]
+            results[name]['sql_queries_per_request'] = round(queries / served, 2)
+
+        latencies = []
+        for _ in range(max(1, samples // 10)):
+            db.session.remove()
+            with _counting_queries() as queries:
+                started = time.perf_counter()
+                _load_every_order(user_id)
+                latencies.append(time.perf_counter() - started)
+        results['unpaginated_load'] = dict(_latency_summary(latencies), sql_queries_per_request=queries[0])
+    finally:
+        db.session.remove()
+        _remove_history_user()
+    for name, r in results.items():
+        click.echo(f"  {name:20} p50 {r['p50_ms']:9.3f} ms  p99 {r['p99_ms']:9.3f} ms  "
+                   f"{r['sql_queries_per_request']} queries")
+    return {'orders': orders_count, 'samples': samples, 'pages': results}
+
+# --- Pool load: no connection pool timeouts at the target concurrency ---
+
+def pool_load(threads, concurrency, duration):
+    # One gthread worker (so /internal/metrics sees its whole pool) with the pool sized by
+    # config.engine_options for `threads`, the page cache off so every page uses the
+    # database, and `concurrency` clients hammering the catalog for `duration` seconds
+    targets = _load_targets()
+    paths = ['/products', '/search?q=shirt'] + [f'/products/category/{slug}' for slug in targets['category_slugs']]
+    paths += [f'/product/{slug}' for slug in targets['product_slugs'][:200]]
+    process, base_url = _start_gunicorn(1, threads, {'CACHE_BACKEND': 'none'})
+    try:
+        stop, lock = threading.Event(), threading.Lock()
+        latencies, statuses = [], {}
+        rng = random.Random(7)
+        fetch = lambda: HTTPSession(base_url).request('GET', rng.choice(paths))[0]
+        clients = [threading.Thread(target=_timed_loop, args=(fetch, stop, latencies, statuses, lock))
+                   for _ in range(concurrency)]
+        for client in clients:
+            client.start()
+        time.sleep(duration)
+        stop.set()
+        for client in clients:
+            client.join()
+        status, body = HTTPSession(base_url).request('GET', '/internal/metrics')
+        if status != 200:
+            raise click.ClickException(f'/internal/metrics answered {status}')
+        pool = json.loads(body)['db_pool']
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    waits = pool['wait_seconds_count']
+    return dict(_latency_summary(latencies), threads=threads, concurrency=concurrency, duration_s=duration,
+                requests=len(latencies), throughput_rps=round(len(latencies) / duration, 1),
+                statuses={str(k): v for k, v in sorted(statuses.items())},
+                pool_timeouts=pool['timeouts_total'], pool_size=pool.get('pool_size'),
+                connections_open=pool['connections_open'],
+                pool_wait_avg_ms=round(pool['wait_seconds_sum'] / waits * 1000, 3) if waits else 0.0,
+                pool_wait_max_ms=round(pool['wait_seconds_max'] * 1000, 3))
+
+# --- Oversell: buyers racing for the last units ---
+
+OVERSELL_SLUG = 'bench-oversell'
+OVERSELL_USER_PREFIX = 'bench_buyer_'
+
+def _buyer(app, user_id, product_id, outcomes, latencies, lock):
+    # Buys one unit at a time through the checkout engine until the product is sold out
+    from orders import place_order, OutOfStockError
+    with app.app_context():
+        while True:
+            db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=1))
+            db.session.commit()
+            started = time.perf_counter()
+            try:
+                place_order(user_id, 'Bench Street 1')
+                outcome = 'ordered'
+            except OutOfStockError:
+                outcome = 'out_of_stock'
+            except Exception as e:  # a lock or pool timeout: count it and try again
+                outcome = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if outcome == 'ordered':
+                    latencies.append(elapsed)
+            if outcome == 'out_of_stock':
+                return
+
+def _oversell_round(app, product_id, user_ids, stock):
+    db.session.execute(delete(CartItem).where(CartItem.user_id.in_(user_ids)))
+    db.session.execute(update(Product).where(Product.id == product_id).values(stock=stock))
+    db.session.commit()
+    outcomes, latencies, lock = {}, [], threading.Lock()
+    threads = [threading.Thread(target=_buyer, args=(app, user_id, product_id, outcomes, latencies, lock))
+               for user_id in user_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    db.session.expire_all()
+    order_ids = select(Order.id).where(Order.user_id.in_(user_ids))
+    sold = db.session.scalar(select(func.coalesce(func.sum(OrderItem.quantity), 0))
+                             .where(OrderItem.product_id == product_id, OrderItem.order_id.in_(order_ids)))
+    remaining = db.session.scalar(select(Product.stock).where(Product.id == product_id))
+    # Each round starts from no orders, so the next one counts only its own sales
+    db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+    db.session.execute(delete(Order).where(Order.user_id.in_(user_ids)))
+    db.session.commit()
+    return dict(_latency_summary(latencies), buyers=len(user_ids), initial_stock=stock, units_sold=sold,
+                remaining_stock=remaining, outcomes=outcomes, seconds=round(elapsed, 3),
+                orders_per_s=round(outcomes.get('ordered', 0) / elapsed, 1) if elapsed else 0.0)
+
+def oversell(app, stock, buyer_counts):
+    # Sets one product's stock, lets each number of buyer threads check it out one unit at a
+    # time until it is gone, and checks the conditional reservation never oversold it
+    category_id = db.session.scalar(select(Category.id).order_by(Category.id).limit(1))
+    if category_id is None:
+        raise click.ClickException('The database has no categories. Run `flask bench seed` first.')
+    last_job_id = db.session.scalar(select(func.max(Job.id))) or 0
+    product = Product(name='Bench oversell item', slug=OVERSELL_SLUG, price=Decimal('10.00'), stock=0,
+                      category_id=category_id)
+    db.session.add(product)
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    db.session.execute(insert(User), [
+        {'username': f'{OVERSELL_USER_PREFIX}{i}', 'email': f'{OVERSELL_USER_PREFIX}{i}@example.com',
+         'password_hash': password_hash, 'is_admin': False} for i in range(max(buyer_counts))])
+    db.session.commit()
+    product_id = product.id
+    user_ids = db.session.scalars(select(User.id).where(User.username.like(f'{OVERSELL_USER_PREFIX}%'))
+                                  .order_by(User.id)).all()
+    results, failures = {}, []
+    try:
+        for buyers in buyer_counts:
+            r = results[buyers] = _oversell_round(app, product_id, user_ids[:buyers], stock)
+            click.echo(f"  {buyers:3} buyers: {r['units_sold']}/{stock} units sold, {r['remaining_stock']} left, "
+                       f"{r['orders_per_s']} orders/s, p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms {r['outcomes']}")
+            if r['remaining_stock'] < 0:
+                failures.append(f"{buyers} buyers: stock went negative ({r['remaining_stock']})")
+            if r['units_sold'] != stock:
+                failures.append(f"{buyers} buyers: sold {r['units_sold']} units of {stock}")
+    finally:
+        db.session.rollback()
+        db.session.execute(delete(CartItem).where(CartItem.user_id.in_(user_ids)))
+        order_ids = select(Order.id).where(Order.user_id.in_(user_ids))
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        db.session.execute(delete(Order).where(Order.user_id.in_(user_ids)))
+        db.session.execute(delete(Job).where(Job.id > last_job_id))
+        db.session.execute(delete(User).where(User.id.in_(user_ids)))
+        db.session.execute(delete(Product).where(Product.id == product_id))
+        bump_catalog_version([product_id])
+        db.session.commit()
+    return {'stock': stock, 'rounds': results, 'failures': failures}
+
+# --- Page weight: what a page costs the browser, development assets vs the build ---
+
+SCRIPT_TAG = re.compile(r'<script\b([^>]*)\ssrc="([^"]+)"')
+LINK_TAG = re.compile(r'<link\b[^>]*\shref="([^"]+)"')
+
+@contextmanager
+def _asset_files(files):
+    # Swaps the asset manifest, e.g. for an empty one to serve the development assets
+    from assets import asset_manifest
+    previous, asset_manifest.files = asset_manifest.files, files
+    try:
+        yield
+    finally:
+        asset_manifest.files = previous
+
+def _page_weight(app, paths, samples):
+    # Renders each page as a browser asking for compressed responses would get it, then
+    # fetches the local scripts/stylesheets it references (once each). Transfer sizes are
+    # the bytes on the wire; a repeat visit re-requests every asset not marked immutable.
+    client = app.test_client()
+    headers = {'Accept-Encoding': 'br, gzip'}
+    assets = {}
+    pages = {}
+    for path in paths:
+        latencies = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise click.ClickException(f'GET {path} answered {response.status_code}')
+        html = client.get(path).get_data(as_text=True)
+        head = html.split('</head>', 1)[0]
+        scripts = SCRIPT_TAG.findall(html)
+        urls = [src for _, src in scripts] + LINK_TAG.findall(html)
+        local = [url for url in urls if url.startswith('/') and not url.startswith('//')]
+        external = [url for url in urls if url not in local]
+        for url in local:
+            if url not in assets:
+                asset = client.get(url, headers=headers)
+                if asset.status_code != 200:
+                    raise click.ClickException(f'GET {url} answered {asset.status_code}')
+                assets[url] = (len(asset.get_data()), bool(asset.cache_control.immutable))
+        pages[path] = dict(
+            _latency_summary(latencies),
+            html_bytes=len(response.get_data()),
+            asset_bytes=sum(assets[url][0] for url in local),
+            requests=1 + len(urls),
+            repeat_requests=1 + len(external) + sum(not assets[url][1] for url in local),
+            external=external,
+            blocking_scripts=sum(1 for attributes, _ in SCRIPT_TAG.findall(head)
+                                 if 'defer' not in attributes and 'async' not in attributes),
+        )
+    return pages
+
+def page_weight(app, samples):
+    # The storefront pages with the development assets (no manifest: the in-browser Tailwind
+    # compiler from the CDN plus the unminified sources) and with the `flask assets build`
+    # output. Render time is the server's, with the page cache off; a browser's own layout
+    # and paint time is not measured here, but the blocking scripts and requests it waits on are.
+    from assets import asset_manifest
+    from cache import NullCache
+    asset_manifest.load()
+    if not asset_manifest.files:
+        raise click.ClickException('No built assets to compare with. Run `flask assets build` first.')
+    targets = _load_targets()
+    paths = ['/', '/products', f"/products/category/{targets['category_slugs'][0]}",
+             f"/product/{targets['product_slugs'][0]}"]
+    results = {}
+    with _page_cache(NullCache()):
+        for mode, files in (('development', {}), ('built', dict(asset_manifest.files))):
+            with _asset_files(files):
+                results[mode] = _in_fresh_thread(_page_weight, app, paths, samples)
+            for path, r in results[mode].items():
+                click.echo(f"  {mode:11}  {path[:40]:40}  html {r['html_bytes']:6} B  assets {r['asset_bytes']:6} B  "
+                           f"{r['requests']} requests ({r['repeat_requests']} on a repeat visit)  "
+                           f"{len(r['external'])} external  {r['blocking_scripts']} blocking scripts  "
+                           f"p50 {r['p50_ms']:7.3f} ms  p99 {r['p99_ms']:7.3f} ms")
+    return {'samples': samples, 'modes': results}
+
+# --- Recommendations: order lines counted in bounded memory ---
+
+RECOMMENDATIONS_USERNAME = 'bench_recommendations'
+
+def _add_order_lines(lines_count, seed_value):
+    # Settled orders of 1-8 lines each, for one shopper, until `lines_count` lines exist
+    rng = random.Random(seed_value)
+    products = db.session.execute(select(Product.id, Product.price).limit(10000)).all()
+    if not products:
+        raise click.ClickException('The database has no products. Run `flask bench seed` first.')
+    user = User(username=RECOMMENDATIONS_USERNAME, email=f'{RECOMMENDATIONS_USERNAME}@example.com',
+                password_hash=generate_password_hash(BENCH_PASSWORD))
+    db.session.add(user)
+    db.session.flush()
+    placed = datetime.utcnow() - timedelta(days=1)
+    order_id = (db.session.scalar(select(func.max(Order.id))) or 0) + 1
+    added = 0
+    while added < lines_count:
+        orders, items = [], []
+        while len(items) < BATCH_SIZE * 4 and added + len(items) < lines_count:
+            lines = rng.sample(products, min(rng.randint(1, 8), len(products), lines_count - added - len(items)))
+            orders.append({'id': order_id, 'user_id': user.id, 'status': 'Delivered', 'order_date': placed,
+                           'total_amount': total((line.price, 1) for line in lines),
+                           'shipping_address': '1 Bench Street, Testville, 00000'})
+            items.extend({'order_id': order_id, 'product_id': line.id, 'quantity': 1, 'price': line.price}
+                         for line in lines)
+            order_id += 1
+        db.session.execute(insert(Order), orders)
+        db.session.execute(insert(OrderItem), items)
+        db.session.commit()
+        added += len(items)
+        click.echo(f'\r  order lines: {added}', nl=False)
+    click.echo('')
+
+def _remove_order_lines():
+    user_ids = select(User.id).where(User.username == RECOMMENDATIONS_USERNAME)
+    order_ids = select(Order.id).where(Order.user_id.in_(user_ids))
+    db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+    db.session.execute(delete(Order).where(Order.user_id.in_(user_ids)))
+    db.session.execute(delete(User).where(User.username == RECOMMENDATIONS_USERNAME))
+    db.session.commit()
+
+def recommendations_memory(lines_count, seed_value):
+    # Adds `lines_count` order lines and times `process_new_orders` folding them into the pair
+    # counts, sampling this process's RSS after every chunk. Its growth after the first tenth
+    # of the chunks against its growth at the end shows whether memory grows with the number
+    # of lines or stays bounded by the chunk size. The bench orders are removed afterwards
+    # and the counts rebuilt from the remaining orders.
+    import recommendations
+
+    _remove_order_lines()  # left over from an interrupted run
+    recommendations.process_new_orders()  # existing orders are not part of the measurement
+    try:
+        _add_order_lines(lines_count, seed_value)
+        db.session.remove()
+        rss = []
+
+        def on_chunk(upper, max_id):
+            rss.append(_memory_kb(os.getpid())['rss_kb'])
+            click.echo(f'\r  orders up to #{upper} of #{max_id}', nl=False)
+
+        before = _memory_kb(os.getpid())['rss_kb']
+        started = time.perf_counter()
+        processed, touched = recommendations.process_new_orders(on_chunk=on_chunk)
+        seconds = time.perf_counter() - started
+        click.echo('')
+        early = rss[max(0, len(rss) // 10 - 1)] if rss else before
+        results = {
+            'order_lines': lines_count, 'orders': processed, 'products': len(touched),
+            'chunks': len(rss), 'orders_per_chunk': recommendations.ORDERS_PER_CHUNK,
+            'seconds': round(seconds, 1), 'lines_per_second': round(lines_count / max(seconds, 1e-9)),
+            'rss_mb_before': round(before / 1024, 1),
+            'growth_mb_first_tenth': round((early - before) / 1024, 1),
+            'growth_mb': round((max(rss, default=before) - before) / 1024, 1),
+        }
+    finally:
+        db.session.remove()
+        _remove_order_lines()
+        click.echo('  rebuilding the pair counts without the bench orders')
+        recommendations.update(rebuild=True)
+    return results
+
+def compare(results, baseline, threshold):
+    # Returns human-readable regressions against a previous results file
+    regressions = []
+    for flow, current in results['flows'].items():
+        previous = baseline.get('flows', {}).get(flow)
+        if not previous:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{flow}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{flow}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if previous.get('sql_queries_per_request') is not None and current.get('sql_queries_per_request') is not None \
+                and current['sql_queries_per_request'] > previous['sql_queries_per_request']:
+            regressions.append(f"{flow}: SQL queries per request {previous['sql_queries_per_request']} -> "
+                               f"{current['sql_queries_per_request']}")
+        if previous.get('sql_writes_per_request') is not None and current.get('sql_writes_per_request') is not None \
+                and current['sql_writes_per_request'] > previous['sql_writes_per_request']:
+            regressions.append(f"{flow}: SQL writes per request {previous['sql_writes_per_request']} -> "
+                               f"{current['sql_writes_per_request']}")
+        if current['errors'] > previous.get('errors', 0):
+            regressions.append(f"{flow}: errors {previous.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+# --- CLI ---
+
+def init_benchmark(app):
+    @app.cli.group('bench')
+    def bench():
+        """Seed synthetic data and benchmark the shop's critical flows."""
+
+    @bench.command('seed')
+    @click.option('--products', default=10000, show_default=True)
+    @click.option('--users', default=1000, show_default=True)
+    @click.option('--categories', default=12, show_default=True)
+    @click.option('--carts', default=500, show_default=True, help='Users that get a pre-filled cart.')
+    @click.option('--orders-per-user', default=2, show_default=True)
+    @click.option('--seed', 'seed_value', default=42, show_default=True, help='Random seed, for reproducible data.')
+    def seed_command(products, users, categories, carts, orders_per_user, seed_value):
+        """Fill the configured database with a synthetic catalog, users, carts and orders."""
+        db.create_all()
+        started = time.perf_counter()
+        seed(products, users, categories, carts, orders_per_user, seed_value)
+        click.echo(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+    @bench.command('run')
+    @click.option('--mode', type=click.Choice(['client', 'gunicorn']), default='client', show_default=True)
+    @click.option('--flow', 'flows', multiple=True, type=click.Choice(FLOWS), help='Defaults to every flow.')
+    @click.option('--requests', 'requests_per_flow', default=200, show_default=True)
+    @click.option('--concurrency', default=4, show_default=True)
+    @click.option('--workers', default=2, show_default=True, help='gunicorn workers (gunicorn mode).')
+    @click.option('--threads', default=1, show_default=True, help='gunicorn threads per worker (gunicorn mode).')
+    @click.option('--output', default='bench_results.json', show_default=True)
+    @click.option('--baseline', default=None, help='Previous results file to compare against.')
+    @click.option('--threshold', default=0.2, show_default=True, help='Allowed relative slowdown before flagging.')
+    def run_command(mode, flows, requests_per_flow, concurrency, workers, threads, output, baseline, threshold):
+        """Drive the critical flows and report throughput, latency percentiles and SQL per request."""
+        results = run(app, mode, list(flows) or FLOWS, requests_per_flow, concurrency, workers, threads)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        click.echo(f'Results written to {output}')
+
+        if baseline:
+            with open(baseline, encoding='utf-8') as f:
+                regressions = compare(results, json.load(f), threshold)
+            if regressions:
+                click.echo('Regressions against baseline:')
+                for line in regressions:
+                    click.echo(f'  {line}')
+                sys.exit(1)
+            click.echo('No regressions against baseline.')
+
+    @bench.command('checkout-latency')
+    @click.option('--requests', 'requests_per_mode', default=50, show_default=True)
+    @click.option('--concurrency', default=2, show_default=True)
+    @click.option('--handler-delay', default=0.5, show_default=True, help='Seconds each email takes to send.')
+    def checkout_latency_command(requests_per_mode, concurrency, handler_delay):
+        """Compare checkout latency with follow-up jobs run inline vs. queued, given a slow mailer."""
+        results = checkout_latency(app, requests_per_mode, concurrency, handler_delay)
+        inline, queued = results['modes']['inline'], results['modes']['queued']
+        if queued['p50_ms']:
+            click.echo(f"Queued checkout p50 is {inline['p50_ms'] / queued['p50_ms']:.1f}x faster than inline.")
+
+    @bench.command('facets')
+    @click.option('--synthetic', default=0, show_default=True,
+                  help='Benchmark an index of this many generated products instead of the database.')
+    @click.option('--samples', default=2000, show_default=True)
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def facets_command(synthetic, samples, seed_value):
+        """Time facet counts, the listing page query and index updates."""
+        results = facet_latency(app, synthetic, samples, seed_value)
+        click.echo(f"{results['products']} products indexed in {results['build_seconds']}s")
+
+    @bench.command('repeat-visits')
+    @click.option('--pages', default=50, show_default=True, help='Product pages in the browsing session.')
+    @click.option('--rounds', default=3, show_default=True)
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def repeat_visits_command(pages, rounds, seed_value):
+        """Compare bytes and server CPU per page for plain, compressed and revalidated visits."""
+        results = repeat_visits(app, pages, rounds, seed_value)
+        for visitor, modes in results['visitors'].items():
+            plain, repeat = modes['plain'], modes['repeat']
+            click.echo(f"{visitor}: a repeat visit sends {plain['bytes_per_page'] / max(repeat['bytes_per_page'], 1):.0f}x "
+                       f"fewer bytes and uses {plain['cpu_ms_per_page'] / max(repeat['cpu_ms_per_page'], 0.001):.1f}x "
+                       f"less server CPU than a plain one")
+
+    @bench.command('sales-dashboard')
+    @click.option('--days', default=30, show_default=True, type=click.Choice(['7', '30', '90', '365']))
+    @click.option('--samples', default=20, show_default=True)
+    def sales_dashboard_command(days, samples):
+        """Time the sales dashboard's reports from the rollups against aggregating raw orders."""
+        results = sales_dashboard(int(days), samples)
+        click.echo(f"{results['orders']} orders; {results['caught_up_orders']} rolled up first "
+                   f"in {results['catch_up_seconds']}s")
+
+    @bench.command('startup')
+    @click.option('--workers', default=4, show_default=True)
+    @click.option('--warm-requests', default=200, show_default=True, help='Requests sent before measuring memory.')
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def startup_command(workers, warm_requests, seed_value):
+        """Compare worker startup time, first-request latency and memory with and without preload."""
+        startup(workers, warm_requests, seed_value)
+
+    @bench.command('login-flood')
+    @click.option('--workers', default=4, show_default=True)
+    @click.option('--catalog-concurrency', default=2, show_default=True)
+    @click.option('--flood-concurrency', default=16, show_default=True, help='Concurrent login attempts.')
+    @click.option('--duration', default=10.0, show_default=True, help='Seconds per phase.')
+    @click.option('--mode', 'modes', multiple=True, type=click.Choice(list(FLOOD_MODES)),
+                  help='Defaults to every mode.')
+    @click.option('--max-slowdown', default=2.0, show_default=True,
+                  help='Allowed catalog p99 under flood, as a multiple of the quiet p99.')
+    def login_flood_command(workers, catalog_concurrency, flood_concurrency, duration, modes, max_slowdown):
+        """Measure catalog latency during a login flood, with and without the hashing cap and throttling."""
+        results = login_flood(workers, catalog_concurrency, flood_concurrency, duration,
+                              list(modes) or list(FLOOD_MODES))
+        failures = flood_failures(results, max_slowdown)
+        if failures:
+            click.echo('Catalog latency not stable under the flood:')
+            for line in failures:
+                click.echo(f'  {line}')
+            sys.exit(1)
+        click.echo(f'Catalog p99 stayed within {max_slowdown}x of quiet in every capped mode.')
+
+    @bench.command('cart-totals')
+    @click.option('--carts', 'limit', default=10000, show_default=True, help='How many open carts to total.')
+    def cart_totals_command(limit):
+        """Compare cart-total strategies over many open carts, for speed and exactness."""
+        cart_totals(limit)
+
+    @bench.command('oversell')
+    @click.option('--stock', default=200, show_default=True, help='Units each round starts with.')
+    @click.option('--buyers', 'buyer_counts', multiple=True, type=int, help='Concurrent buyers; defaults to 1, 8 and 32.')
+    def oversell_command(stock, buyer_counts):
+        """Race buyer threads for one product's stock; fail if it ever oversells."""
+        results = oversell(app, stock, list(buyer_counts) or [1, 8, 32])
+        if results['failures']:
+            click.echo('Oversold:')
+            for line in results['failures']:
+                click.echo(f'  {line}')
+            sys.exit(1)
+        click.echo(f'Never oversold: every round sold exactly {stock} units and stock never went below 0.')
+
+    @bench.command('catalog-scaling')
+    @click.option('--size', 'sizes', multiple=True, type=int,
+                  help='Catalog sizes to time, smallest first; defaults to 1k, 10k, 100k and 500k.')
+    @click.option('--samples', default=50, show_default=True, help='Requests per page and size.')
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def catalog_scaling_command(sizes, samples, seed_value):
+        """Grow the catalog and time the listing pages at each size (adds products to the database)."""
+        db.create_all()
+        catalog_scaling(app, list(sizes) or [1000, 10000, 100000, 500000], samples, seed_value)
+
+    @bench.command('search')
+    @click.option('--samples', default=500, show_default=True, help='Random queries to time.')
+    @click.option('--limit', default=24, show_default=True, help='Results per query.')
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def search_command(samples, limit, seed_value):
+        """Time product search on the inverted index against a LIKE '%word%' baseline."""
+        results = search_latency(samples, limit, seed_value)
+        index = results['methods']['index']
+        click.echo(f"{results['products']} products indexed in {results['build_seconds']}s; p50 relative to the "
+                   f"ranked index: " + ', '.join(
+                       f"{name} {results['methods'][name]['p50_ms'] / max(index['p50_ms'], 0.001):.2f}x"
+                       for name in ('like_first_page', 'like_all_matches')))
+
+    @bench.command('page-cache')
+    @click.option('--backend', type=click.Choice(['lru', 'sqlite']), default='lru', show_default=True)
+    @click.option('--pages', default=200, show_default=True, help='Product pages among the visited pages.')
+    @click.option('--requests', 'requests_total', default=2000, show_default=True)
+    @click.option('--concurrency', default=4, show_default=True)
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def page_cache_command(backend, pages, requests_total, concurrency, seed_value):
+        """Compare anonymous catalog browsing with the page cache off and on: hit ratio, p50/p99."""
+        results = page_cache_latency(app, backend, pages, requests_total, concurrency, seed_value)
+        off, on = results['modes']['off'], results['modes']['on']
+        click.echo(f"With the cache on, p50 is {off['p50_ms'] / max(on['p50_ms'], 0.001):.1f}x and p99 "
+                   f"{off['p99_ms'] / max(on['p99_ms'], 0.001):.1f}x lower at a {on['hit_ratio']:.0%} hit ratio.")
+
+    @bench.command('identity')
+    @click.option('--requests', 'requests_per_mode', default=1000, show_default=True)
+    @click.option('--concurrency', default=8, show_default=True)
+    def identity_command(requests_per_mode, concurrency):
+        """Compare /cart queries per request and throughput with the identity cache off and on."""
+        results = identity_lookups(app, requests_per_mode, concurrency)
+        before, after = results['modes']['before'], results['modes']['after']
+        click.echo(f"The identity cache saves {before['sql_queries_per_request'] - after['sql_queries_per_request']:.2f} "
+                   f"queries per /cart request; throughput {before['throughput_rps']} -> {after['throughput_rps']} req/s.")
+
+    @bench.command('pool-load')
+    @click.option('--threads', default=8, show_default=True, help='gunicorn threads; the pool is sized from it.')
+    @click.option('--concurrency', default=32, show_default=True, help='Concurrent clients.')
+    @click.option('--duration', default=20.0, show_default=True, help='Seconds of load.')
+    def pool_load_command(threads, concurrency, duration):
+        """Load one threaded worker and fail if any database pool checkout timed out."""
+        r = pool_load(threads, concurrency, duration)
+        click.echo(f"  {r['requests']} requests, {r['throughput_rps']} req/s, p50 {r['p50_ms']} ms, "
+                   f"p99 {r['p99_ms']} ms, statuses {r['statuses']}")
+        click.echo(f"  pool size {r['pool_size']}, {r['connections_open']} connections open, "
+                   f"checkout wait avg {r['pool_wait_avg_ms']} ms / max {r['pool_wait_max_ms']} ms, "
+                   f"{r['pool_timeouts']} timeouts")
+        server_errors = sum(count for status, count in r['statuses'].items() if status.startswith('5'))
+        if r['pool_timeouts'] or server_errors:
+            click.echo(f"Pool timeouts: {r['pool_timeouts']}, server errors: {server_errors}")
+            sys.exit(1)
+        click.echo(f'No pool timeouts with {concurrency} clients on {threads} threads.')
+
+    @bench.command('profiler-overhead')
+    @click.option('--rounds', default=20, show_default=True)
+    @click.option('--requests', 'requests_per_round', default=200, show_default=True)
+    @click.option('--max-overhead', default=5.0, show_default=True,
+                  help='Allowed cost of the always-on metrics, in percent.')
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def profiler_overhead_command(rounds, requests_per_round, max_overhead, seed_value):
+        """Measure what the request profiler costs per request, with and without stack sampling."""
+        results = profiler_overhead(app, rounds, requests_per_round, seed_value)
+        overhead = results['modes']['metrics']['overhead_pct']
+        if overhead > max_overhead:
+            click.echo(f'Profiler metrics cost {overhead}% per request (allowed {max_overhead}%).')
+            sys.exit(1)
+        click.echo(f'Profiler metrics cost {overhead}% per request, within {max_overhead}%.')
+
+    @bench.command('order-history')
+    @click.option('--orders', 'orders_count', default=5000, show_default=True, help='Orders the shopper holds.')
+    @click.option('--samples', default=50, show_default=True)
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def order_history_command(orders_count, samples, seed_value):
+        """Time order history and order detail pages for a shopper with thousands of orders."""
+        results = order_history(app, orders_count, samples, seed_value)['pages']
+        paginated, unpaginated = results['history_first_page'], results['unpaginated_load']
+        click.echo(f"The first history page is {unpaginated['p50_ms'] / max(paginated['p50_ms'], 0.001):.0f}x faster "
+                   f"at p50 than loading every order was, with {paginated['sql_queries_per_request']} queries "
+                   f"instead of {unpaginated['sql_queries_per_request']}.")
+
+    @bench.command('recommendations')
+    @click.option('--lines', 'lines_count', default=10_000_000, show_default=True, help='Order lines to count.')
+    @click.option('--max-growth-mb', default=256.0, show_default=True,
+                  help='Allowed growth of the process RSS while counting.')
+    @click.option('--seed', 'seed_value', default=42, show_default=True)
+    def recommendations_command(lines_count, max_growth_mb, seed_value):
+        """Fold millions of order lines into the pair counts and report time and memory growth."""
+        r = recommendations_memory(lines_count, seed_value)
+        click.echo(f"{r['order_lines']} order lines ({r['orders']} orders) in {r['seconds']}s, "
+                   f"{r['lines_per_second']} lines/s; RSS grew {r['growth_mb_first_tenth']} MB over the first "
+                   f"tenth of {r['chunks']} chunks and {r['growth_mb']} MB overall (from {r['rss_mb_before']} MB).")
+        if r['growth_mb'] > max_growth_mb:
+            click.echo(f"Memory grew {r['growth_mb']} MB, over the allowed {max_growth_mb} MB.")
+            sys.exit(1)
+
+    @bench.command('page-weight')
+    @click.option('--samples', default=50, show_default=True, help='Renders timed per page.')
+    def page_weight_command(samples):
+        """Compare page weight, requests and render time with the development and the built assets."""
+        modes = page_weight(app, samples)['modes']
+        before, after = modes['development']['/'], modes['built']['/']
+        click.echo(f"Home page: {before['html_bytes'] + before['asset_bytes']} -> "
+                   f"{after['html_bytes'] + after['asset_bytes']} bytes from the shop, "
+                   f"{len(before['external'])} -> {len(after['external'])} external requests, "
+                   f"{before['repeat_requests']} -> {after['repeat_requests']} requests on a repeat visit, "
+                   f"render p50 {before['p50_ms']} -> {after['p50_ms']} ms.")
+        if after['external'] or after['blocking_scripts']:
+            click.echo(f"The built page still loads {after['external']} "
+                       f"with {after['blocking_scripts']} blocking scripts.")
+            sys.exit(1)
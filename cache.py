@@ -0,0 +1,552 @@
+# fashion-shop/cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import current_app, g, request, session, make_response
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+from models import db, Product, Category, Watermark, CatalogChange
+from querybudget import not_counted
+import guest_cart
+
+# Page cache for anonymous catalog pages.
+# Rendered HTML is stored under a key built from the route, its arguments and a catalog
+# version counter. Any committed Product/Category write bumps the version, so stale
+# entries are simply never looked up again and age out of the backend.
+#
+# Other processes' writes (other gunicorn workers, `flask import-products`, the
+# recommendations cron) reach the key through the database: it also carries the catalog
+# version and the pages version (the CATALOG_CHANGED and PAGES_CHANGED watermarks), read
+# at most every SNAPSHOT_CHECK_SECONDS. With a per-process backend (lru) the products
+# whose updated_at moved since the last check, e.g. stock sold by another worker, get
+# their own pages' counters bumped as well; the sqlite backend's counters are shared.
+#
+# Per-user bits stay out of the cached HTML: pages are only cached for anonymous visitors
+# without pending flash messages, and CSRF tokens and the guest cart badge are rendered as
+# placeholders that are swapped for the visitor's own values on the way out (hit or miss).
+#
+# Cached pages also answer conditional requests. Each page has a last-modified time: the
+# newest Product.updated_at among the products it shows, or the catalog change time kept in
+# the database by bump_catalog_version(), whichever is later. Its ETag hashes that time with
+# the URL and the visitor's own parts of the page (login, cart badge, CSRF token), so a
+# returning browser gets a 304 without the template being rendered, from any worker.
+# For anonymous visitors the time is stored with the cached HTML, so neither a hit nor a
+# 304 runs a query.
+
+CSRF_PLACEHOLDER = '__CSRF_TOKEN_PLACEHOLDER__'
+# Watermark holding the catalog version: the unix time of the last catalog change
+CATALOG_CHANGED = 'catalog_changed'
+# Watermark moved when cached pages must go although the catalog did not change (pages_changed)
+PAGES_CHANGED = 'pages_changed'
+# How far back each check re-reads Product.updated_at, for transactions that committed late
+PRODUCT_CHANGES_SLACK = timedelta(seconds=30)
+# More changed products than this in one check drops every cached page instead
+MAX_PRODUCT_CHANGES = 1000
+# Seconds of catalog versions whose changed products are kept (CatalogChange)
+CATALOG_CHANGES_KEEP = 7 * 24 * 3600
+
+class NullCache:
+    # Used when caching is disabled; every lookup misses
+    shared_versions = False  # whether incr_version() is seen by other processes
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def get_version(self, name):
+        return self._versions.get(name, 0)
+
+    def incr_version(self, name):
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+class LRUCache(NullCache):
+    # In-process, size-bounded LRU with a per-entry TTL. Each worker process has its own.
+    def __init__(self, max_entries=1024, ttl=300):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr_version(self, name):
+        with self._lock:
+            super().incr_version(name)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        stats = super().stats()
+        stats['entries'] = len(self._data)
+        return stats
+
+class SQLiteCache(NullCache):
+    # Local key-value file shared by every worker on the host, so one worker's render
+    # (and one worker's version bump) is seen by all of them.
+    PRUNE_EVERY = 200
+    shared_versions = True
+
+    def __init__(self, path, max_entries=10000, ttl=300):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_version (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def _connect(self):
+        # One connection per thread, and a new one in a forked worker (an SQLite
+        # connection must not be used by two processes)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                     (key, value, time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def get_version(self, name):
+        row = self._connect().execute('SELECT value FROM cache_version WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def incr_version(self, name):
+        self._connect().execute(
+            'INSERT INTO cache_version (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+    def stats(self):
+        stats = super().stats()
+        stats['entries'] = self._connect().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return stats
+
+# Replaced by init_cache() with the backend chosen in the config
+page_cache = NullCache()
+
+def make_cache(app):
+    backend = app.config.get('CACHE_BACKEND', 'lru')
+    ttl = app.config.get('CACHE_TTL', 300)
+    max_entries = app.config.get('CACHE_MAX_ENTRIES', 1024)
+    if backend == 'lru':
+        return LRUCache(max_entries=max_entries, ttl=ttl)
+    if backend == 'sqlite':
+        return SQLiteCache(app.config['CACHE_SQLITE_PATH'], max_entries=max_entries, ttl=ttl)
+    return NullCache()
+
+def csrf_placeholder():
+    # Template helper: a CSRF hidden input whose value is filled in per request
+    return Markup(f'<input id="csrf_token" name="csrf_token" type="hidden" value="{CSRF_PLACEHOLDER}">')
+
+def _fill_placeholders(html):
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, generate_csrf())
+    if guest_cart.CART_COUNT_PLACEHOLDER in html:
+        html = html.replace(guest_cart.CART_COUNT_PLACEHOLDER, str(guest_cart.count()))
+    return html
+
+def _cacheable_request():
+    return (request.method == 'GET'
+            and not current_user.is_authenticated
+            and not session.get('_flashes'))
+
+def product_page(slug):
+    # Version name of one product's own page (see product_pages_changed)
+    return f'product:{slug}'
+
+class SharedVersions:
+    # What other processes changed, as of the last check: (catalog version, pages version),
+    # checked at most every check_seconds. Writes in this process update it as they commit.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.check_seconds = 5.0
+        self.checked_at = 0.0
+        self.versions = (0, 0)
+        self.products_since = None  # newest Product.updated_at seen (per-process backends only)
+        self._seen = set()  # (id, updated_at) already handled within the slack window
+
+    def get(self):
+        if time.monotonic() - self.checked_at >= self.check_seconds:
+            with self._lock, not_counted():
+                if time.monotonic() - self.checked_at >= self.check_seconds:
+                    self._check()
+                    self.checked_at = time.monotonic()
+        return self.versions
+
+    def committed(self, catalog=None, pages=None):
+        # The versions a transaction in this process just committed
+        self.versions = (max(self.versions[0], catalog or 0), max(self.versions[1], pages or 0))
+
+    def _check(self):
+        values = dict(db.session.execute(select(Watermark.name, Watermark.value)
+                                          .where(Watermark.name.in_((CATALOG_CHANGED, PAGES_CHANGED)))).all())
+        self.committed(values.get(CATALOG_CHANGED), values.get(PAGES_CHANGED))
+        if not page_cache.shared_versions:
+            self._check_products()
+
+    def _check_products(self):
+        first = self.products_since is None
+        if first:
+            # Nothing is cached yet: only the starting point and what is already seen are needed
+            self.products_since = db.session.scalar(select(func.max(Product.updated_at))) or datetime(1970, 1, 1)
+        rows = db.session.execute(
+            select(Product.id, Product.slug, Product.updated_at)
+            .where(Product.updated_at > self.products_since - PRODUCT_CHANGES_SLACK)
+            .limit(MAX_PRODUCT_CHANGES + 1)).all()
+        seen = {(row.id, row.updated_at) for row in rows}
+        if first:
+            pass
+        elif len(rows) > MAX_PRODUCT_CHANGES:
+            page_cache.incr_version('catalog')
+        else:
+            for row in rows:
+                if (row.id, row.updated_at) not in self._seen:
+                    page_cache.incr_version(product_page(row.slug))
+        self._seen = seen
+        self.products_since = max((row.updated_at for row in rows), default=self.products_since)
+
+# One per process
+shared_versions = SharedVersions()
+
+def page_key(namespace, versions=()):
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    view_args = '&'.join(f'{k}={v}' for k, v in sorted((request.view_args or {}).items()))
+    version = '.'.join(str(v) for v in shared_versions.get())
+    version += ''.join(f'.{page_cache.get_version(name)}' for name in (namespace, *versions))
+    return f'page:{version}:{request.endpoint}:{view_args}?{args}'
+
+# --- Conditional requests ---
+
+def catalog_last_modified(products=None):
+    # When the catalog data behind a page last changed: the newest updated_at of `products`
+    # (a select of Product ids; None for the whole catalog), the catalog change time or the
+    # pages change time. None when `products` matches nothing, e.g. an unknown slug.
+    products_changed = select(func.max(Product.updated_at))
+    if products is not None:
+        products_changed = products_changed.where(Product.id.in_(products))
+    updated_at, changed = db.session.execute(select(
+        products_changed.scalar_subquery(),
+        select(func.max(Watermark.value))
+        .where(Watermark.name.in_((CATALOG_CHANGED, PAGES_CHANGED))).scalar_subquery(),
+    )).one()
+    if updated_at is None and products is not None:
+        return None
+    changed_at = datetime.fromtimestamp(changed, timezone.utc).replace(tzinfo=None) if changed else None
+    return max(filter(None, (updated_at, changed_at)), default=datetime(1970, 1, 1))
+
+def _csrf_epoch():
+    # Changes every half token lifetime, so a page revalidated with a 304 never carries an expired token
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    return int(time.time() // (limit / 2)) if limit else 0
+
+def _visitor_tag():
+    who = f'user:{current_user.id}' if current_user.is_authenticated else 'anon'
+    return f"{who}:{guest_cart.visitor_cart_count()}:{session.get('csrf_token', '')}:{_csrf_epoch()}"
+
+def page_etag(modified):
+    url = request.full_path
+    return hashlib.sha1(f'{url}|{modified.isoformat()}|{_visitor_tag()}'.encode()).hexdigest()[:24]
+
+def _not_modified(modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(page_etag(modified))
+    # A date alone says nothing about the visitor's cart or CSRF token, so it is only
+    # trusted from clients without a session (crawlers)
+    since = request.if_modified_since
+    return (since is not None and not session
+            and modified.replace(microsecond=0, tzinfo=timezone.utc) <= since)
+
+def _set_validators(response, modified):
+    response.set_etag(page_etag(modified), weak=True)
+    response.last_modified = modified.replace(tzinfo=timezone.utc)
+    # Per-visitor HTML: browsers may keep it but must revalidate, shared caches must not store it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+def _not_modified_response(modified):
+    return _set_validators(current_app.response_class(status=304), modified)
+
+def _read_entry(entry):
+    # Entries are "<last-modified or empty>\n<html>"; anything else (an entry written before
+    # pages carried validators) counts as a miss
+    if entry is None:
+        return None
+    stamp, _, html = entry.partition('\n')
+    try:
+        return (datetime.fromisoformat(stamp) if stamp else None), html
+    except ValueError:
+        return None
+
+def cached_page(namespace='catalog', last_modified=None, versions=None):
+    # View decorator: serve anonymous GETs from the page cache, keyed on route + arguments,
+    # and answer conditional GETs with 304. `last_modified(**view_args)` returns the page's
+    # last-modified time (usually via catalog_last_modified()); None skips validation.
+    # `versions(**view_args)` names more version counters the page depends on besides the
+    # namespace's, e.g. product_page(slug) for what only changes one product's page.
+    def decorator(view):
+        def modified_at(kwargs):
+            return last_modified(**kwargs) if last_modified is not None else None
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _cacheable_request():
+                modified = None
+                if request.method == 'GET' and not session.get('_flashes'):
+                    modified = modified_at(kwargs)
+                    if modified is not None and _not_modified(modified):
+                        return _not_modified_response(modified)
+                response = make_response(view(*args, **kwargs))
+                if response.mimetype == 'text/html' and not response.direct_passthrough:
+                    response.set_data(_fill_placeholders(response.get_data(as_text=True)))
+                    if modified is not None and response.status_code == 200:
+                        _set_validators(response, modified)
+                return response
+
+            key = page_key(namespace, versions(**kwargs) if versions is not None else ())
+            entry = _read_entry(page_cache.get(key))
+            hit = entry is not None
+            if hit:
+                modified, html = entry
+                if modified is not None and _not_modified(modified):
+                    return _not_modified_response(modified)
+            else:
+                modified = modified_at(kwargs)
+                if modified is not None and _not_modified(modified):
+                    return _not_modified_response(modified)
+                g._page_cacheable = True
+                response = make_response(view(*args, **kwargs))
+                # Only plain 200 HTML pages are stored; redirects and errors pass straight through
+                if response.status_code != 200 or response.mimetype != 'text/html':
+                    return response
+                html = response.get_data(as_text=True)
+                page_cache.set(key, f"{modified.isoformat() if modified else ''}\n{html}")
+            response = make_response(_fill_placeholders(html))
+            response.headers['X-Page-Cache'] = 'HIT' if hit else 'MISS'
+            if modified is not None:
+                _set_validators(response, modified)
+            return response
+        return wrapper
+    return decorator
+
+# --- Invalidation ---
+# Product/Category writes are noted on flush and the version is bumped after commit,
+# so a rolled-back write does not throw the cache away.
+#
+# Every catalog write also moves the catalog version kept in the database (the
+# CATALOG_CHANGED watermark), in the writing transaction. That is how other processes find
+# out: the catalog snapshot and the search and facet indexes compare it with the version
+# they were built from (see catalog_changes()). The version is the change time in unix
+# seconds, or one more than the previous version if that is not later, so two changes in
+# the same second still get different versions. The products each version changed are
+# logged (CatalogChange), so the indexes of other processes re-read only those rows
+# (catalog_changes_since()).
+
+def catalog_version():
+    return db.session.scalar(select(Watermark.value).where(Watermark.name == CATALOG_CHANGED)) or 0
+
+def move_version(session, name):
+    # Moves the watermark `name` in the session's transaction, e.g. for other per-process
+    # caches that other processes must drop (identity.py). Returns (before, after). The row
+    # stays locked until the transaction ends, so concurrent writers take turns and each
+    # one gets its own version.
+    connection = session.connection()
+    table = Watermark.__table__
+    before = connection.scalar(select(table.c.value).where(table.c.name == name).with_for_update())
+    after = max(int(time.time()), (before or 0) + 1)
+    if before is None:
+        connection.execute(insert(table).values(name=name, value=after))
+    else:
+        connection.execute(update(table).where(table.c.name == name).values(value=after))
+    return before or 0, after
+
+def _move_catalog_version(session):
+    # Once per transaction
+    if 'catalog_version' not in session.info:
+        session.info['catalog_version'] = move_version(session, CATALOG_CHANGED)
+        changes = CatalogChange.__table__
+        session.connection().execute(delete(changes).where(
+            changes.c.version < session.info['catalog_version'][1] - CATALOG_CHANGES_KEEP))
+
+def _log_catalog_rows(session, product_ids):
+    # Records the products this transaction's catalog version changed; None: any may have
+    logged = session.info.setdefault('catalog_logged', set())
+    new = {None} if product_ids is None else set(product_ids)
+    new -= logged
+    if new:
+        version = session.info['catalog_version'][1]
+        session.connection().execute(insert(CatalogChange.__table__),
+                                     [{'version': version, 'product_id': product_id} for product_id in new])
+        logged.update(new)
+
+def catalog_changes_since(version, limit):
+    # For per-process catalog data current at `version`: (the current version, ids of the
+    # products changed since), or (the current version, None) if any product may have
+    # changed or more than `limit` did, i.e. it is time to rebuild
+    current = catalog_version()
+    if current == version:
+        return current, set()
+    if version < current - CATALOG_CHANGES_KEEP:
+        return current, None  # older than the log goes back
+    product_ids = set(db.session.scalars(
+        select(CatalogChange.product_id).where(CatalogChange.version > version).distinct().limit(limit + 1)))
+    if None in product_ids or len(product_ids) > limit:
+        return current, None
+    return current, product_ids
+
+def catalog_changes(session):
+    # For the after_commit hooks of per-process catalog data: None if the transaction just
+    # committed left the catalog alone, else (version before, version after, product ids
+    # written by bulk statements, or None if those may have touched any product)
+    versions = session.info.get('catalog_version')
+    if versions is None:
+        return None
+    rows = None if session.info.get('catalog_rewritten') else session.info.get('catalog_rows', set())
+    return versions + (rows,)
+
+def _note_catalog_writes(session, flush_context):
+    written = [obj for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+               if isinstance(obj, (Product, Category))]
+    if written:
+        session.info['catalog_dirty'] = True
+        _move_catalog_version(session)
+        _log_catalog_rows(session, [obj.id for obj in written if isinstance(obj, Product)])
+
+def _bump_catalog_version(session):
+    if session.info.pop('catalog_dirty', False):
+        page_cache.incr_version('catalog')
+    for slug in session.info.pop('product_pages', ()):
+        page_cache.incr_version(product_page(slug))
+    catalog, pages = session.info.get('catalog_version'), session.info.get('pages_version')
+    if catalog or pages:
+        shared_versions.committed(catalog and catalog[1], pages and pages[1])
+
+def _forget_catalog_writes(session, previous_transaction):
+    session.info.pop('catalog_dirty', None)
+    session.info.pop('product_pages', None)
+
+def product_pages_changed(slugs):
+    # For bulk writes that only change what the products' own pages show, e.g. the stock
+    # count after a sale: their cached pages are dropped once the transaction commits
+    db.session.info.setdefault('product_pages', set()).update(slugs)
+
+def pages_changed():
+    # For writes that change what cached pages show but not the catalog the indexes and the
+    # snapshot hold, e.g. recommendations: moves the pages version in the caller's
+    # transaction, which the caller then commits, and every process drops its cached pages
+    session = db.session
+    if 'pages_version' not in session.info:
+        session.info['pages_version'] = move_version(session, PAGES_CHANGED)
+    session.info['catalog_dirty'] = True
+
+def _end_catalog_transaction(session, transaction):
+    if transaction.parent is None:
+        for key in ('catalog_version', 'pages_version', 'catalog_rows', 'catalog_rewritten', 'catalog_logged'):
+            session.info.pop(key, None)
+
+def bump_catalog_version(product_ids=None):
+    # For writes that bypass the ORM unit of work (bulk UPDATE/INSERT statements) or change
+    # what pages show without touching Product rows (categories; recommendations, which no
+    # index holds, use pages_changed()). Moves the catalog version in the caller's
+    # transaction, which the caller then commits.
+    # `product_ids`: the only products the bulk statements changed, if known, so that the
+    # processes' indexes re-read those rows instead of rebuilding.
+    session = db.session
+    _move_catalog_version(session)
+    session.info['catalog_dirty'] = True
+    if product_ids is None:
+        session.info['catalog_rewritten'] = True
+    else:
+        product_ids = set(product_ids)
+        session.info.setdefault('catalog_rows', set()).update(product_ids)
+    _log_catalog_rows(session, product_ids)
+
+def init_cache(app):
+    global page_cache
+    page_cache = make_cache(app)
+    shared_versions.check_seconds = app.config.get('SNAPSHOT_CHECK_SECONDS', 5.0)
+    app.jinja_env.globals.update(csrf_placeholder=csrf_placeholder)
+    event.listen(Session, 'after_flush', _note_catalog_writes)
+    event.listen(Session, 'after_commit', _bump_catalog_version)
+    event.listen(Session, 'after_soft_rollback', _forget_catalog_writes)
+    event.listen(Session, 'after_transaction_end', _end_catalog_transaction)
@@ -0,0 +1,158 @@
+# fashion-shop/carts.py
+
+from flask_login import current_user
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from models import db, Product, CartItem
+from money import as_json, line_total, to_money, total, totals_by_group, ZERO
+import guest_cart
+
+# Cart operations shared by the form routes and the JSON API (/api/cart).
+# Logged-in shoppers' lines are CartItem rows; visitors' lines live in the session
+# (guest_cart.py) and are addressed by product id. Every operation raises CartError
+# with a user-facing message instead of flashing, so each caller can report it its own way.
+
+class CartError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _get_product(product_id):
+    product = db.session.get(Product, product_id)
+    if not product:
+        raise CartError('Product not found.', 404)
+    return product
+
+def add_item(product_id, quantity):
+    # Adds `quantity` of the product and returns the updated line (see line_json)
+    if quantity <= 0:
+        raise CartError('Quantity must be positive.')
+    product = _get_product(product_id)
+    if not product.available:
+        raise CartError('Product not available.', 409)
+    if product.stock < quantity:
+        raise CartError(f'Not enough stock for {product.name}. Available: {product.stock}.', 409)
+
+    if not current_user.is_authenticated:
+        in_cart = guest_cart.quantity_of(product_id)
+        if product.stock < (in_cart + quantity):
+            raise CartError(f'Adding more would exceed stock. Max available: {product.stock - in_cart}', 409)
+        if not guest_cart.set_quantity(product_id, in_cart + quantity):
+            raise CartError(f'Your cart is full ({guest_cart.MAX_LINES} items). Log in to add more.', 409)
+        return line_json(guest_cart.GuestCartItem(product, in_cart + quantity))
+
+    cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
+    if cart_item:
+        if product.stock < (cart_item.quantity + quantity):
+            raise CartError(f'Adding more would exceed stock. Max available: {product.stock - cart_item.quantity}', 409)
+        cart_item.quantity += quantity
+    else:
+        cart_item = CartItem(user_id=current_user.id, product_id=product_id, quantity=quantity, product=product)
+        db.session.add(cart_item)
+    return _save(cart_item, 'Failed to add item to cart due to a database error.')
+
+def update_item(item_id, quantity):
+    # Sets the quantity of one cart line and returns the updated line
+    if quantity <= 0:
+        raise CartError('Quantity must be positive.')
+
+    if not current_user.is_authenticated:
+        if not guest_cart.quantity_of(item_id):
+            raise CartError('Cart item not found.', 404)
+        product = db.session.get(Product, item_id)
+        if not product:
+            guest_cart.remove(item_id)
+            raise CartError('Cart item not found.', 404)
+        if not product.available:
+            raise CartError('Product not available.', 409)
+        if product.stock < quantity:
+            raise CartError(f'Not enough stock for {product.name}. Max available: {product.stock}', 409)
+        guest_cart.set_quantity(item_id, quantity)
+        return line_json(guest_cart.GuestCartItem(product, quantity))
+
+    cart_item = CartItem.query.options(joinedload(CartItem.product)) \
+        .filter_by(id=item_id, user_id=current_user.id).first()
+    if not cart_item:
+        raise CartError('Cart item not found.', 404)
+    if not cart_item.product.available:
+        raise CartError('Product not available.', 409)
+    if cart_item.product.stock < quantity:
+        raise CartError(f'Not enough stock for {cart_item.product.name}. Max available: {cart_item.product.stock}', 409)
+    cart_item.quantity = quantity
+    return _save(cart_item, 'Failed to update cart due to a database error.')
+
+def remove_item(item_id):
+    if not current_user.is_authenticated:
+        guest_cart.remove(item_id)
+        return
+
+    cart_item = CartItem.query.filter_by(id=item_id, user_id=current_user.id).first()
+    if not cart_item:
+        raise CartError('Cart item not found.', 404)
+    db.session.delete(cart_item)
+    _commit('Failed to remove item from cart due to a database error.')
+
+def _commit(message):
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise CartError(message, 500)
+    guest_cart.forget_user_count()
+
+def _save(cart_item, message):
+    # The line is read from the flushed row before committing, since commit expires it
+    try:
+        db.session.flush()
+        line = line_json(cart_item)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise CartError(message, 500)
+    guest_cart.forget_user_count()
+    return line
+
+def load_items():
+    # Every cart line with its product, in one query
+    if not current_user.is_authenticated:
+        return guest_cart.load_items()
+    items = CartItem.query.options(joinedload(CartItem.product)).filter_by(user_id=current_user.id).all()
+    guest_cart.remember_user_count(len(items))
+    return items
+
+def summary(items=None):
+    # (line count, Decimal total) for the badge and order summary: one SUM(price * quantity)
+    # query for a logged-in cart, one batched Product lookup for a guest cart (none if its
+    # lines are passed in, already loaded by the page)
+    if not current_user.is_authenticated:
+        items = guest_cart.load_items() if items is None else items
+        return len(items), total((item.product.price, item.quantity) for item in items)
+    count, amount = db.session.execute(
+        select(func.count(CartItem.id), func.sum(Product.price * CartItem.quantity))
+        .join(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == current_user.id)
+    ).one()
+    guest_cart.remember_user_count(count)
+    return count, to_money(amount) if amount is not None else ZERO
+
+def all_cart_totals(price_overrides=None):
+    # {user_id: Decimal total} for every open cart, for batch recomputation after price
+    # changes. price_overrides ({product_id: price}) previews prices not yet saved.
+    rows = db.session.execute(
+        select(CartItem.user_id, CartItem.product_id, CartItem.quantity, Product.price)
+        .join(Product, Product.id == CartItem.product_id)
+    ).all()
+    overrides = price_overrides or {}
+    return totals_by_group([row.user_id for row in rows],
+                           [overrides.get(row.product_id, row.price) for row in rows],
+                           [row.quantity for row in rows])
+
+def line_json(item):
+    return {
+        'id': item.id,
+        'product_id': item.product_id,
+        'name': item.product.name,
+        'price': as_json(item.product.price),
+        'quantity': item.quantity,
+        'line_total': as_json(line_total(item.product.price, item.quantity)),
+    }
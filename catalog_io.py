@@ -0,0 +1,243 @@
+# fashion-shop/catalog_io.py
+
+import csv
+import io
+import json
+import time
+import click
+from sqlalchemy import insert, select, update
+from models import db, Product, Category
+from money import CENT, to_money
+from cache import bump_catalog_version
+
+# Streaming bulk import/export of the product catalog (CSV or JSON Lines).
+# Rows flow through a generator pipeline (parse -> validate -> batch -> upsert), so memory
+# stays flat however large the file or the catalog is: each batch looks up its own slugs
+# with one IN query, and categories come from a map loaded once per import.
+# Updates only set the columns the feed has, so a feed of prices and stock levels leaves
+# descriptions and images alone. A slug repeated within a batch is rejected; one repeated
+# in a later batch updates the product the earlier row wrote (the last row wins).
+
+FIELDS = ['slug', 'name', 'description', 'price', 'stock', 'category', 'image_filename', 'available']
+# Column values for new products whose feed leaves the column out
+INSERT_DEFAULTS = {'description': None, 'stock': 0, 'category_id': None, 'image_filename': None, 'available': True}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+class RowError(Exception):
+    pass
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+# --- Parsing ---
+
+def parse_rows(stream, fmt):
+    # Yields (line_number, dict) pairs from a text stream
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, RowError(f'invalid JSON: {e}')
+                continue
+            yield line_number, row if isinstance(row, dict) else RowError('each line must be a JSON object')
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise RowError(f'available must be true/false, got {value!r}')
+
+def validate_row(row, category_ids):
+    # Returns the Product column values for one input row, or raises RowError.
+    # Optional columns the row does not have are left out (see INSERT_DEFAULTS).
+    if isinstance(row, RowError):
+        raise row
+    name = str(row.get('name') or '').strip()
+    slug = str(row.get('slug') or '').strip()
+    if not name or len(name) > 200:
+        raise RowError('name is required (max 200 characters)')
+    if not slug or len(slug) > 200:
+        raise RowError('slug is required (max 200 characters)')
+    try:
+        price = to_money(row.get('price'))
+    except ValueError:
+        raise RowError(f"price must be a number, got {row.get('price')!r}")
+    if price is None:
+        raise RowError('price is required')
+    if price < CENT:
+        raise RowError('price must be at least 0.01')
+    values = {'slug': slug, 'name': name, 'price': price}
+
+    if 'description' in row:
+        values['description'] = row['description'] or None
+    if 'stock' in row:
+        try:
+            values['stock'] = int(row['stock'] or 0)
+        except (TypeError, ValueError):
+            raise RowError(f"stock must be an integer, got {row['stock']!r}")
+        if values['stock'] < 0:
+            raise RowError('stock cannot be negative')
+    if 'category' in row:
+        category_slug = str(row['category'] or '').strip()
+        values['category_id'] = None
+        if category_slug:
+            values['category_id'] = category_ids.get(category_slug)
+            if values['category_id'] is None:
+                raise RowError(f'unknown category {category_slug!r}')
+    if 'image_filename' in row:
+        values['image_filename'] = row['image_filename'] or None
+    if 'available' in row:
+        available = row['available']
+        values['available'] = True if available in (None, '') else _to_bool(available)
+    return values
+
+# --- Import ---
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    @property
+    def processed(self):
+        return self.inserted + self.updated + self.errors
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.started
+        return self.processed / elapsed if elapsed else 0.0
+
+def import_products(stream, fmt, batch_size=2000, on_error=None, on_batch=None):
+    # Upserts products by slug. on_error(line_number, message, row) is called for every
+    # rejected row and on_batch(report) after each committed batch.
+    report = ImportReport()
+    category_ids = dict(db.session.execute(select(Category.slug, Category.id)).all())
+    batch = {}  # slug -> column values, in file order
+
+    def flush(last=False):
+        existing = dict(db.session.execute(
+            select(Product.slug, Product.id).where(Product.slug.in_(batch))).all()) if batch else {}
+        inserts = [dict(INSERT_DEFAULTS, **values) for slug, values in batch.items() if slug not in existing]
+        updates = [dict(values, id=existing[slug]) for slug, values in batch.items() if slug in existing]
+        if inserts:
+            db.session.execute(insert(Product), inserts)
+        if updates:
+            db.session.execute(update(Product), updates)
+        if last:
+            # Bulk statements skip the ORM flush hooks, so the catalog version is moved by
+            # hand, once, with the last batch: other processes catch up on the whole import
+            bump_catalog_version()
+        db.session.commit()
+        report.inserted += len(inserts)
+        report.updated += len(updates)
+        batch.clear()
+        if on_batch:
+            on_batch(report)
+
+    for line_number, row in parse_rows(stream, fmt):
+        try:
+            values = validate_row(row, category_ids)
+            if values['slug'] in batch:
+                raise RowError(f"duplicate slug {values['slug']!r} earlier in the file")
+        except RowError as e:
+            report.errors += 1
+            if on_error:
+                on_error(line_number, str(e), row if isinstance(row, dict) else None)
+            continue
+        batch[values['slug']] = values
+        if len(batch) >= batch_size:
+            flush()
+
+    flush(last=True)
+    return report
+
+# --- Export ---
+
+def export_products(fmt, batch_size=1000):
+    # Yields the catalog as CSV or JSONL text chunks, streamed from the database
+    rows = db.session.execute(
+        select(Product.slug, Product.name, Product.description, Product.price, Product.stock,
+               Category.slug.label('category'), Product.image_filename, Product.available)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .order_by(Product.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow(['' if value is None else value for value in row])
+            if count % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        chunk = []
+        for row in rows:
+            # Decimal prices are written as strings so they stay exact
+            chunk.append(json.dumps(dict(zip(FIELDS, row)), default=str))
+            if len(chunk) == batch_size:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+# --- CLI ---
+
+def init_catalog_io(app):
+    @app.cli.command('import-products')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+                  help='Defaults to the file extension.')
+    @click.option('--batch-size', default=2000, show_default=True)
+    @click.option('--errors', 'errors_path', default=None,
+                  help='Where to write rejected rows (CSV). Defaults to <path>.errors.csv')
+    def import_products_command(path, fmt, batch_size, errors_path):
+        """Stream a CSV/JSONL product feed into the catalog, upserting by slug."""
+        fmt = fmt or detect_format(path)
+        errors_path = errors_path or f'{path}.errors.csv'
+        with open(path, newline='', encoding='utf-8') as source, \
+                open(errors_path, 'w', newline='', encoding='utf-8') as error_file:
+            error_writer = csv.writer(error_file)
+            error_writer.writerow(['line', 'error', 'row'])
+
+            def on_error(line_number, message, row):
+                error_writer.writerow([line_number, message, json.dumps(row) if row else ''])
+
+            def on_batch(report):
+                click.echo(f'\r  {report.processed} rows ({report.inserted} new, {report.updated} updated, '
+                           f'{report.errors} rejected) {report.rows_per_second:.0f} rows/s', nl=False)
+
+            report = import_products(source, fmt, batch_size, on_error, on_batch)
+        click.echo('')
+        if report.errors:
+            click.echo(f'{report.errors} rows rejected, see {errors_path}')
+
+    @app.cli.command('export-products')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+                  help='Defaults to the file extension.')
+    def export_products_command(path, fmt):
+        """Stream the whole catalog to a CSV/JSONL file."""
+        fmt = fmt or detect_format(path)
+        with open(path, 'w', newline='', encoding='utf-8') as target:
+            for chunk in export_products(fmt):
+                target.write(chunk)
+        click.echo(f'Catalog exported to {path}')
@@ -0,0 +1,120 @@
+# fashion-shop/compression.py
+
+import gzip
+import mimetypes
+import os
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it responses are gzip-compressed only
+    brotli = None
+
+# Response compression.
+# Dynamic responses (HTML, JSON, CSS/JS, CSV) are compressed with brotli or gzip, whichever
+# the client prefers of those available, once they are big enough for it to pay off.
+# Static files with a precompressed variant beside them (app.<hash>.css.br / .gz, written
+# by `flask assets build`) are served from that variant instead, so they cost no CPU per
+# request. Images are already compressed and are sent as they are.
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml',
+}
+# Content-Encoding -> file suffix of the precompressed variant
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def encodings():
+    # Supported encodings, preferred first
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def choose_encoding():
+    # The best encoding the client accepts, or None (no Accept-Encoding means identity only)
+    return request.accept_encodings.best_match(encodings())
+
+def compress(data, encoding, level):
+    # `level` is the gzip level (1-9); brotli uses the quality of similar cost
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def precompress(path):
+    # Writes path.br / path.gz at maximum compression, for the static file handler below.
+    # Only for fingerprinted files (see assets.py): a variant never goes stale when the name
+    # changes with the content. Returns {encoding: size} of the variants written.
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = {}
+    for encoding in encodings():
+        compressed = compress(data, encoding, 11 if encoding == 'br' else 9)
+        if len(compressed) < len(data):
+            with open(path + SUFFIXES[encoding], 'wb') as f:
+                f.write(compressed)
+            written[encoding] = len(compressed)
+    return written
+
+class Compressor:
+    def __init__(self):
+        self.min_size = 500
+        self.level = 6
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        # after_request hooks run last-registered first, so this must be registered before
+        # any hook that could still change the body
+        app.after_request(self._compress_response)
+        self._wrap_static(app)
+
+    def _compress_response(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or response.cache_control.no_transform):
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        encoding = choose_encoding()
+        if encoding is None:
+            return response
+        response.set_data(compress(data, encoding, self.level))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # A strong ETag names the exact bytes; the compressed body is a different set of bytes
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _wrap_static(self, app):
+        # Serves the precompressed variant of a static file when there is one the client accepts
+        send_static_file = app.view_functions['static']
+
+        def static(filename):
+            variants = {encoding: safe_join(app.static_folder, filename + suffix)
+                        for encoding, suffix in SUFFIXES.items()}
+            available = [encoding for encoding in encodings()
+                         if variants[encoding] and os.path.isfile(variants[encoding])]
+            if not available:
+                return send_static_file(filename=filename)
+            encoding = request.accept_encodings.best_match(available)
+            if encoding is None:
+                response = send_static_file(filename=filename)
+            else:
+                response = send_from_directory(
+                    app.static_folder, filename + SUFFIXES[encoding],
+                    mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                    max_age=app.get_send_file_max_age(filename))
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+
+        app.view_functions['static'] = static
+
+compressor = Compressor()
+
+def init_compression(app):
+    compressor.init_app(app)
@@ -1,7 +1,45 @@
 import os
+from dbpool import InstrumentedQueuePool
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# Builds the SQLAlchemy engine options, including connection pool sizing.
+# Every gunicorn worker gets its own pool, so the defaults follow the worker model:
+# a sync worker serves one request at a time and needs only a couple of connections,
+# a threaded (gthread) worker needs roughly one per thread. Each value can be
+# overridden with its DB_POOL_* environment variable.
+def engine_options(database_uri):
+    if database_uri.startswith('sqlite') and (':memory:' in database_uri or database_uri.rstrip('/') == 'sqlite:'):
+        # In-memory SQLite keeps one connection per thread; pool sizing does not apply
+        return {}
+
+    threads = int(os.environ.get('WEB_THREADS', 1))
+    if threads > 1:
+        default_size, default_overflow = threads, max(2, threads // 2)
+    else:
+        default_size, default_overflow = 2, 2
+
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.environ.get('DB_POOL_SIZE', default_size)),
+        "max_overflow": int(os.environ.get('DB_POOL_MAX_OVERFLOW', default_overflow)),
+        # Seconds to wait for a free connection before giving up with a pool timeout
+        "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # Recycle connections before MySQL's wait_timeout closes them on the server side
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        # Test each connection on checkout so stale ones are replaced instead of erroring
+        "pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', 'True') == 'True',
+    }
+    if database_uri.startswith('mysql'):
+        options["connect_args"] = {
+            "host": os.environ.get('DB_HOST', '127.0.0.1'),
+            "port": int(os.environ.get('DB_PORT', 3306)),
+            "user": os.environ.get('DB_USER', 'flask_user'),
+            "password": os.environ.get('DB_PASSWORD'), # Plain password here, will be securely loaded
+            "database": os.environ.get('DB_NAME'),
+        }
+    return options
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'a-fallback-secret-key-for-local-testing-only')
     DEBUG = os.environ.get('FLASK_DEBUG', 'False') == 'True' # Controlled by env var, default False
@@ -17,16 +55,92 @@ class Config:
     # If your MySQL is on the same VM, 127.0.0.1 is fine.
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        "connect_args": {
-            "host": os.environ.get('DB_HOST', '127.0.0.1'),
-            "port": int(os.environ.get('DB_PORT', 3306)),
-            "user": os.environ.get('DB_USER', 'flask_user'),
-            "password": os.environ.get('DB_PASSWORD'), # Plain password here, will be securely loaded
-            "database": os.environ.get('DB_NAME'),
-        }
-    }
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # Per-request timings and SQL counts for /internal/metrics/prometheus (profiling.py)
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'True') == 'True'
+    # Opt-in sampling profiler: keeps folded stacks of the slowest requests in PROFILING_DUMP_DIR
+    PROFILING_SAMPLE = os.environ.get('PROFILING_SAMPLE', 'False') == 'True'
+    PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL', 0.005))
+    PROFILING_KEEP_SLOWEST = int(os.environ.get('PROFILING_KEEP_SLOWEST', 20))
+    PROFILING_DUMP_DIR = os.environ.get('PROFILING_DUMP_DIR', os.path.join(basedir, 'profiles'))
+
+    # Client addresses allowed to read /internal/metrics
+    INTERNAL_METRICS_ALLOWED_IPS = set(os.environ.get('INTERNAL_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(','))
 
     UPLOAD_FOLDER = os.path.join(basedir, 'static', 'images', 'products')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    # Background threads that resize uploads into responsive WebP/JPEG derivatives
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+    # Static asset build (`flask assets build`): the Tailwind CLI to run, e.g. the offline
+    # standalone binary or "npx tailwindcss", and the max-age for fingerprinted files
+    TAILWIND_BIN = os.environ.get('TAILWIND_BIN', 'tailwindcss')
+    ASSET_MAX_AGE = int(os.environ.get('ASSET_MAX_AGE', 365 * 24 * 3600))
+
+    # Response compression (gzip, or brotli when installed): smallest body worth compressing
+    # and the gzip level for dynamic responses; fingerprinted assets are precompressed at build
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+    # Number of products shown per page on the catalog listings
+    PRODUCTS_PER_PAGE = int(os.environ.get('PRODUCTS_PER_PAGE', 24))
+
+    # Number of orders shown per page on the order history
+    ORDERS_PER_PAGE = int(os.environ.get('ORDERS_PER_PAGE', 20))
+
+    # Page cache for anonymous catalog pages: 'lru' (per process), 'sqlite' (shared local file) or 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH', os.path.join(basedir, 'page_cache.sqlite3'))
+
+    # Seconds between checks of the catalog version behind the read-only catalog snapshot
+    # (snapshot.py); writes in the same process refresh it at once
+    SNAPSHOT_CHECK_SECONDS = float(os.environ.get('SNAPSHOT_CHECK_SECONDS', 5))
+
+    # Password hashing (see passwords.py): Werkzeug method and cost, e.g. 'scrypt' or
+    # 'pbkdf2:sha256:1000000' (existing hashes are upgraded on login), how many hashes may
+    # run at once across all workers (default: half the CPUs) and how long a login or
+    # registration may wait for a free slot before it gets a 503. A sync worker that waits
+    # serves nothing else meanwhile, so by default it does not wait at all.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 0)) or None
+    PASSWORD_HASH_WAIT_SECONDS = float(os.environ.get('PASSWORD_HASH_WAIT_SECONDS', 0))
+    # Login throttling over a sliding window: failed logins per client IP and per username,
+    # and registrations per IP (0 turns a limit off)
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+    LOGIN_FAILURES_PER_IP = int(os.environ.get('LOGIN_FAILURES_PER_IP', 50))
+    LOGIN_FAILURES_PER_USERNAME = int(os.environ.get('LOGIN_FAILURES_PER_USERNAME', 10))
+    REGISTRATIONS_PER_IP = int(os.environ.get('REGISTRATIONS_PER_IP', 10))
+
+    # Flask-Login identity snapshot cache (per process)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+
+    # Background jobs (`flask jobs work`): worker threads, retries with exponential backoff
+    # (JOB_BACKOFF_SECONDS doubling up to JOB_BACKOFF_MAX_SECONDS), and how long a job may stay
+    # claimed before it is assumed lost. JOBS_INLINE runs jobs inside the request instead.
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_BACKOFF_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS', 10))
+    JOB_BACKOFF_MAX_SECONDS = float(os.environ.get('JOB_BACKOFF_MAX_SECONDS', 3600))
+    JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 600))
+    JOBS_INLINE = os.environ.get('JOBS_INLINE', 'False') == 'True'
+
+    # Order emails: 'file' writes .eml files to MAIL_FILE_DIR (development/tests), 'smtp' sends them
+    MAIL_BACKEND = os.environ.get('MAIL_BACKEND', 'file')
+    MAIL_FROM = os.environ.get('MAIL_FROM', 'Fashion Shop <orders@fashion-shop.local>')
+    MAIL_FILE_DIR = os.environ.get('MAIL_FILE_DIR', os.path.join(basedir, 'outbox'))
+    MAIL_SMTP_HOST = os.environ.get('MAIL_SMTP_HOST', 'localhost')
+    MAIL_SMTP_PORT = int(os.environ.get('MAIL_SMTP_PORT', 587))
+    MAIL_SMTP_USERNAME = os.environ.get('MAIL_SMTP_USERNAME')
+    MAIL_SMTP_PASSWORD = os.environ.get('MAIL_SMTP_PASSWORD')
+    MAIL_SMTP_USE_TLS = os.environ.get('MAIL_SMTP_USE_TLS', 'True') == 'True'
+    # Admins get a stock_low alert when an order leaves a product at or below this
+    LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 5))
+
+    # Raise instead of logging when a view runs more SQL queries than its @query_budget
+    # (turn this on in tests so N+1 regressions fail loudly)
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE', 'False') == 'True'
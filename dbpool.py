@@ -0,0 +1,108 @@
+# fashion-shop/dbpool.py
+
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Database connection pool instrumentation.
+# InstrumentedQueuePool times how long each checkout waits for a free connection and
+# counts timeouts; pool events track checkouts and how old the open connections are.
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._connected_at = {}  # id(dbapi connection) -> time it was opened
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+            self._connected_at[id(dbapi_connection)] = time.monotonic()
+
+    def on_close(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.disconnects += 1
+            self._connected_at.pop(id(dbapi_connection), None)
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def attach(self, engine):
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'close', self.on_close)
+        event.listen(engine, 'close_detached', lambda dbapi_connection: self.on_close(dbapi_connection, None))
+        event.listen(engine, 'invalidate', self.on_invalidate)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+    def snapshot(self, pool=None):
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - opened for opened in self._connected_at.values()]
+            data = {
+                'checkouts_total': self.checkouts,
+                'checkins_total': self.checkins,
+                'connects_total': self.connects,
+                'disconnects_total': self.disconnects,
+                'invalidations_total': self.invalidations,
+                'timeouts_total': self.timeouts,
+                'wait_seconds_count': self.wait_count,
+                'wait_seconds_sum': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+                'connections_open': len(ages),
+                'connection_age_seconds_max': round(max(ages), 3) if ages else 0.0,
+                'connection_age_seconds_avg': round(sum(ages) / len(ages), 3) if ages else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                'pool_size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+            })
+        return data
+
+pool_metrics = PoolMetrics()
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool that reports how long each checkout waited for a connection
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+def init_pool_metrics(app, db):
+    with app.app_context():
+        pool_metrics.attach(db.engine)
@@ -0,0 +1,318 @@
+# fashion-shop/facets.py
+
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, Product, Category
+from cache import catalog_version, catalog_changes, catalog_changes_since
+from querybudget import not_counted
+
+logger = logging.getLogger(__name__)
+
+# Faceted filtering for the catalog listings (category, price band, in stock).
+# Counts next to each option come from an in-process index of bitsets, one per facet value,
+# with bit N set when available product N has that value. The count for an option is a
+# popcount of its bitset ANDed with the bitsets of the other active filters, so no GROUP BY
+# runs per request. Like the search index, it is built once per process and kept current
+# from commit hooks (rows written by bulk statements are re-read, see follow). When the
+# catalog version shows another process changed the catalog (checked at most every
+# SNAPSHOT_CHECK_SECONDS) the products it changed are re-read, or after a bulk rewrite the
+# index is rebuilt in a background thread, so the counts agree with the listing next to them.
+
+CategoryFacet = namedtuple('CategoryFacet', 'id name slug')
+PriceBand = namedtuple('PriceBand', 'key label low high')
+
+PRICE_BANDS = [
+    PriceBand('under-25', 'Under $25', None, Decimal('25')),
+    PriceBand('25-50', '$25 to $50', Decimal('25'), Decimal('50')),
+    PriceBand('50-100', '$50 to $100', Decimal('50'), Decimal('100')),
+    PriceBand('100-200', '$100 to $200', Decimal('100'), Decimal('200')),
+    PriceBand('200-up', '$200 & up', Decimal('200'), None),
+]
+PRICE_BANDS_BY_KEY = {band.key: band for band in PRICE_BANDS}
+# More products changed by another process than this rebuild the index instead; each
+# re-read product rewrites the bitsets it is in
+MAX_DELTA_ROWS = 2000
+
+def price_band(price):
+    for band in PRICE_BANDS:
+        if (band.low is None or price >= band.low) and (band.high is None or price < band.high):
+            return band.key
+    return None
+
+def _bitset(ids):
+    # Builds the integer bitset in one pass instead of OR-ing in one bit at a time
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        buffer[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+class FacetIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}                       # product_id -> (category_id, price band, in stock)
+        self._all = 0                         # every available product
+        self._by_category = defaultdict(int)  # category_id -> bitset
+        self._by_price = defaultdict(int)     # price band key -> bitset
+        self._in_stock = 0
+        self._categories = []                 # CategoryFacet, sorted by name
+        self._stale = set()                   # product ids to re-read before the next lookup
+        self._refresh_lock = threading.Lock()
+        self._rebuilding = False
+        self.categories_stale = True
+        self.ready = False
+        self.version = None                   # catalog version the contents match
+        self.checked_at = 0.0
+        self.check_seconds = 5.0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, product_id, category_id, price, stock, available):
+        with self._lock:
+            self._remove(product_id)
+            if not available:
+                return
+            bit = 1 << product_id
+            band = price_band(price)
+            self._docs[product_id] = (category_id, band, stock > 0)
+            self._all |= bit
+            self._by_category[category_id] |= bit
+            self._by_price[band] |= bit
+            if stock > 0:
+                self._in_stock |= bit
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        category_id, band, in_stock = doc
+        mask = ~(1 << product_id)
+        self._all &= mask
+        self._by_category[category_id] &= mask
+        self._by_price[band] &= mask
+        if in_stock:
+            self._in_stock &= mask
+
+    def categories(self):
+        return self._categories
+
+    def _filter(self, category_id=None, price=None, in_stock=False, skip=None):
+        # Bitset of the products matching every active filter except `skip`
+        bits = self._all
+        if category_id is not None and skip != 'category':
+            bits &= self._by_category.get(category_id, 0)
+        if price is not None and skip != 'price':
+            bits &= self._by_price.get(price, 0)
+        if in_stock and skip != 'in_stock':
+            bits &= self._in_stock
+        return bits
+
+    def counts(self, category_id=None, price=None, in_stock=False):
+        # Count for every option of every facet, given the other facets' current selection
+        with self._lock:
+            without_category = self._filter(category_id, price, in_stock, skip='category')
+            without_price = self._filter(category_id, price, in_stock, skip='price')
+            without_stock = self._filter(category_id, price, in_stock, skip='in_stock')
+            return {
+                'total': self._filter(category_id, price, in_stock).bit_count(),
+                'all_categories': without_category.bit_count(),
+                'category': {c.id: (without_category & self._by_category.get(c.id, 0)).bit_count()
+                             for c in self._categories},
+                'price': {band.key: (without_price & self._by_price.get(band.key, 0)).bit_count()
+                          for band in PRICE_BANDS},
+                'in_stock': (without_stock & self._in_stock).bit_count(),
+            }
+
+    def load_categories(self, session):
+        self.set_categories(CategoryFacet(*row) for row in session.execute(
+            select(Category.id, Category.name, Category.slug)))
+
+    def set_categories(self, categories):
+        categories = sorted(categories, key=lambda c: c.name)
+        with self._lock:
+            self._categories = categories
+            self.categories_stale = False
+
+    def refresh_stale(self, session):
+        # Re-reads products changed by bulk statements that bypassed the flush hooks
+        with self._lock:
+            stale, self._stale = self._stale, set()
+        if not stale:
+            return
+        rows = {row.id: row for row in session.execute(
+            select(Product.id, Product.category_id, Product.price, Product.stock, Product.available)
+            .where(Product.id.in_(stale)))}
+        for product_id in stale:
+            row = rows.get(product_id)
+            if row is None:
+                self.remove(product_id)
+            else:
+                self.add(*row)
+
+    def load(self, rows):
+        # Replaces the contents with (product_id, category_id, price, stock) rows of available products
+        docs = {}
+        by_category, by_price, in_stock = defaultdict(list), defaultdict(list), []
+        for product_id, category_id, price, stock in rows:
+            band = price_band(price)
+            docs[product_id] = (category_id, band, stock > 0)
+            by_category[category_id].append(product_id)
+            by_price[band].append(product_id)
+            if stock > 0:
+                in_stock.append(product_id)
+        with self._lock:
+            self._docs = docs
+            self._all = _bitset(docs)
+            self._by_category = defaultdict(int, {k: _bitset(v) for k, v in by_category.items()})
+            self._by_price = defaultdict(int, {k: _bitset(v) for k, v in by_price.items()})
+            self._in_stock = _bitset(in_stock)
+            self._stale = set()
+            self.ready = True
+
+    def rebuild(self, session, version=None):
+        # Full (re)build from the Product table, streamed in chunks, then swapped in
+        self.load(session.execute(
+            select(Product.id, Product.category_id, Product.price, Product.stock)
+            .where(Product.available.is_(True))
+            .execution_options(yield_per=5000)
+        ))
+        self.load_categories(session)
+        self.version = version
+
+    def _rebuild_in_background(self, app):
+        # Lookups keep using the current contents until the new ones are swapped in
+        self._rebuilding = True
+
+        def run():
+            try:
+                with app.app_context():
+                    try:
+                        self.rebuild(db.session, catalog_version())
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception('Could not rebuild the facet index')
+            finally:
+                self._rebuilding = False
+                self.checked_at = 0.0  # catch up on what changed while it was built
+
+        threading.Thread(target=run, name='facets-rebuild', daemon=True).start()
+
+    def refresh(self, session):
+        # Brings the index up to date. The first build happens here; after that the catalog
+        # version is checked at most every check_seconds and the products changed since are
+        # re-read. A bulk rewrite, or more products changed than MAX_DELTA_ROWS, rebuilds it
+        # in a background thread instead.
+        with self._refresh_lock:
+            if not self.ready:
+                self.rebuild(session, catalog_version())
+                self.checked_at = time.monotonic()
+            elif not self._rebuilding and time.monotonic() - self.checked_at >= self.check_seconds:
+                since = self.version
+                version, changed = catalog_changes_since(since, MAX_DELTA_ROWS)
+                if changed is None:
+                    self._rebuild_in_background(current_app._get_current_object())
+                elif version != since:
+                    with self._lock:
+                        self._stale.update(changed)
+                        self.categories_stale = True  # the change may have been to a category
+                        if self.version == since:  # else a commit here moved it meanwhile, see follow()
+                            self.version = version
+                self.checked_at = time.monotonic()
+            if self._stale:
+                self.refresh_stale(session)
+            if self.categories_stale:
+                self.load_categories(session)
+
+    def follow(self, before, after, product_ids):
+        # A catalog change committed by this process, moving the version from `before` to
+        # `after`: its ORM writes are already applied, and rows written by bulk statements
+        # are re-read on the next lookup. If the index was not current at `before`, or the
+        # bulk writes are not known row by row, the next lookup checks the version instead.
+        with self._lock:
+            if self.version == before and product_ids is not None:
+                self._stale.update(product_ids)
+                self.version = after
+            else:
+                self.checked_at = 0.0
+
+    def needs_refresh(self):
+        return (not self.ready or bool(self._stale) or self.categories_stale
+                or (not self._rebuilding and time.monotonic() - self.checked_at >= self.check_seconds))
+
+# One index per process
+facet_index = FacetIndex()
+
+def get_facets():
+    # Builds the index on first use in this process and keeps it current (see refresh)
+    if facet_index.needs_refresh():
+        with not_counted():
+            facet_index.refresh(db.session)
+    return facet_index
+
+# --- Filtering the listing query ---
+
+def apply_filters(query, price=None, in_stock=False):
+    # Adds the price band / in-stock filters to a Product query (category is filtered by the route)
+    band = PRICE_BANDS_BY_KEY.get(price)
+    if band is not None:
+        if band.low is not None:
+            query = query.filter(Product.price >= band.low)
+        if band.high is not None:
+            query = query.filter(Product.price < band.high)
+    if in_stock:
+        query = query.filter(Product.stock > 0)
+    return query
+
+# --- Incremental updates ---
+
+def _collect_product_changes(session, flush_context):
+    pending = session.info.setdefault('facets_pending', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Product):
+            pending[obj.id] = (obj.id, obj.category_id, obj.price, obj.stock, obj.available)
+        elif isinstance(obj, Category):
+            session.info['facets_categories'] = True
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            pending[obj.id] = None
+        elif isinstance(obj, Category):
+            session.info['facets_categories'] = True
+
+def _apply_product_changes(session):
+    pending = session.info.pop('facets_pending', None)
+    changes = catalog_changes(session)
+    if session.info.pop('facets_categories', False):
+        facet_index.categories_stale = True
+    if not facet_index.ready:
+        return
+    for product_id, values in (pending or {}).items():
+        if values is None:
+            facet_index.remove(product_id)
+        else:
+            facet_index.add(*values)
+    if changes is not None:
+        facet_index.follow(*changes)
+
+def _discard_product_changes(session, previous_transaction):
+    session.info.pop('facets_pending', None)
+    session.info.pop('facets_categories', None)
+
+def init_facets(app):
+    facet_index.check_seconds = app.config.get('SNAPSHOT_CHECK_SECONDS', 5.0)
+    event.listen(Session, 'after_flush', _collect_product_changes)
+    event.listen(Session, 'after_commit', _apply_product_changes)
+    event.listen(Session, 'after_soft_rollback', _discard_product_changes)
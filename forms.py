@@ -8,7 +8,8 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField, DecimalField, IntegerField, BooleanField, SelectField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, NumberRange, ValidationError
 from flask_wtf.file import FileField, FileAllowed, FileRequired # NEW IMPORTS
-from models import User, Category # Import models to use for validation
+from sqlalchemy import case, func, or_, select
+from models import db, User, Category # Import models to use for validation
 # User Registration Form
 class RegistrationForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=4, max=20)])
@@ -18,16 +19,21 @@ class RegistrationForm(FlaskForm):
                                      validators=[DataRequired(), EqualTo('password', message='Passwords must match')])
     submit = SubmitField('Sign Up')
 
-    # Custom validation to check if username or email already exists
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user:
-            raise ValidationError('That username is taken. Please choose a different one.')
-
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user:
-            raise ValidationError('That email is taken. Please choose a different one.')
+    # Custom validation to check if username or email already exists, in one query. The
+    # database compares, so "taken" follows its collation (case-insensitive on MySQL).
+    def validate(self, extra_validators=None):
+        valid = super().validate(extra_validators)
+        if self.username.errors or self.email.errors:
+            return False
+        username_taken, email_taken = db.session.execute(select(
+            func.count(case((User.username == self.username.data, 1))),
+            func.count(case((User.email == self.email.data, 1))),
+        ).where(or_(User.username == self.username.data, User.email == self.email.data))).one()
+        if username_taken:
+            self.username.errors.append('That username is taken. Please choose a different one.')
+        if email_taken:
+            self.email.errors.append('That email is taken. Please choose a different one.')
+        return valid and not username_taken and not email_taken
 
 # User Login Form
 class LoginForm(FlaskForm):
@@ -40,7 +46,7 @@ class AddProductForm(FlaskForm):
     name = StringField('Product Name', validators=[DataRequired(), Length(max=200)])
     slug = StringField('Product Slug (URL friendly)', validators=[DataRequired(), Length(max=200)])
     description = TextAreaField('Description')
-    price = DecimalField('Price', validators=[DataRequired(), NumberRange(min=0.01)])
+    price = DecimalField('Price', places=2, validators=[DataRequired(), NumberRange(min=0.01)])
     stock = IntegerField('Stock Quantity', validators=[DataRequired(), NumberRange(min=0)])
     # For category, we'll dynamically populate choices in the route
     category = SelectField('Category', coerce=int, validators=[DataRequired()])
@@ -64,4 +70,9 @@ class CheckoutForm(FlaskForm):
     address = TextAreaField('Shipping Address', validators=[DataRequired(), Length(max=250)])
     postal_code = StringField('Postal Code', validators=[DataRequired(), Length(max=20)])
     city = StringField('City', validators=[DataRequired(), Length(max=100)])
-    submit = SubmitField('Place Order')
\ No newline at end of file
+    submit = SubmitField('Place Order')
+
+# Bulk catalog import (for admin)
+class ImportProductsForm(FlaskForm):
+    feed = FileField('Product Feed', validators=[FileRequired(), FileAllowed(['csv', 'jsonl', 'ndjson'], 'CSV or JSON Lines files only!')])
+    submit = SubmitField('Import')
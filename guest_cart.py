@@ -0,0 +1,155 @@
+# fashion-shop/guest_cart.py
+
+from flask import g, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import and_, insert, select, update
+from models import db, Product, CartItem
+
+# Cart for visitors who are not logged in.
+# The cart lives in Flask's signed session cookie as {product_id: quantity}, so browsing
+# and adding items costs no database writes. Price and stock always come from Product
+# (one batched query per cart render), never from the cookie. On login the lines are
+# merged into the user's CartItem rows with one SELECT and one batched INSERT/UPDATE.
+
+SESSION_KEY = 'cart'
+# A signed-in shopper's line count, [user id, count], remembered between their cart writes
+USER_COUNT_KEY = 'cart_count'
+# Keeps the cookie well under the 4 KB browsers allow
+MAX_LINES = 50
+CART_COUNT_PLACEHOLDER = '__CART_COUNT_PLACEHOLDER__'
+
+class GuestCartItem:
+    # Stands in for CartItem in the cart templates; the line is addressed by product id
+    def __init__(self, product, quantity):
+        self.id = product.id
+        self.product_id = product.id
+        self.product = product
+        self.quantity = quantity
+
+def get_lines():
+    # {product_id: quantity}; the session is JSON, so keys are stored as strings
+    lines = {}
+    for key, quantity in (session.get(SESSION_KEY) or {}).items():
+        try:
+            product_id, quantity = int(key), int(quantity)
+        except (TypeError, ValueError):
+            continue
+        if quantity > 0:
+            lines[product_id] = quantity
+    return lines
+
+def _save(lines):
+    if lines:
+        session[SESSION_KEY] = {str(product_id): quantity for product_id, quantity in lines.items()}
+    else:
+        session.pop(SESSION_KEY, None)
+
+def quantity_of(product_id):
+    return get_lines().get(product_id, 0)
+
+def set_quantity(product_id, quantity):
+    # Returns False if the cart is full and product_id is not in it yet
+    lines = get_lines()
+    if quantity <= 0:
+        lines.pop(product_id, None)
+    elif product_id in lines or len(lines) < MAX_LINES:
+        lines[product_id] = quantity
+    else:
+        return False
+    _save(lines)
+    return True
+
+def remove(product_id):
+    set_quantity(product_id, 0)
+
+def count():
+    # Number of lines, like User.cart_count
+    return len(get_lines())
+
+def load_items():
+    # The cart lines with their products, in one query; lines for deleted products are dropped
+    lines = get_lines()
+    if not lines:
+        return []
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(lines)).all()}
+    items = [GuestCartItem(products[product_id], quantity)
+             for product_id, quantity in lines.items() if product_id in products]
+    if len(items) != len(lines):
+        _save({item.product_id: item.quantity for item in items})
+    return items
+
+def merge_into(user_id):
+    # Moves the session cart into the user's CartItem rows and returns the number of lines merged
+    forget_user_count()  # a new sign-in counts the user's cart afresh
+    lines = get_lines()
+    if not lines:
+        return 0
+    # One query finds which products can still be bought and which are already in the user's cart
+    rows = db.session.execute(
+        select(Product.id, Product.stock, CartItem.id.label('cart_item_id'), CartItem.quantity)
+        .outerjoin(CartItem, and_(CartItem.product_id == Product.id, CartItem.user_id == user_id))
+        .where(Product.id.in_(lines), Product.available.is_(True), Product.stock > 0)
+    ).all()
+
+    # Like adding to the cart while logged in: no line may ask for more than is in stock
+    inserts, updates, seen = [], [], set()
+    for product_id, stock, cart_item_id, quantity in rows:
+        if product_id in seen:
+            continue  # duplicate CartItem rows for a product: top up the first one only
+        seen.add(product_id)
+        if cart_item_id is None:
+            inserts.append({'user_id': user_id, 'product_id': product_id,
+                            'quantity': min(lines[product_id], stock)})
+        elif quantity < stock:
+            updates.append({'id': cart_item_id, 'quantity': min(quantity + lines[product_id], stock)})
+
+    try:
+        if inserts:
+            db.session.execute(insert(CartItem), inserts)
+        if updates:
+            db.session.execute(update(CartItem), updates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    session.pop(SESSION_KEY, None)
+    return len(inserts) + len(updates)
+
+def visitor_cart_count():
+    # Lines in the current visitor's cart (CartItem rows or the session cart), once per
+    # request: the page validators and the badge both need it (see cache.page_etag). A
+    # signed-in shopper's count is kept in the session, so pages run no COUNT query; it is
+    # counted again after their cart writes and reset whenever the cart itself is loaded.
+    # Writes from another of their devices show there on its next cart write or cart page.
+    if '_cart_count' not in g:
+        if not current_user.is_authenticated:
+            g._cart_count = count()
+        else:
+            remembered = session.get(USER_COUNT_KEY)
+            if isinstance(remembered, list) and remembered[:1] == [current_user.id]:
+                g._cart_count = remembered[1]
+            else:
+                remember_user_count(current_user.cart_count)
+    return g._cart_count
+
+def remember_user_count(lines):
+    session[USER_COUNT_KEY] = [current_user.id, lines]
+    g._cart_count = lines
+
+def forget_user_count():
+    # After a write to the signed-in shopper's CartItem rows
+    session.pop(USER_COUNT_KEY, None)
+    g.pop('_cart_count', None)
+
+def cart_badge_count():
+    # Template helper for the cart badge. Pages rendered for the anonymous page cache get a
+    # placeholder, filled in per visitor by the cache (see cache._fill_placeholders).
+    if current_user.is_authenticated:
+        return visitor_cart_count()
+    if g.get('_page_cacheable'):
+        return Markup(CART_COUNT_PLACEHOLDER)
+    return count()
+
+def init_guest_cart(app):
+    app.jinja_env.globals.update(cart_badge_count=cart_badge_count)
@@ -0,0 +1,51 @@
+# fashion-shop/gunicorn.conf.py
+
+import multiprocessing
+import os
+import time
+
+# gunicorn settings: `gunicorn -c gunicorn.conf.py` (the file in the working directory is
+# picked up on its own). Each value can be overridden with its WEB_* environment variable
+# or on the command line.
+#
+# With preload_app the master builds the application once and warms it up (warmup.py)
+# before forking, so workers start in milliseconds, already warm, and share the loaded
+# catalog data copy-on-write instead of each importing and loading its own copy. That data
+# is versioned: each worker checks the catalog version on its first lookup and keeps its
+# copy current from then on.
+# (warmup is imported in the hooks, so that without preload_app the master stays empty.)
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Also sizes each worker's connection pool (config.engine_options)
+threads = int(os.environ.get('WEB_THREADS', 1))
+preload_app = os.environ.get('WEB_PRELOAD', 'True') == 'True'
+
+def when_ready(server):
+    # Runs in the master once the application is loaded, before the first fork
+    if server.cfg.preload_app:
+        import warmup
+        timings = warmup.before_fork(server.app.wsgi())
+        server.log.info('Warm-up done: %s', ', '.join(f'{name} {seconds * 1000:.0f} ms'
+                                                     for name, seconds in timings.items()))
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+    worker.first_request_done = False
+    if server.cfg.preload_app:
+        import warmup
+        warmup.after_fork(server.app.wsgi())
+
+# Startup figures per worker, at info level (`flask bench startup` reads them)
+def post_worker_init(worker):
+    worker.log.info('Worker %s ready in %.1f ms', worker.pid, (time.monotonic() - worker.forked_at) * 1000)
+
+def pre_request(worker, req):
+    req.started_at = time.monotonic()
+
+def post_request(worker, req, environ, resp):
+    if not worker.first_request_done:
+        worker.first_request_done = True
+        worker.log.info('Worker %s first request %s in %.1f ms', worker.pid, req.path,
+                        (time.monotonic() - req.started_at) * 1000)
@@ -0,0 +1,128 @@
+# fashion-shop/identity.py
+
+import threading
+import time
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from cache import LRUCache, move_version
+from models import db, User, CartItem, Watermark
+from querybudget import not_counted
+
+# Cached Flask-Login identity.
+# The user loader runs on every authenticated request, so instead of a primary-key
+# query each time it returns a lightweight snapshot of the few columns the views and
+# templates read. The full ORM User is only loaded if something asks for more.
+# Committed User updates and deletes drop the snapshot in this process and move the
+# USERS_CHANGED watermark in the same transaction; other processes check it at most every
+# SNAPSHOT_CHECK_SECONDS and drop their snapshots when it moved. The snapshot's is_admin
+# only decides what the templates show: admin views ask the database (has_admin_rights),
+# so a revoked admin is locked out at once in every process.
+
+USERS_CHANGED = 'users_changed'
+
+class CachedUser(UserMixin):
+    def __init__(self, id, username, email, is_admin):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = bool(is_admin)
+        self._user = None
+
+    @property
+    def user(self):
+        # The full ORM object, loaded on first use
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    @property
+    def cart_count(self):
+        # Answered with a COUNT query, without loading the User row (the badge remembers it
+        # between cart writes, see guest_cart.visitor_cart_count)
+        return CartItem.query.filter_by(user_id=self.id).count()
+
+    def has_admin_rights(self):
+        # For admin views: read now, not from the snapshot
+        return bool(db.session.scalar(select(User.is_admin).where(User.id == self.id)))
+
+    def __getattr__(self, name):
+        # Anything not in the snapshot (relationships, password hash, ...) comes from the ORM object
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+class IdentityCache:
+    def __init__(self):
+        self.cache = LRUCache(max_entries=10000, ttl=60)
+        self._lock = threading.Lock()
+        self.version = None  # USERS_CHANGED as of the last check
+        self.checked_at = 0.0
+        self.check_seconds = 5.0
+
+    def init_app(self, app):
+        self.cache = LRUCache(max_entries=app.config.get('USER_CACHE_MAX_ENTRIES', 10000),
+                              ttl=app.config.get('USER_CACHE_TTL', 60))
+        self.check_seconds = app.config.get('SNAPSHOT_CHECK_SECONDS', 5.0)
+        event.listen(Session, 'after_flush', _note_user_writes)
+        event.listen(Session, 'after_commit', _evict_user_writes)
+        event.listen(Session, 'after_soft_rollback', _forget_user_writes)
+
+    def _check_version(self):
+        # Drops every snapshot once another process committed a User write
+        if time.monotonic() - self.checked_at < self.check_seconds:
+            return
+        with self._lock, not_counted():
+            if time.monotonic() - self.checked_at < self.check_seconds:
+                return
+            version = db.session.scalar(select(Watermark.value).where(Watermark.name == USERS_CHANGED)) or 0
+            if version != self.version:
+                self.cache.clear()
+                self.version = version
+            self.checked_at = time.monotonic()
+
+    def committed(self, before, after):
+        # A User write committed here moved the version: this process already evicted it
+        with self._lock:
+            if self.version == before:
+                self.version = after
+
+    def load(self, user_id):
+        self._check_version()
+        snapshot = self.cache.get(user_id)
+        if snapshot is None:
+            row = db.session.execute(
+                db.select(User.id, User.username, User.email, User.is_admin).where(User.id == user_id)
+            ).first()
+            if row is None:
+                return None
+            snapshot = tuple(row)
+            self.cache.set(user_id, snapshot)
+        # A fresh object per request, so a lazily loaded ORM User never leaks across sessions
+        return CachedUser(*snapshot)
+
+    def evict(self, user_id):
+        self.cache.delete(user_id)
+
+identity_cache = IdentityCache()
+
+def _note_user_writes(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault('user_writes', set()).add(obj.id)
+            if 'users_version' not in session.info:
+                session.info['users_version'] = move_version(session, USERS_CHANGED)
+
+def _evict_user_writes(session):
+    for user_id in session.info.pop('user_writes', ()):
+        identity_cache.evict(user_id)
+    versions = session.info.pop('users_version', None)
+    if versions is not None:
+        identity_cache.committed(*versions)
+
+def _forget_user_writes(session, previous_transaction):
+    session.info.pop('user_writes', None)
+    session.info.pop('users_version', None)
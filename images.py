@@ -0,0 +1,240 @@
+# fashion-shop/images.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import click
+from flask import request, url_for
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it templates fall back to the original upload
+    Image = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: manifest writes are then only serialised within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Responsive product image derivatives.
+# Every upload is resized into a few fixed widths, each saved as WebP plus a JPEG fallback,
+# under content-hashed names in <UPLOAD_FOLDER>/derived. A small JSON manifest maps the
+# original filename to its hash and the widths that were produced. Writers (every worker,
+# `flask images backfill`) merge their entry into it under an exclusive lock on a file
+# beside it, so concurrent writes from different processes do not drop each other's entries.
+
+# Widths (px) generated for every image, named after where they are shown
+VARIANTS = {'card': 400, 'detail': 800, 'zoom': 1600}
+
+# Default `sizes` attribute per display slot
+SIZES = {
+    'card': '(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+    'zoom': '100vw',
+}
+
+DERIVED_DIR = 'derived'
+MANIFEST_NAME = 'manifest.json'
+# How often a process re-checks the manifest file for entries written by other workers
+MANIFEST_RELOAD_SECONDS = 5
+
+class ImagePipeline:
+    def __init__(self):
+        self.upload_folder = None
+        self.executor = None
+        self._manifest = {}
+        self._manifest_mtime = 0.0
+        self._manifest_checked = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        self.executor = ThreadPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS', 2),
+                                           thread_name_prefix='image-derivatives')
+        os.makedirs(self.derived_folder, exist_ok=True)
+        self._load_manifest()
+
+    @property
+    def derived_folder(self):
+        return os.path.join(self.upload_folder, DERIVED_DIR)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.derived_folder, MANIFEST_NAME)
+
+    # --- Manifest ---
+
+    def _load_manifest(self):
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        except (OSError, ValueError):
+            logger.warning('Could not read image manifest %s', self.manifest_path)
+
+    def entry(self, filename):
+        now = time.monotonic()
+        if now - self._manifest_checked > MANIFEST_RELOAD_SECONDS:
+            self._manifest_checked = now
+            self._load_manifest()
+        return self._manifest.get(filename)
+
+    @contextmanager
+    def _manifest_locked(self):
+        # Held across the read-merge-replace of a manifest write, in this process and all others
+        with self._lock, open(f'{self.manifest_path}.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def _save_entry(self, filename, entry):
+        with self._manifest_locked():
+            # Merge with what is on disk so entries written by other processes are kept
+            self._manifest_mtime = 0.0
+            self._load_manifest()
+            manifest = dict(self._manifest)
+            manifest[filename] = entry
+            tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
+            self._manifest = manifest
+            self._manifest_mtime = os.path.getmtime(self.manifest_path)
+
+    # --- Processing ---
+
+    def process(self, filename, force=False):
+        # Generates every derivative for one original; safe to call again (it is idempotent)
+        if Image is None:
+            return None
+        source = os.path.join(self.upload_folder, filename)
+        with open(source, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:12]
+
+        existing = self.entry(filename)
+        if existing and existing['hash'] == digest and not force:
+            return existing
+
+        stem = os.path.splitext(filename)[0]
+        widths = []
+        with Image.open(source) as original:
+            original.load()
+            for width in sorted(VARIANTS.values()):
+                # Never upscale; the largest useful width is the original's own
+                target = min(width, original.width)
+                if widths and target == widths[-1]:
+                    continue
+                resized = original.copy()
+                resized.thumbnail((target, original.height), Image.LANCZOS)
+                base = os.path.join(self.derived_folder, f'{stem}-{digest}-{target}')
+                resized.save(base + '.webp', 'WEBP', quality=80, method=4)
+                if resized.mode not in ('RGB', 'L'):
+                    # JPEG has no alpha channel; flatten onto white like the page background
+                    background = Image.new('RGB', resized.size, (255, 255, 255))
+                    background.paste(resized, mask=resized.convert('RGBA').split()[-1])
+                    resized = background
+                resized.save(base + '.jpg', 'JPEG', quality=82, optimize=True, progressive=True)
+                widths.append(target)
+
+        entry = {'hash': digest, 'stem': stem, 'widths': widths}
+        self._save_entry(filename, entry)
+        return entry
+
+    def submit(self, filename):
+        # Queue derivative generation off the request thread
+        if Image is None or self.executor is None:
+            return None
+        future = self.executor.submit(self.process, filename)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        error = future.exception()
+        if error is not None:
+            logger.error('Image derivative generation failed: %s', error)
+
+    # --- Template helper ---
+
+    def _srcset(self, entry, extension):
+        return ', '.join(
+            url_for('static', filename=f"images/products/{DERIVED_DIR}/{entry['stem']}-{entry['hash']}-{width}.{extension}")
+            + f' {width}w'
+            for width in entry['widths']
+        )
+
+    def render(self, filename, alt='', variant='card', sizes=None, class_=''):
+        # Emits a <picture> with WebP + JPEG srcsets, or a plain <img> if no derivatives exist yet
+        extra = f' class="{escape(class_)}"' if class_ else ''
+        entry = self.entry(filename) if filename else None
+        if not entry:
+            src = url_for('static', filename='images/products/' + (filename or 'placeholder.jpg'))
+            return Markup(f'<img src="{src}" alt="{escape(alt)}"{extra} loading="lazy" decoding="async">')
+
+        sizes = sizes or SIZES.get(variant, SIZES['card'])
+        wanted = VARIANTS.get(variant, VARIANTS['card'])
+        fallback_width = next((w for w in entry['widths'] if w >= wanted), entry['widths'][-1])
+        fallback = url_for('static', filename=f"images/products/{DERIVED_DIR}/{entry['stem']}-{entry['hash']}-{fallback_width}.jpg")
+        return Markup(
+            f'<picture>'
+            f'<source type="image/webp" srcset="{self._srcset(entry, "webp")}" sizes="{sizes}">'
+            f'<img src="{fallback}" srcset="{self._srcset(entry, "jpg")}" sizes="{sizes}" '
+            f'alt="{escape(alt)}"{extra} loading="lazy" decoding="async">'
+            f'</picture>'
+        )
+
+image_pipeline = ImagePipeline()
+
+def init_images(app):
+    image_pipeline.init_app(app)
+    app.jinja_env.globals.update(product_image=image_pipeline.render)
+    derived_prefix = os.path.relpath(image_pipeline.derived_folder, app.static_folder).replace(os.sep, '/') + '/'
+    max_age = app.config.get('ASSET_MAX_AGE', 365 * 24 * 3600)
+
+    @app.after_request
+    def derived_cache_headers(response):
+        # Derivatives are named after their content hash, so browsers never need to revalidate.
+        # Originals keep the default: revalidated with their ETag/Last-Modified (304 when unchanged).
+        filename = (request.view_args or {}).get('filename', '')
+        if request.endpoint == 'static' and filename.startswith(derived_prefix) \
+                and response.status_code in (200, 304):
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+    @app.cli.command('backfill-images')
+    @click.option('--force', is_flag=True, help='Regenerate derivatives even if they are up to date.')
+    def backfill_images(force):
+        """Generate responsive derivatives for every image in UPLOAD_FOLDER."""
+        if Image is None:
+            raise click.ClickException('Pillow is not installed.')
+        allowed = app.config['ALLOWED_EXTENSIONS']
+        filenames = sorted(
+            name for name in os.listdir(image_pipeline.upload_folder)
+            if os.path.isfile(os.path.join(image_pipeline.upload_folder, name))
+            and name.rsplit('.', 1)[-1].lower() in allowed
+        )
+        futures = [(name, image_pipeline.executor.submit(image_pipeline.process, name, force))
+                   for name in filenames]
+        for name, future in futures:
+            try:
+                entry = future.result()
+                click.echo(f"{name}: {', '.join(str(w) for w in entry['widths'])}")
+            except Exception as e:
+                click.echo(f'{name}: failed ({e})', err=True)
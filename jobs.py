@@ -0,0 +1,286 @@
+# fashion-shop/jobs.py
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+import click
+from flask import current_app, g, has_request_context
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+# Durable job queue in the application database.
+# enqueue() adds a Job row to the caller's transaction, so a job exists exactly when the
+# work that caused it was committed (an order and its `order_placed` job commit together).
+# `flask jobs work` runs handlers in a pool of threads:
+#   - a job is claimed with a conditional UPDATE (pending -> running), so two workers
+#     never run the same job, on any database
+#   - a failed job is retried with exponential backoff and jitter, and moved to the
+#     dead-letter state ('dead') after max_attempts; `flask jobs retry` requeues those
+#   - jobs left 'running' by a worker that died are requeued after JOB_LOCK_TIMEOUT
+# Handlers run at least once, so they must be safe to repeat; the job's idempotency key
+# is passed along for that.
+#
+# With JOBS_INLINE on, jobs enqueued during a request are run before its response is sent
+# (the old synchronous behaviour, for development and for comparing latency).
+
+PENDING, RUNNING, DONE, DEAD = 'pending', 'running', 'done', 'dead'
+# Due jobs fetched per claim attempt; workers pick among them at random to avoid contention
+CLAIM_BATCH = 10
+
+HANDLERS = {}
+
+def handler(kind):
+    # Registers func(payload, job) as the handler for jobs of this kind
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+def enqueue(kind, payload, key=None, delay=0, max_attempts=None):
+    # Adds a job to the current transaction. Returns the existing job instead if one with
+    # the same idempotency key was already enqueued.
+    if key is not None:
+        existing = db.session.scalar(select(Job).where(Job.idempotency_key == key))
+        if existing is not None:
+            return existing
+    job = Job(kind=kind, payload=json.dumps(payload, default=str), idempotency_key=key,
+              run_at=datetime.utcnow() + timedelta(seconds=delay),
+              max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5))
+    db.session.add(job)
+    db.session.info.setdefault('enqueued_jobs', []).append(job)
+    return job
+
+# --- Running jobs ---
+
+def backoff(attempts):
+    # Seconds before retry number `attempts`: base * 2**(attempts - 1), capped, with +-20% jitter
+    base = current_app.config.get('JOB_BACKOFF_SECONDS', 10)
+    cap = current_app.config.get('JOB_BACKOFF_MAX_SECONDS', 3600)
+    return min(base * 2 ** (attempts - 1), cap) * random.uniform(0.8, 1.2)
+
+def _claim(job_id, worker_name, now):
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == PENDING)
+        .values(status=RUNNING, locked_by=worker_name, locked_at=now, attempts=Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return db.session.get(Job, job_id) if claimed else None
+
+def claim_next(worker_name):
+    now = datetime.utcnow()
+    due = db.session.scalars(
+        select(Job.id).where(Job.status == PENDING, Job.run_at <= now)
+        .order_by(Job.run_at).limit(CLAIM_BATCH)
+    ).all()
+    random.shuffle(due)
+    for job_id in due:
+        job = _claim(job_id, worker_name, now)
+        if job is not None:
+            return job
+    return None
+
+def run_job(job):
+    # Runs a claimed job. The handler's own writes commit together with the 'done' mark.
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f'no handler for job kind {job.kind!r}')
+        func(json.loads(job.payload), job)
+        job.status = DONE
+        job.finished_at = datetime.utcnow()
+        job.locked_by = job.locked_at = None
+        job.last_error = None
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed on attempt %s', job.id, job.kind, job.attempts)
+        _record_failure(job, traceback.format_exc())
+        return False
+
+def _record_failure(job, error):
+    job.last_error = error[-4000:]
+    job.locked_by = job.locked_at = None
+    if job.attempts >= job.max_attempts:
+        job.status = DEAD
+        job.finished_at = datetime.utcnow()
+    else:
+        job.status = PENDING
+        job.run_at = datetime.utcnow() + timedelta(seconds=backoff(job.attempts))
+    db.session.commit()
+
+def requeue_stale():
+    # Jobs still 'running' long after they were claimed belong to a worker that died
+    stale = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_LOCK_TIMEOUT', 600))
+    running_since = (Job.status == RUNNING) & (Job.locked_at < stale)
+    dead = db.session.execute(
+        update(Job).where(running_since, Job.attempts >= Job.max_attempts)
+        .values(status=DEAD, finished_at=datetime.utcnow(), locked_by=None, locked_at=None,
+                last_error='worker stopped while running the job')
+        .execution_options(synchronize_session=False)).rowcount
+    requeued = db.session.execute(
+        update(Job).where(running_since)
+        .values(status=PENDING, locked_by=None, locked_at=None)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return requeued, dead
+
+class Worker:
+    # A pool of threads taking jobs from the queue until stopped
+    def __init__(self, app, concurrency=2, poll_interval=1.0):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, burst=False):
+        # burst: return once the queue has no due jobs instead of polling forever
+        with self.app.app_context():
+            requeue_stale()
+        threads = [threading.Thread(target=self._loop, args=(f'{self.name}/{i}', burst),
+                                    name=f'job-worker-{i}', daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stop()  # finish the jobs in hand, then exit
+            for thread in threads:
+                thread.join()
+
+    def _loop(self, thread_name, burst):
+        idle_polls = 0
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    job = claim_next(thread_name)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Could not claim a job')
+                    job = None
+                if job is None:
+                    if burst:
+                        return
+                    idle_polls += 1
+                    if idle_polls % 60 == 0:
+                        requeue_stale()
+                    self._stop.wait(self.poll_interval)
+                    continue
+                idle_polls = 0
+                ok = run_job(job)
+                with self._lock:
+                    self.processed += 1
+                    self.failed += 0 if ok else 1
+                db.session.remove()
+
+# --- Inline mode ---
+
+def _note_enqueued(session, flush_context):
+    jobs = session.info.pop('enqueued_jobs', None)
+    if jobs:
+        session.info.setdefault('flushed_job_ids', []).extend(job.id for job in jobs)
+
+def _run_inline_after_commit(session):
+    job_ids = session.info.pop('flushed_job_ids', None)
+    if job_ids and has_request_context() and current_app.config.get('JOBS_INLINE'):
+        g.setdefault('_inline_job_ids', []).extend(job_ids)
+
+def _forget_enqueued(session, previous_transaction):
+    session.info.pop('enqueued_jobs', None)
+    session.info.pop('flushed_job_ids', None)
+
+def _run_inline_jobs(response):
+    job_ids = g.pop('_inline_job_ids', None)
+    if job_ids:
+        # The view's @query_budget covers its own work, not the jobs it hands off
+        g.pop('_query_budget', None)
+    while job_ids:
+        # Handlers may enqueue follow-up jobs, which land back in g._inline_job_ids
+        for job_id in job_ids:
+            job = _claim(job_id, 'inline', datetime.utcnow())
+            if job is not None:
+                run_job(job)
+        job_ids = g.pop('_inline_job_ids', None)
+    return response
+
+# --- CLI ---
+
+def init_jobs(app):
+    import notifications  # registers the order_placed / stock_low / send_email handlers
+    notifications.init_notifications(app)
+
+    event.listen(Session, 'after_flush', _note_enqueued)
+    event.listen(Session, 'after_commit', _run_inline_after_commit)
+    event.listen(Session, 'after_soft_rollback', _forget_enqueued)
+    app.after_request(_run_inline_jobs)
+
+    @app.cli.group('jobs')
+    def jobs():
+        """Background job queue."""
+
+    @jobs.command('work')
+    @click.option('--concurrency', default=None, type=int, help='Worker threads. Defaults to JOB_WORKERS.')
+    @click.option('--poll', 'poll_interval', default=1.0, show_default=True, help='Seconds between polls when idle.')
+    @click.option('--burst', is_flag=True, help='Exit once no jobs are due.')
+    def work_command(concurrency, poll_interval, burst):
+        """Run queued jobs until interrupted."""
+        worker = Worker(app, concurrency or app.config.get('JOB_WORKERS', 2), poll_interval)
+        click.echo(f'Worker {worker.name} running with {worker.concurrency} threads (Ctrl+C to stop)')
+        worker.run(burst)
+        click.echo(f'{worker.processed} jobs run, {worker.failed} failed')
+
+    @jobs.command('status')
+    def status_command():
+        """Job counts by kind and status."""
+        rows = db.session.execute(
+            select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status)
+            .order_by(Job.kind, Job.status)).all()
+        if not rows:
+            click.echo('No jobs.')
+        for kind, status, count in rows:
+            click.echo(f'  {kind:20} {status:10} {count}')
+
+    @jobs.command('retry')
+    @click.option('--kind', default=None, help='Only requeue dead jobs of this kind.')
+    def retry_command(kind):
+        """Requeue dead-lettered jobs with a fresh set of attempts."""
+        condition = Job.status == DEAD
+        if kind:
+            condition &= Job.kind == kind
+        requeued = db.session.execute(
+            update(Job).where(condition)
+            .values(status=PENDING, attempts=0, run_at=datetime.utcnow(), finished_at=None)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        click.echo(f'{requeued} jobs requeued')
+
+    @jobs.command('purge')
+    @click.option('--days', default=7, show_default=True, help='Delete finished jobs older than this.')
+    def purge_command(days):
+        """Delete old finished jobs (dead-lettered jobs are kept)."""
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        deleted = db.session.execute(
+            delete(Job).where(Job.status == DONE, Job.finished_at < cutoff)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        click.echo(f'{deleted} jobs deleted')
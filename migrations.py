@@ -0,0 +1,127 @@
+# fashion-shop/migrations.py
+
+import click
+from sqlalchemy import inspect, text
+from models import db
+
+# Idempotent schema upgrades for databases created before a model change.
+# db.create_all() only creates missing tables, so new columns and indexes on existing
+# tables are added here. Every step checks what is already there, so `flask upgrade-db`
+# can be re-run safely; steps run in the order they are registered.
+
+MIGRATIONS = []
+
+def migration(name):
+    def decorator(func):
+        MIGRATIONS.append((name, func))
+        return func
+    return decorator
+
+def add_column_if_missing(model, column_name):
+    table = model.__table__
+    existing = {c['name'] for c in inspect(db.engine).get_columns(table.name)}
+    if column_name in existing:
+        return False
+    column = table.c[column_name]
+    preparer = db.engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} '
+                          f'ADD COLUMN {preparer.format_column(column)} {column_type}'))
+    return True
+
+def create_index_if_missing(model, index_name):
+    index = next(i for i in model.__table__.indexes if i.name == index_name)
+    existing = {i['name'] for i in inspect(db.engine).get_indexes(model.__table__.name)}
+    if index_name in existing:
+        return False
+    index.create(db.engine)
+    return True
+
+def alter_column_type_if_needed(model, column_name):
+    # Changes an existing column to the type the model now declares and rounds the stored
+    # values to its scale. SQLite cannot alter column types, but it keeps whatever type a
+    # value is given, so there only the rounding runs.
+    table = model.__table__
+    column = table.c[column_name]
+    preparer = db.engine.dialect.identifier_preparer
+    table_name, column_sql = preparer.format_table(table), preparer.format_column(column)
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    current = next(c for c in inspect(db.engine).get_columns(table.name) if c['name'] == column_name)
+    changed = current['type'].compile(dialect=db.engine.dialect) != column_type
+    with db.engine.begin() as conn:
+        scale = getattr(column.type, 'scale', None)
+        if scale is not None:
+            conn.execute(text(f'UPDATE {table_name} SET {column_sql} = ROUND({column_sql}, {scale})'))
+        if changed and db.engine.dialect.name == 'mysql':
+            null = 'NULL' if column.nullable else 'NOT NULL'
+            conn.execute(text(f'ALTER TABLE {table_name} MODIFY {column_sql} {column_type} {null}'))
+        elif changed and db.engine.dialect.name == 'postgresql':
+            conn.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN {column_sql} TYPE {column_type}'))
+    return changed
+
+# --- Registered migrations ---
+
+@migration('product listing indexes')
+def product_indexes():
+    from models import Product
+    for name in ('ix_product_available_name', 'ix_product_available_category_name',
+                 'ix_product_available_created_at'):
+        create_index_if_missing(Product, name)
+
+@migration('order summary columns and (user_id, order_date) index')
+def order_summaries():
+    from models import Order
+    from orders import backfill_order_summaries
+    add_column_if_missing(Order, 'item_count')
+    add_column_if_missing(Order, 'items_summary')
+    create_index_if_missing(Order, 'ix_order_user_date')
+    backfilled = backfill_order_summaries()
+    click.echo(f'    backfilled {backfilled} order summaries')
+
+@migration('exact money columns (NUMERIC instead of FLOAT)')
+def money_columns():
+    from models import Product, Order, OrderItem
+    for model, column_name in ((Product, 'price'), (Order, 'total_amount'), (OrderItem, 'price')):
+        if alter_column_type_if_needed(model, column_name):
+            click.echo(f'    {model.__tablename__}.{column_name} converted')
+
+@migration('order item (order_id, product_id) index for the recommendation job')
+def order_item_index():
+    from models import OrderItem
+    create_index_if_missing(OrderItem, 'ix_order_item_order')
+
+@migration('product (available, price) index for price-sorted listings')
+def product_price_index():
+    from models import Product
+    create_index_if_missing(Product, 'ix_product_available_price')
+
+@migration('sales rollups (revenue per product per day)')
+def sales_rollups():
+    from models import ProductSalesDay
+    if add_column_if_missing(ProductSalesDay, 'revenue'):
+        # Rows so far were a 30-day window kept by the recommendation job; `flask sales
+        # rebuild` (or the next `flask sales update`) recounts them from every order
+        db.session.execute(ProductSalesDay.__table__.delete())
+        db.session.commit()
+        click.echo('    product_sales_day cleared, run `flask sales rebuild`')
+
+@migration('product updated_at index for catalog page validators')
+def product_updated_at_index():
+    from models import Product
+    create_index_if_missing(Product, 'ix_product_updated_at')
+
+@migration('64-bit watermark values (catalog version times)')
+def watermark_bigint():
+    from models import Watermark
+    alter_column_type_if_needed(Watermark, 'value')
+
+def init_migrations(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Create missing tables, then add new columns/indexes and backfill data."""
+        db.create_all()
+        for name, func in MIGRATIONS:
+            click.echo(f'  {name}')
+            func()
+        click.echo('Database is up to date.')
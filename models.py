@@ -3,7 +3,7 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash # For password hashing
+from passwords import password_hasher # Bounded, configurable password hashing (see passwords.py)
 
 db = SQLAlchemy() # Initialize SQLAlchemy here, it will be linked to the app later
 
@@ -21,11 +21,21 @@ class User(UserMixin, db.Model):
 
     def set_password(self, password):
         # Hashes the password before storing it
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        # Checks if the provided password matches the stored hash
-        return check_password_hash(self.password_hash, password)
+        # Checks if the provided password matches the stored hash. On a match, a hash made
+        # with an older method or cost is replaced (saved with the caller's next commit).
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+        return True
+
+    @property
+    def cart_count(self):
+        # Number of lines in the cart, without loading the CartItem rows
+        return CartItem.query.filter_by(user_id=self.id).count()
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -48,7 +58,7 @@ class Product(db.Model):
     name = db.Column(db.String(200), nullable=False)
     slug = db.Column(db.String(200), unique=True, nullable=False) # URL-friendly name
     description = db.Column(db.Text, nullable=True)
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Numeric(10, 2), nullable=False) # Exact: read back as Decimal
     stock = db.Column(db.Integer, default=0)
     image_filename = db.Column(db.String(200), nullable=True) # Stores filename of the product image
     available = db.Column(db.Boolean, default=True)
@@ -58,6 +68,16 @@ class Product(db.Model):
     # Foreign key to Category
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
 
+    # Composite indexes so the catalog listings are index range scans, not full table scans
+    __table_args__ = (
+        db.Index('ix_product_available_name', 'available', 'name', 'id'),
+        db.Index('ix_product_available_category_name', 'available', 'category_id', 'name', 'id'),
+        db.Index('ix_product_available_created_at', 'available', 'created_at'),
+        db.Index('ix_product_available_price', 'available', 'price', 'id'),
+        # max(updated_at) dates the catalog pages for conditional requests (cache.last_modified)
+        db.Index('ix_product_updated_at', 'updated_at'),
+    )
+
     def __repr__(self):
         return f'<Product {self.name}>'
 
@@ -80,13 +100,21 @@ class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     order_date = db.Column(db.DateTime, default=datetime.utcnow)
-    total_amount = db.Column(db.Float, nullable=False)
+    total_amount = db.Column(db.Numeric(12, 2), nullable=False)
     shipping_address = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(50), default='Pending') # e.g., Pending, Shipped, Delivered
+    # Denormalized at checkout so order history renders from the order rows alone
+    item_count = db.Column(db.Integer, nullable=True)
+    items_summary = db.Column(db.String(255), nullable=True) # First few product names
 
     # Relationship: an order can have multiple order items
     order_items = db.relationship('OrderItem', backref='order', lazy=True)
 
+    # Order history pages through a user's orders newest first
+    __table_args__ = (
+        db.Index('ix_order_user_date', 'user_id', 'order_date', 'id'),
+    )
+
     def __repr__(self):
         return f'<Order {self.id} User:{self.user_id} Total:{self.total_amount}>'
 
@@ -96,10 +124,160 @@ class OrderItem(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False) # Price at the time of order
+    price = db.Column(db.Numeric(10, 2), nullable=False) # Price at the time of order
 
     # Relationship to Product
     product = db.relationship('Product', lazy=True)
 
+    # The recommendation job reads order lines one range of order ids at a time
+    __table_args__ = (
+        db.Index('ix_order_item_order', 'order_id', 'product_id'),
+    )
+
     def __repr__(self):
         return f'<OrderItem Order:{self.order_id} Product:{self.product_id} Qty:{self.quantity}>'
+
+# --- Recommendation tables (maintained by `flask recommendations update`, see recommendations.py) ---
+
+# ProductPair: number of orders that contained both products, stored in both directions.
+# The row with other_id == product_id holds the number of orders containing the product.
+class ProductPair(db.Model):
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ProductPair {self.product_id}-{self.other_id}: {self.orders}>'
+
+# Sales rollups (maintained by `flask sales update`, see sales.py). Every row is a day's
+# running total, so reports over a date range read a few rows per day, however many orders there are.
+
+# ProductSalesDay: units and revenue per product per day
+class ProductSalesDay(db.Model):
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_product_sales_day_day', 'day'),
+    )
+
+    def __repr__(self):
+        return f'<ProductSalesDay {self.product_id} {self.day}: {self.units}>'
+
+# ProductSalesMonth: the same per calendar month (month is its first day), so long periods
+# read a row per product per month instead of per day
+class ProductSalesMonth(db.Model):
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Date, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_product_sales_month_month', 'month'),
+    )
+
+    def __repr__(self):
+        return f'<ProductSalesMonth {self.product_id} {self.month}: {self.units}>'
+
+# SalesDay: orders, units and revenue per day
+class SalesDay(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SalesDay {self.day}: {self.revenue}>'
+
+# CategorySalesDay: units and revenue per category per day; category_id 0 is uncategorized
+class CategorySalesDay(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CategorySalesDay {self.day} {self.category_id}: {self.revenue}>'
+
+# RelatedProduct: precomputed "frequently bought together" list, read by rank
+class RelatedProduct(db.Model):
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    related = db.relationship('Product', lazy=True)
+
+    def __repr__(self):
+        return f'<RelatedProduct {self.product_id} #{self.rank}: {self.related_id}>'
+
+# Bestseller: precomputed rankings per category; category_id 0 is the whole catalog
+class Bestseller(db.Model):
+    category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+
+    product = db.relationship('Product', lazy=True)
+
+    def __repr__(self):
+        return f'<Bestseller {self.category_id} #{self.rank}: {self.product_id}>'
+
+# Watermark: how far a background job has got, e.g. the last order id it processed
+# (also the catalog version, the unix time of the last catalog change: see cache.py)
+class Watermark(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    # 64-bit: unix times outgrow a 32-bit INT in 2038
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def get(cls, name):
+        row = db.session.get(cls, name)
+        return row.value if row else 0
+
+    @classmethod
+    def set(cls, name, value):
+        # Saved with the caller's transaction, so progress and results commit together
+        db.session.merge(cls(name=name, value=value))
+
+    def __repr__(self):
+        return f'<Watermark {self.name}={self.value}>'
+
+# CatalogChange: the products each catalog version changed (see cache.py), so other
+# processes re-read just those rows instead of rebuilding; product_id NULL means any
+# product may have changed. Old rows are pruned as new versions are written.
+class CatalogChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, index=True)
+    product_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f'<CatalogChange {self.version}: {self.product_id}>'
+
+# Job: durable background work, run by `flask jobs work` (see jobs.py).
+# Finished jobs stay as 'done' until purged; 'dead' jobs are the dead-letter queue.
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON
+    # Enqueuing twice with the same key creates one job; handlers also use it to dedupe side effects
+    idempotency_key = db.Column(db.String(191), unique=True, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, running, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # Workers look for the due pending jobs, oldest first
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
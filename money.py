@@ -0,0 +1,68 @@
+# fashion-shop/money.py
+
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:  # optional: only speeds up totals_by_group
+    np = None
+
+# Money helpers.
+# Amounts are Decimal in Python and NUMERIC(_, 2) in the database, so prices and totals
+# never pick up binary floating point error. Sums over many lines are done in integer
+# minor units (cents) and converted back once at the end.
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+MINOR_UNITS = 100
+
+def to_money(value):
+    # Decimal rounded half-up to cents; floats go through str() so 19.99 stays 19.99
+    if value is None:
+        return None
+    if isinstance(value, float):
+        value = repr(value)
+    try:
+        amount = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f'not a money amount: {value!r}')
+    if not amount.is_finite():
+        raise ValueError(f'not a money amount: {value!r}')
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+def to_minor_units(amount):
+    return int(to_money(amount) * MINOR_UNITS)
+
+def from_minor_units(minor):
+    return (Decimal(int(minor)) / MINOR_UNITS).quantize(CENT)
+
+def line_total(price, quantity):
+    return to_money(price) * quantity
+
+def total(lines):
+    # Sum of price * quantity over (price, quantity) pairs
+    return from_minor_units(sum(to_minor_units(price) * quantity for price, quantity in lines))
+
+def as_json(amount):
+    # JSON has no decimal type, so amounts go out as strings ('19.90'): a JSON number is
+    # read back as a float by most clients, which is exactly what Decimal is here to avoid
+    return str(to_money(amount))
+
+def totals_by_group(group_ids, prices, quantities):
+    # {group_id: Decimal total} of price * quantity, e.g. every open cart at once.
+    # With NumPy the per-group sums are one vectorised pass adding integer cents in int64,
+    # so they are exact; amounts that could overflow int64 are summed as Python ints.
+    cents = [to_minor_units(price) for price in prices]
+    if np is not None and cents and \
+            max(map(abs, cents)) * max(map(abs, quantities)) * len(cents) < 2**63:
+        groups, index = np.unique(np.asarray(group_ids), return_inverse=True)
+        amounts = np.asarray(cents, dtype=np.int64) * np.asarray(quantities, dtype=np.int64)
+        sums = np.zeros(len(groups), dtype=np.int64)
+        np.add.at(sums, index, amounts)
+        return {group.item(): from_minor_units(minor) for group, minor in zip(groups, sums.tolist())}
+
+    sums = defaultdict(int)
+    for group_id, minor, quantity in zip(group_ids, cents, quantities):
+        sums[group_id] += minor * quantity
+    return {group_id: from_minor_units(minor) for group_id, minor in sums.items()}
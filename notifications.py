@@ -0,0 +1,124 @@
+# fashion-shop/notifications.py
+
+import logging
+import os
+import smtplib
+from datetime import date
+from email.message import EmailMessage
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from models import db, User, Product, Order, OrderItem
+from jobs import enqueue, handler
+import sales
+
+logger = logging.getLogger(__name__)
+
+# Follow-up work after checkout, run by the job worker (jobs.py) instead of the request:
+#   order_placed  -> confirmation email to the buyer, notification to the admins,
+#                    an analytics log line, stock_low for products running out and a
+#                    sales_rollup catch-up (sales.py)
+#   stock_low     -> low-stock alert to the admins (at most one per product per day)
+#   send_email    -> one message through the configured mailer, retried on its own
+# Each email is its own job keyed by what it is about, so a retry of one never resends another.
+
+class FileMailer:
+    # Writes each message to MAIL_FILE_DIR as <key>.eml; resending the same key overwrites it
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, message, key):
+        path = os.path.join(self.directory, f"{key.replace(':', '_').replace('/', '_')}.eml")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(bytes(message))
+        os.replace(path + '.tmp', path)
+
+class SMTPMailer:
+    def __init__(self, host, port, username=None, password=None, use_tls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+
+    def send(self, message, key):
+        message['X-Idempotency-Key'] = key
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+def make_mailer(app):
+    if app.config.get('MAIL_BACKEND', 'file') == 'smtp':
+        return SMTPMailer(app.config['MAIL_SMTP_HOST'], app.config['MAIL_SMTP_PORT'],
+                          app.config.get('MAIL_SMTP_USERNAME'), app.config.get('MAIL_SMTP_PASSWORD'),
+                          app.config.get('MAIL_SMTP_USE_TLS', True))
+    return FileMailer(app.config['MAIL_FILE_DIR'])
+
+mailer = None
+
+def queue_email(to, subject, body, key):
+    # Enqueues one message; `to` is a list of addresses
+    if to:
+        enqueue('send_email', {'to': to, 'subject': subject, 'body': body}, key=key)
+
+def _admin_emails():
+    return db.session.scalars(select(User.email).where(User.is_admin.is_(True))).all()
+
+# --- Handlers ---
+
+@handler('send_email')
+def send_email(payload, job):
+    message = EmailMessage()
+    message['From'] = current_app.config['MAIL_FROM']
+    message['To'] = ', '.join(payload['to'])
+    message['Subject'] = payload['subject']
+    message.set_content(payload['body'])
+    mailer.send(message, job.idempotency_key or f'job-{job.id}')
+
+@handler('order_placed')
+def order_placed(payload, job):
+    order = Order.query.options(joinedload(Order.order_items).joinedload(OrderItem.product)) \
+        .filter_by(id=payload['order_id']).first()
+    if order is None:
+        return  # deleted since; nothing left to tell anyone
+    user = db.session.get(User, order.user_id)
+    lines = '\n'.join(f'  {item.quantity} x {item.product.name if item.product else item.product_id} '
+                      f'@ ${item.price:.2f}' for item in order.order_items)
+    summary = f'Order #{order.id}\n{lines}\nTotal: ${order.total_amount:.2f}\nShip to: {order.shipping_address}'
+
+    if user is not None and user.email:
+        queue_email([user.email], f'Your Fashion Shop order #{order.id}',
+                    f'Hi {user.username},\n\nThanks for your order!\n\n{summary}\n',
+                    key=f'email:order_confirmation:{order.id}')
+    queue_email(_admin_emails(), f'New order #{order.id}',
+                f"{user.username if user else order.user_id} placed an order.\n\n{summary}\n",
+                key=f'email:order_admin:{order.id}')
+
+    logger.info('analytics order_placed order=%s user=%s items=%s total=%s',
+                order.id, order.user_id, order.item_count, order.total_amount)
+
+    sales.queue_catch_up()
+
+    threshold = current_app.config.get('LOW_STOCK_THRESHOLD', 5)
+    for item in order.order_items:
+        if item.product is not None and item.product.stock <= threshold:
+            enqueue('stock_low', {'product_id': item.product_id},
+                    key=f'stock_low:{item.product_id}:{date.today().isoformat()}')
+
+@handler('stock_low')
+def stock_low(payload, job):
+    product = db.session.get(Product, payload['product_id'])
+    if product is None:
+        return
+    queue_email(_admin_emails(), f'Low stock: {product.name}',
+                f'{product.name} ({product.slug}) is down to {product.stock} in stock.\n',
+                key=f'email:{job.idempotency_key or job.id}')
+
+def init_notifications(app):
+    global mailer
+    mailer = make_mailer(app)
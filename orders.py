@@ -0,0 +1,175 @@
+# fashion-shop/orders.py
+
+from datetime import datetime, timedelta
+from sqlalchemy import case, insert, select, update
+from models import db, Product, CartItem, Order, OrderItem
+from money import total
+from jobs import enqueue
+from cache import bump_catalog_version, product_pages_changed
+
+# Checkout engine: turns a user's cart into an Order in a fixed number of statements.
+# Stock is reserved with one conditional UPDATE, so two buyers racing for the last
+# unit can never both succeed (the database re-checks `stock >= quantity` per row).
+# That bulk UPDATE bypasses the ORM hooks that invalidate catalog data, so checkout says
+# what changed itself: the bought products' pages (they show the stock count), and when a
+# product sells out the catalog version, since listings, facet counts and search show it
+# as out of stock.
+# Follow-up work (emails, stock alerts) is only enqueued here, in the same transaction,
+# and run later by the job worker (see jobs.py / notifications.py).
+
+class OutOfStockError(Exception):
+    def __init__(self, shortfalls):
+        # shortfalls: list of dicts with product_id, name, requested and available
+        self.shortfalls = shortfalls
+        super().__init__(', '.join(f"{s['name']} (requested {s['requested']}, available {s['available']})"
+                                   for s in shortfalls))
+
+class EmptyCartError(Exception):
+    pass
+
+# Orders newer than this may still be committing behind a later id, so readers that walk
+# orders by id (recommendations, sales rollups) stop short of them
+SETTLE_SECONDS = 60
+
+def last_settled_order_id():
+    # Walks back from the newest order id, so this reads a handful of rows, not the table
+    settled = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+    return db.session.scalar(
+        select(Order.id).where(Order.order_date <= settled).order_by(Order.id.desc()).limit(1)
+    ) or 0
+
+# How many product names are kept in Order.items_summary
+SUMMARY_NAMES = 3
+
+def build_summary(names):
+    # Comma-separated first few product names, trimmed to fit Order.items_summary
+    summary = ', '.join(names[:SUMMARY_NAMES])
+    if len(names) > SUMMARY_NAMES:
+        summary += f' and {len(names) - SUMMARY_NAMES} more'
+    return summary[:255]
+
+def _load_cart_lines(user_id):
+    # One query: cart rows joined to the product columns checkout needs
+    rows = db.session.execute(
+        select(CartItem.id, CartItem.product_id, CartItem.quantity, Product.price, Product.name, Product.slug)
+        .join(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == user_id)
+    ).all()
+
+    # Merge duplicate lines for the same product so each product is decremented once
+    lines = {}
+    cart_item_ids = []
+    for cart_item_id, product_id, quantity, price, name, slug in rows:
+        cart_item_ids.append(cart_item_id)
+        if product_id in lines:
+            lines[product_id]['quantity'] += quantity
+        else:
+            lines[product_id] = {'product_id': product_id, 'quantity': quantity, 'price': price, 'name': name,
+                                 'slug': slug}
+    return list(lines.values()), cart_item_ids
+
+def _find_shortfalls(lines):
+    rows = db.session.execute(
+        select(Product.id, Product.name, Product.stock, Product.available)
+        .where(Product.id.in_([line['product_id'] for line in lines]))
+    ).all()
+    stock = {row.id: row for row in rows}
+    shortfalls = []
+    for line in lines:
+        row = stock.get(line['product_id'])
+        available = row.stock if row is not None and row.available else 0
+        if available < line['quantity']:
+            shortfalls.append({
+                'product_id': line['product_id'],
+                'name': row.name if row is not None else f"Product {line['product_id']}",
+                'requested': line['quantity'],
+                'available': available,
+            })
+    return shortfalls
+
+def place_order(user_id, shipping_address):
+    # Returns the committed Order, or raises EmptyCartError / OutOfStockError after rolling back
+    try:
+        lines, cart_item_ids = _load_cart_lines(user_id)
+        if not lines:
+            raise EmptyCartError()
+
+        product_ids = [line['product_id'] for line in lines]
+        quantity_for = case({line['product_id']: line['quantity'] for line in lines}, value=Product.id)
+
+        # Reserve stock for every line at once; a row only matches if it still has enough stock
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id.in_(product_ids),
+                   Product.available.is_(True),
+                   Product.stock >= quantity_for)
+            .values(stock=Product.stock - quantity_for)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(lines):
+            # Undo the partial reservation first so the shortfall report sees real stock levels
+            db.session.rollback()
+            raise OutOfStockError(_find_shortfalls(lines))
+        product_pages_changed(line['slug'] for line in lines)
+        sold_out = db.session.scalars(
+            select(Product.id).where(Product.id.in_(product_ids), Product.stock <= 0)).all()
+        if sold_out:
+            bump_catalog_version(sold_out)
+
+        order = Order(
+            user_id=user_id,
+            total_amount=total((line['price'], line['quantity']) for line in lines),
+            shipping_address=shipping_address,
+            status='Pending',
+            item_count=sum(line['quantity'] for line in lines),
+            items_summary=build_summary([line['name'] for line in lines])
+        )
+        db.session.add(order)
+        db.session.flush()
+
+        db.session.execute(insert(OrderItem), [
+            {'order_id': order.id, 'product_id': line['product_id'],
+             'quantity': line['quantity'], 'price': line['price']}
+            for line in lines
+        ])
+        # Only delete the rows we priced, in case the user added something meanwhile
+        db.session.execute(
+            CartItem.__table__.delete().where(CartItem.id.in_(cart_item_ids))
+        )
+        # A brand-new order id cannot have a job yet, so no idempotency key lookup is needed
+        enqueue('order_placed', {'order_id': order.id})
+        db.session.commit()
+        return order
+    except Exception:
+        db.session.rollback()
+        raise
+
+def backfill_order_summaries(batch_size=1000):
+    # Fills item_count/items_summary for orders placed before they existed, in id-ordered batches
+    done = 0
+    last_id = 0
+    while True:
+        order_ids = db.session.scalars(
+            select(Order.id).where(Order.id > last_id, Order.item_count.is_(None))
+            .order_by(Order.id).limit(batch_size)
+        ).all()
+        if not order_ids:
+            return done
+        rows = db.session.execute(
+            select(OrderItem.order_id, OrderItem.quantity, Product.name)
+            .join(Product, Product.id == OrderItem.product_id)
+            .where(OrderItem.order_id.in_(order_ids))
+            .order_by(OrderItem.order_id, OrderItem.id)
+        ).all()
+        counts = dict.fromkeys(order_ids, 0)
+        names = {order_id: [] for order_id in order_ids}
+        for order_id, quantity, name in rows:
+            counts[order_id] += quantity
+            names[order_id].append(name)
+        db.session.execute(update(Order), [
+            {'id': order_id, 'item_count': counts[order_id], 'items_summary': build_summary(names[order_id])}
+            for order_id in order_ids
+        ])
+        db.session.commit()
+        done += len(order_ids)
+        last_id = order_ids[-1]
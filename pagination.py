@@ -0,0 +1,136 @@
+# fashion-shop/pagination.py
+
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, or_
+
+# Keyset (cursor) pagination helpers.
+# Instead of OFFSET, every page remembers the sort key of its first and last row
+# and the next query starts right after it, so page N costs the same as page 1.
+
+def _encode_value(value):
+    # Datetimes survive the round trip so they can be compared against DateTime columns
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return str(value)
+
+def _decode_value(obj):
+    if set(obj) == {'dt'}:
+        return datetime.fromisoformat(obj['dt'])
+    return obj
+
+def encode_cursor(values):
+    # Turns a tuple of sort-key values into an opaque, URL-safe string
+    raw = json.dumps(list(values), separators=(',', ':'), default=_encode_value).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _column_value(column, value):
+    # The cursor value as the column's Python type, or None if it cannot be one. Cursors
+    # come from the query string, so anything but a scalar of the right type is rejected.
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is int:
+        return value if type(value) is int else None
+    if python_type is Decimal:
+        if type(value) not in (str, int):
+            return None
+        try:
+            amount = Decimal(value)
+        except InvalidOperation:
+            return None
+        return amount if amount.is_finite() else None
+    if python_type in (str, datetime):
+        return value if type(value) is python_type else None
+    return None
+
+def decode_cursor(cursor, columns=None):
+    # Returns the list of sort-key values, or None if the cursor is missing/garbled. Given
+    # the sort columns, also None unless there is one value of each column's type per column.
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')), object_hook=_decode_value)
+    except (ValueError, TypeError, RecursionError):
+        return None
+    if not isinstance(values, list):
+        return None
+    if columns is None:
+        return values
+    if len(values) != len(columns):
+        return None
+    values = [_column_value(column, value) for column, value in zip(columns, values)]
+    return None if None in values else values
+
+def _greater(columns, values):
+    # (c1, c2) > (v1, v2) spelled out
+    first, rest = columns[0], columns[1:]
+    if not rest:
+        return first > values[0]
+    return or_(first > values[0], and_(first == values[0], _greater(rest, values[1:])))
+
+def _less(columns, values):
+    first, rest = columns[0], columns[1:]
+    if not rest:
+        return first < values[0]
+    return or_(first < values[0], and_(first == values[0], _less(rest, values[1:])))
+
+# The leading c1 >= v1 (<=) is implied by the OR, but it is what makes the composite index a
+# range scan: without it SQLite (with bound parameters) walks the index from its start, so
+# page N would cost N pages
+def _after(columns, values):
+    return and_(columns[0] >= values[0], _greater(columns, values))
+
+def _before(columns, values):
+    return and_(columns[0] <= values[0], _less(columns, values))
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def keyset_paginate(query, columns, key, per_page, after=None, before=None, descending=False):
+    # query:      an un-ordered query (filters already applied)
+    # columns:    the sort columns, the last one must be unique (e.g. the PK)
+    # key:        function mapping a row to its tuple of sort values
+    # descending: sort newest/largest first on every column
+    forward, backward = (_before, _after) if descending else (_after, _before)
+    forward_order = [c.desc() for c in columns] if descending else list(columns)
+    backward_order = list(columns) if descending else [c.desc() for c in columns]
+
+    after_values = decode_cursor(after, columns)
+    before_values = decode_cursor(before, columns)
+
+    if before_values is not None:
+        # Walk backwards from the cursor, then flip the rows back into display order
+        rows = query.filter(backward(columns, before_values)) \
+                    .order_by(*backward_order) \
+                    .limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        prev_cursor = encode_cursor(key(items[0])) if items and has_more else None
+        next_cursor = encode_cursor(key(items[-1])) if items else None
+    else:
+        if after_values is not None:
+            query = query.filter(forward(columns, after_values))
+        rows = query.order_by(*forward_order).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = rows[:per_page]
+        next_cursor = encode_cursor(key(items[-1])) if items and has_more else None
+        prev_cursor = encode_cursor(key(items[0])) if items and after_values is not None else None
+
+    return KeysetPage(items, next_cursor, prev_cursor, per_page)
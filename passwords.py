@@ -0,0 +1,131 @@
+# fashion-shop/passwords.py
+
+import multiprocessing
+import os
+from contextlib import contextmanager
+from werkzeug.security import generate_password_hash, check_password_hash
+from throttle import SlidingWindowCounter
+
+# Password hashing and sign-in throttling.
+# Werkzeug's hashes are deliberately expensive (~100 ms of CPU for scrypt), so a burst of
+# login or registration attempts could keep every worker hashing while catalog requests
+# wait. Two limits keep that bounded:
+#   - at most PASSWORD_HASH_CONCURRENCY hashes run at once. This is our form of a bounded
+#     executor for the hashing: sync workers cannot hand a hash to a separate pool and wait
+#     on it any cheaper than computing it, so the bound is kept and the pool dropped: each
+#     worker hashes on its own thread, holding one of the slots. The slots are a semaphore created
+#     with the application, so under gunicorn with preload_app the cap is shared by every
+#     worker. A request that gets no slot within PASSWORD_HASH_WAIT_SECONDS (none by
+#     default) fails fast (HashingBusy -> 503) rather than queueing, since a sync worker
+#     waiting for a hash is as unavailable to the catalog as one computing it.
+#   - failed logins are counted per client IP and per username over LOGIN_THROTTLE_WINDOW
+#     seconds, and registrations per IP (throttle.py); over the limit the attempt is
+#     refused (TooManyAttempts -> 429) before any hashing.
+# A login for an unknown username is still checked against a hash (dummy_hash, made with
+# PASSWORD_HASH_METHOD), so the response takes as long as a wrong password and does not
+# reveal which usernames exist.
+# A successful login re-hashes a password stored with another method or cost than
+# PASSWORD_HASH_METHOD, so raising the cost upgrades users as they sign in.
+
+class HashingBusy(Exception):
+    pass
+
+class TooManyAttempts(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Too many attempts; retry in {retry_after}s')
+        self.retry_after = retry_after
+
+def default_concurrency():
+    # Leave at least half the cores for everything else
+    return max(1, (os.cpu_count() or 2) // 2)
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = 'scrypt'
+        self.wait = 0.0
+        self._slots = None  # no cap outside an application (scripts, shell)
+        self._dummy_hash = None
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+        self.wait = app.config.get('PASSWORD_HASH_WAIT_SECONDS', 0.0)
+        self._slots = multiprocessing.BoundedSemaphore(
+            app.config.get('PASSWORD_HASH_CONCURRENCY') or default_concurrency())
+        self._dummy_hash = None
+
+    @contextmanager
+    def _slot(self):
+        if self._slots is None:
+            yield
+            return
+        if not self._slots.acquire(timeout=self.wait):
+            raise HashingBusy()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        with self._slot():
+            return generate_password_hash(password, method=self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        with self._slot():
+            return check_password_hash(password_hash, password)
+
+    @property
+    def dummy_hash(self):
+        # A hash of the empty password with the configured method: what an unknown username
+        # is checked against. No real password is empty (forms.py), so it never matches.
+        if self._dummy_hash is None:
+            self._dummy_hash = generate_password_hash('', method=self.method)
+        return self._dummy_hash
+
+    @property
+    def stored_method(self):
+        # PASSWORD_HASH_METHOD as Werkzeug writes it into a hash, e.g. 'scrypt:32768:8:1'
+        return self.dummy_hash.split('$', 1)[0]
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.stored_method
+
+class LoginThrottle:
+    def __init__(self):
+        self.attempts = None
+        self.ip_limit = self.username_limit = self.registration_limit = 0
+
+    def init_app(self, app):
+        self.attempts = SlidingWindowCounter(window=app.config.get('LOGIN_THROTTLE_WINDOW', 300))
+        # A limit of 0 turns that check off
+        self.ip_limit = app.config.get('LOGIN_FAILURES_PER_IP', 50)
+        self.username_limit = app.config.get('LOGIN_FAILURES_PER_USERNAME', 10)
+        self.registration_limit = app.config.get('REGISTRATIONS_PER_IP', 10)
+
+    def _check(self, key, limit):
+        if limit and self.attempts.count(key) >= limit:
+            raise TooManyAttempts(self.attempts.retry_after())
+
+    def check_login(self, ip, username):
+        self._check(f'login-ip:{ip}', self.ip_limit)
+        self._check(f'login-user:{username.lower()}', self.username_limit)
+
+    def login_failed(self, ip, username):
+        self.attempts.add(f'login-ip:{ip}')
+        self.attempts.add(f'login-user:{username.lower()}')
+
+    def login_succeeded(self, username):
+        self.attempts.reset(f'login-user:{username.lower()}')
+
+    def check_registration(self, ip):
+        # Every registration costs a hash, so each attempt counts, not only failed ones
+        self._check(f'register-ip:{ip}', self.registration_limit)
+        self.attempts.add(f'register-ip:{ip}')
+
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+
+def init_passwords(app):
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
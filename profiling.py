@@ -0,0 +1,208 @@
+# fashion-shop/profiling.py
+
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request, template_rendered, before_render_template
+from querybudget import query_count, query_time, write_count
+
+# Request-level profiling.
+# Every request records its wall time, SQL query count and time (from querybudget's
+# engine listeners) and Jinja render time into per-endpoint histograms, which
+# /internal/metrics/prometheus serves in Prometheus text format. Metrics are per process.
+# PROFILING_ENABLED=False turns the recording off (`flask bench profiler-overhead` measures
+# what it costs).
+#
+# With PROFILING_SAMPLE on, a background thread also samples the stacks of in-flight
+# requests and keeps folded (flamegraph.pl / speedscope compatible) stacks for the
+# slowest PROFILING_KEEP_SLOWEST requests in PROFILING_DUMP_DIR.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # label value -> [bucket counts..., sum, count]
+
+    def observe(self, label, value):
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, label_name):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_name}="{label}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_name}="{label}",le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label_name}="{label}"}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{label_name}="{label}"}} {series[-1]}')
+        return lines
+
+class StackSampler:
+    # Samples the Python stacks of threads that are currently serving a request
+    def __init__(self, interval, keep, dump_dir):
+        self.interval = interval
+        self.keep = keep
+        self.dump_dir = dump_dir
+        self.active = {}   # thread id -> Counter of folded stacks
+        self.slowest = []  # min-heap of (duration, seq, path)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        os.makedirs(dump_dir, exist_ok=True)
+        self._pid = None
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork(), so a gunicorn worker forked from a preloaded
+        # master starts its own sampler on its first request
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='request-sampler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, stacks in list(self.active.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._ensure_thread()
+        self.active[threading.get_ident()] = Counter()
+
+    def finish(self, endpoint, duration):
+        stacks = self.active.pop(threading.get_ident(), None)
+        if not stacks:
+            return
+        with self._lock:
+            if len(self.slowest) >= self.keep and duration <= self.slowest[0][0]:
+                return
+            path = os.path.join(self.dump_dir, f'{endpoint}-{int(duration * 1000)}ms-{next(self._seq)}.folded')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            heapq.heappush(self.slowest, (duration, next(self._seq), path))
+            if len(self.slowest) > self.keep:
+                _, _, evicted = heapq.heappop(self.slowest)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+class RequestProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()  # (endpoint, status) -> count
+        self.duration = Histogram('fashionshop_request_duration_seconds',
+                                  'Request wall time in seconds.', DURATION_BUCKETS)
+        self.sql_duration = Histogram('fashionshop_request_sql_seconds',
+                                      'Time spent executing SQL per request in seconds.', DURATION_BUCKETS)
+        self.sql_queries = Histogram('fashionshop_request_sql_queries',
+                                     'SQL statements executed per request.', QUERY_COUNT_BUCKETS)
+        self.sql_writes = Histogram('fashionshop_request_sql_writes',
+                                    'INSERT/UPDATE/DELETE statements executed per request.', QUERY_COUNT_BUCKETS)
+        self.render_duration = Histogram('fashionshop_request_template_seconds',
+                                         'Time spent rendering Jinja templates per request in seconds.',
+                                         DURATION_BUCKETS)
+        self.sampler = None
+        self.enabled = True
+
+    def init_app(self, app):
+        self.enabled = app.config.setdefault('PROFILING_ENABLED', True)
+        app.config.setdefault('PROFILING_SAMPLE', False)
+        if app.config['PROFILING_SAMPLE']:
+            self.sampler = StackSampler(app.config.get('PROFILING_INTERVAL', 0.005),
+                                        app.config.get('PROFILING_KEEP_SLOWEST', 20),
+                                        app.config['PROFILING_DUMP_DIR'])
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _before_request(self):
+        if not self.enabled:
+            return
+        g._profile_started = time.perf_counter()
+        g._render_time = 0.0
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def _after_request(self, response):
+        g._profile_status = response.status_code
+        return response
+
+    def _render_started(self, sender, template, context, **extra):
+        # Templates can include/extend each other, so only the outermost render is timed
+        if '_profile_started' not in g:
+            return
+        if g.get('_render_depth', 0) == 0:
+            g._render_started = time.perf_counter()
+        g._render_depth = g.get('_render_depth', 0) + 1
+
+    def _render_finished(self, sender, template, context, **extra):
+        if '_profile_started' not in g:
+            return
+        g._render_depth = g.get('_render_depth', 1) - 1
+        if g._render_depth == 0 and '_render_started' in g:
+            g._render_time = g.get('_render_time', 0.0) + time.perf_counter() - g._render_started
+
+    def _teardown_request(self, exc):
+        started = g.pop('_profile_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        status = g.get('_profile_status', 500)
+        with self._lock:
+            self.requests[(endpoint, status)] += 1
+            self.duration.observe(endpoint, duration)
+            self.sql_duration.observe(endpoint, query_time())
+            self.sql_queries.observe(endpoint, query_count())
+            self.sql_writes.observe(endpoint, write_count())
+            self.render_duration.observe(endpoint, g.get('_render_time', 0.0))
+        if self.sampler is not None:
+            self.sampler.finish(endpoint, duration)
+
+    def render_prometheus(self, extra_gauges=None):
+        lines = ['# HELP fashionshop_requests_total Requests served, by endpoint and status.',
+                 '# TYPE fashionshop_requests_total counter']
+        with self._lock:
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'fashionshop_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            for histogram in (self.duration, self.sql_duration, self.sql_queries, self.sql_writes,
+                              self.render_duration):
+                lines.extend(histogram.render('endpoint'))
+        for name, value in sorted((extra_gauges or {}).items()):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+request_profiler = RequestProfiler()
+
+def init_profiling(app):
+    request_profiler.init_app(app)
@@ -0,0 +1,85 @@
+# fashion-shop/querybudget.py
+
+import logging
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Per-request SQL query counting and timing, with an optional per-view budget.
+# A view declares its budget with @query_budget(n). When QUERY_BUDGET_ENFORCE is on
+# (tests / local benchmarking) going over the budget raises, otherwise it is logged.
+# Data-modifying statements (INSERT/UPDATE/DELETE) are also counted on their own.
+# Per-process loads that a request merely happens to trigger run under not_counted().
+
+WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE')
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and not g.get('_not_counted'):
+        g._query_count = g.get('_query_count', 0) + 1
+        if statement.lstrip()[:6].upper() in WRITE_VERBS:
+            g._write_count = g.get('_write_count', 0) + 1
+        conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is not None and has_request_context():
+        g._query_time = g.get('_query_time', 0.0) + time.perf_counter() - started
+
+def query_count():
+    # Number of SQL statements executed so far in the current request
+    return g.get('_query_count', 0)
+
+def write_count():
+    # Number of INSERT/UPDATE/DELETE statements executed so far in the current request
+    return g.get('_write_count', 0)
+
+def query_time():
+    # Seconds spent executing SQL so far in the current request
+    return g.get('_query_time', 0.0)
+
+@contextmanager
+def not_counted():
+    # For work done once per process (or per catalog change) rather than per request,
+    # e.g. rebuilding the catalog snapshot: its queries are not the view's
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('_not_counted', False)
+    g._not_counted = True
+    try:
+        yield
+    finally:
+        g._not_counted = previous
+
+def query_budget(max_queries):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g._query_budget = max_queries
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def init_query_budget(app):
+    app.config.setdefault('QUERY_BUDGET_ENFORCE', False)
+
+    @app.after_request
+    def check_query_budget(response):
+        budget = g.get('_query_budget')
+        used = query_count()
+        if budget is not None and used > budget:
+            message = f'{request.endpoint} ran {used} queries (budget {budget})'
+            if app.config['QUERY_BUDGET_ENFORCE']:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,216 @@
+# fashion-shop/recommendations.py
+
+import heapq
+import math
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from itertools import combinations
+import click
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import aliased, joinedload
+from models import (db, Bestseller, OrderItem, Product, ProductPair, ProductSalesDay,
+                    RelatedProduct, Watermark)
+from orders import last_settled_order_id
+from upsert import add_to_counters
+import sales
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional: pair counting falls back to itertools.combinations
+    np = sparse = None
+
+# "Frequently bought together" and bestsellers, precomputed from order history.
+# `flask recommendations update` (run from cron) folds orders newer than a watermark into
+# running co-occurrence counts (ProductPair: orders containing both products, i.e. the
+# item-item matrix), one range of order ids per transaction, so memory is bounded by the
+# chunk size however many order lines exist and nothing is recounted on the next run.
+# It then rewrites the serving tables:
+#   RelatedProduct   top products by cosine similarity, count(a, b) / sqrt(count(a) * count(b)),
+#                    for the products that had new orders
+#   Bestseller       top sellers of the last BESTSELLER_DAYS, per category and overall, from
+#                    the daily sales rollup (sales.py)
+# Pages read those with one indexed join each (related_products / bestsellers).
+
+WATERMARK = 'recommendations'
+ALL_CATEGORIES = 0
+ORDERS_PER_CHUNK = 20000
+RELATED_PER_PRODUCT = 8
+# Pairs seen in fewer orders than this are noise, not a recommendation
+MIN_PAIR_ORDERS = 2
+BESTSELLERS_PER_CATEGORY = 12
+BESTSELLER_DAYS = 30
+
+# --- Counting ---
+
+def count_pairs(order_ids, product_ids):
+    # (product_id, other_id, orders) for every pair of products bought in the same order,
+    # both directions, plus (product_id, product_id, orders containing it).
+    # With SciPy this is the sparse product B.T @ B of the order x product incidence matrix.
+    if sparse is not None:
+        orders, rows = np.unique(np.asarray(order_ids), return_inverse=True)
+        products, cols = np.unique(np.asarray(product_ids), return_inverse=True)
+        incidence = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                      shape=(len(orders), len(products)))
+        incidence.data[:] = 1  # a product on two lines of one order still counts once
+        co = (incidence.T @ incidence).tocoo()
+        return zip(products[co.row].tolist(), products[co.col].tolist(), co.data.tolist())
+
+    baskets = defaultdict(set)
+    for order_id, product_id in zip(order_ids, product_ids):
+        baskets[order_id].add(product_id)
+    counts = Counter()
+    for basket in baskets.values():
+        for product_id in basket:
+            counts[product_id, product_id] += 1
+        for a, b in combinations(basket, 2):
+            counts[a, b] += 1
+            counts[b, a] += 1
+    return ((a, b, n) for (a, b), n in counts.items())
+
+def process_new_orders(chunk_size=ORDERS_PER_CHUNK, on_chunk=None):
+    # Adds orders after the watermark to the pair counts. Each chunk commits together
+    # with the new watermark, so an interrupted run resumes where it stopped.
+    # Returns (orders processed, ids of the products in them).
+    last_id = Watermark.get(WATERMARK)
+    max_id = last_settled_order_id()
+    processed, touched = 0, set()
+
+    while last_id < max_id:
+        upper = min(last_id + chunk_size, max_id)
+        lines = db.session.execute(
+            select(OrderItem.order_id, OrderItem.product_id)
+            .where(OrderItem.order_id > last_id, OrderItem.order_id <= upper)
+        ).all()
+        if lines:
+            pairs = count_pairs([line.order_id for line in lines], [line.product_id for line in lines])
+            add_to_counters(ProductPair, [{'product_id': a, 'other_id': b, 'orders': n} for a, b, n in pairs],
+                            ['product_id', 'other_id'], ['orders'])
+            processed += len({line.order_id for line in lines})
+            touched.update(line.product_id for line in lines)
+        Watermark.set(WATERMARK, upper)
+        db.session.commit()
+        last_id = upper
+        if on_chunk:
+            on_chunk(upper, max_id)
+    return processed, touched
+
+# --- Serving tables ---
+
+def refresh_related(product_ids, batch_size=200):
+    # Rewrites the RelatedProduct rows of the given products from the pair counts. Only
+    # products with new orders are redone; their partners' scores drift slightly as the
+    # partners' own totals grow, which `update --rebuild` corrects.
+    own, other = aliased(ProductPair), aliased(ProductPair)
+    ids = sorted(product_ids)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        rows = db.session.execute(
+            select(ProductPair.product_id, ProductPair.other_id, ProductPair.orders,
+                   own.orders.label('product_orders'), other.orders.label('other_orders'))
+            .join(own, (own.product_id == ProductPair.product_id) & (own.other_id == ProductPair.product_id))
+            .join(other, (other.product_id == ProductPair.other_id) & (other.other_id == ProductPair.other_id))
+            .where(ProductPair.product_id.in_(batch),
+                   ProductPair.other_id != ProductPair.product_id,
+                   ProductPair.orders >= MIN_PAIR_ORDERS)
+        ).all()
+
+        candidates = defaultdict(list)
+        for row in rows:
+            score = row.orders / math.sqrt(row.product_orders * row.other_orders)
+            candidates[row.product_id].append((score, row.orders, row.other_id))
+        related = [
+            {'product_id': product_id, 'rank': rank, 'related_id': other_id, 'score': score}
+            for product_id, scored in candidates.items()
+            for rank, (score, _, other_id) in enumerate(heapq.nlargest(RELATED_PER_PRODUCT, scored), start=1)
+        ]
+        db.session.execute(delete(RelatedProduct).where(RelatedProduct.product_id.in_(batch)))
+        if related:
+            db.session.execute(insert(RelatedProduct), related)
+        db.session.commit()
+
+def refresh_bestsellers(today=None):
+    # Re-ranks the sales of the last BESTSELLER_DAYS, per category and overall
+    cutoff = (today or date.today()) - timedelta(days=BESTSELLER_DAYS)
+    rows = db.session.execute(
+        select(ProductSalesDay.product_id, Product.category_id, func.sum(ProductSalesDay.units).label('units'))
+        .join(Product, Product.id == ProductSalesDay.product_id)
+        .where(ProductSalesDay.day >= cutoff, Product.available.is_(True))
+        .group_by(ProductSalesDay.product_id, Product.category_id)
+    ).all()
+
+    by_category = defaultdict(list)
+    for row in rows:
+        by_category[ALL_CATEGORIES].append((row.units, row.product_id))
+        if row.category_id is not None:
+            by_category[row.category_id].append((row.units, row.product_id))
+    rankings = [
+        {'category_id': category_id, 'rank': rank, 'product_id': product_id, 'units': units}
+        for category_id, sold in by_category.items()
+        for rank, (units, product_id) in enumerate(heapq.nlargest(BESTSELLERS_PER_CATEGORY, sold), start=1)
+    ]
+    # Returns whether the rankings changed; unchanged ones are left as they are
+    current = db.session.execute(
+        select(Bestseller.category_id, Bestseller.rank, Bestseller.product_id, Bestseller.units)).all()
+    if {tuple(row) for row in current} == {tuple(r.values()) for r in rankings}:
+        return False
+    db.session.execute(delete(Bestseller))
+    if rankings:
+        db.session.execute(insert(Bestseller), rankings)
+    db.session.commit()
+    return True
+
+def reset():
+    for model in (ProductPair, RelatedProduct, Bestseller):
+        db.session.execute(delete(model))
+    Watermark.set(WATERMARK, 0)
+    db.session.commit()
+
+def update(rebuild=False, on_chunk=None):
+    # Returns (orders processed, products whose related list was recomputed)
+    from cache import pages_changed
+    if rebuild:
+        reset()
+    processed, touched = process_new_orders(on_chunk=on_chunk)
+    refresh_related(touched)
+    sales.catch_up()  # bestsellers are ranked from the daily sales rollup
+    reranked = refresh_bestsellers()
+    # The serving tables are written with bulk statements, so cached pages need telling.
+    # Nothing indexed changed, so only the pages version moves, and only if pages differ.
+    if rebuild or touched or reranked:
+        pages_changed()
+        db.session.commit()
+    return processed, len(touched)
+
+# --- Reading ---
+
+def related_products(product_id, limit=RELATED_PER_PRODUCT):
+    # "Frequently bought together", best first: one join on RelatedProduct's primary key
+    return Product.query.options(joinedload(Product.category)) \
+        .join(RelatedProduct, RelatedProduct.related_id == Product.id) \
+        .filter(RelatedProduct.product_id == product_id, Product.available.is_(True)) \
+        .order_by(RelatedProduct.rank).limit(limit).all()
+
+def bestsellers(category_id=ALL_CATEGORIES, limit=8):
+    return Product.query.options(joinedload(Product.category)) \
+        .join(Bestseller, Bestseller.product_id == Product.id) \
+        .filter(Bestseller.category_id == category_id, Product.available.is_(True)) \
+        .order_by(Bestseller.rank).limit(limit).all()
+
+def init_recommendations(app):
+    @app.cli.group('recommendations')
+    def recommendations():
+        """Precomputed related products and bestsellers."""
+
+    @recommendations.command('update')
+    @click.option('--rebuild', is_flag=True, help='Discard the pair counts and recount all orders.')
+    def update_command(rebuild):
+        """Fold new orders into the counts and refresh related products and bestsellers."""
+        def on_chunk(upper, max_id):
+            click.echo(f'\r  orders up to #{upper} of #{max_id}', nl=False)
+
+        processed, refreshed = update(rebuild, on_chunk)
+        if processed:
+            click.echo('')
+        click.echo(f'{processed} new orders, related products refreshed for {refreshed} products, '
+                   f'bestsellers re-ranked over {BESTSELLER_DAYS} days.')
@@ -1,64 +1,279 @@
 # fashion-shop/routes.py
 
-from flask import render_template, url_for, flash, redirect, request, abort, jsonify
-from app import app, db # Import app and db from our main app.py
-from models import User, Product, Category, CartItem, Order, OrderItem
-from forms import RegistrationForm, LoginForm, AddProductForm, CheckoutForm
+from flask import (render_template, url_for, flash, redirect, request, abort, jsonify, Response, stream_with_context,
+                   current_app)
+from models import db, User, Product, Category, CartItem, Order, OrderItem, RelatedProduct
+from forms import RegistrationForm, LoginForm, AddProductForm, CheckoutForm, ImportProductsForm
+from pagination import keyset_paginate
+from querybudget import query_budget
+from orders import place_order, OutOfStockError, EmptyCartError
+from search import get_index
+from facets import get_facets, apply_filters, PRICE_BANDS, PRICE_BANDS_BY_KEY
+from snapshot import get_snapshot
+from images import image_pipeline
+from cache import cached_page
+from dbpool import pool_metrics
+from profiling import request_profiler
+from catalog_io import import_products, export_products, detect_format
+import cache
+import guest_cart
+import carts
+import money
+import recommendations
+import sales
+from carts import CartError
+from passwords import password_hasher, login_throttle, HashingBusy, TooManyAttempts
+from sqlalchemy import or_, select
+from sqlalchemy.orm import joinedload, selectinload
 from flask_login import login_user, current_user, logout_user, login_required
+import io
 import os
+from itertools import islice
 from werkzeug.utils import secure_filename # For secure filename handling
 from werkzeug.datastructures import FileStorage # NEW IMPORT
 
+class RouteTable:
+    # Collects the views below; create_app() (app.py) adds them to the application it builds.
+    # Unlike a Blueprint this keeps the plain endpoint names that url_for() calls use everywhere.
+    def __init__(self):
+        self.rules = []           # (rule, endpoint, view, options)
+        self.error_handlers = []  # (code, handler)
+
+    def route(self, rule, **options):
+        def decorator(view):
+            self.rules.append((rule, options.pop('endpoint', None), view, options))
+            return view
+        return decorator
+
+    def errorhandler(self, code):
+        def decorator(handler):
+            self.error_handlers.append((code, handler))
+            return handler
+        return decorator
+
+    def init_app(self, app):
+        for rule, endpoint, view, options in self.rules:
+            app.add_url_rule(rule, endpoint, view, **options)
+        for code, handler in self.error_handlers:
+            app.register_error_handler(code, handler)
+
+shop = RouteTable()
+
+def init_routes(app):
+    shop.init_app(app)
+
 # Helper function to check allowed image file extensions
 def allowed_file(filename):
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+# Listing sort orders: (keyset columns, row -> cursor values, descending)
+PRODUCT_SORTS = {
+    'name': ([Product.name, Product.id], lambda p: (p.name, p.id), False),
+    'price_asc': ([Product.price, Product.id], lambda p: (p.price, p.id), False),
+    'price_desc': ([Product.price, Product.id], lambda p: (p.price, p.id), True),
+    'newest': ([Product.created_at, Product.id], lambda p: (p.created_at, p.id), True),
+}
+SORT_LABELS = {'name': 'Name', 'price_asc': 'Price: low to high',
+               'price_desc': 'Price: high to low', 'newest': 'Newest'}
+
+def paginate_products(query, sort='name'):
+    columns, key, descending = PRODUCT_SORTS[sort]
+    return keyset_paginate(
+        query,
+        columns=columns,
+        key=key,
+        per_page=current_app.config['PRODUCTS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        descending=descending
+    )
+
+def listing_filters():
+    # Facet selections from the query string; unknown values are ignored
+    price = request.args.get('price')
+    sort = request.args.get('sort')
+    return {
+        'price': price if price in PRICE_BANDS_BY_KEY else None,
+        'in_stock': request.args.get('in_stock') == '1',
+        'sort': sort if sort in PRODUCT_SORTS else 'name',
+    }
+
+def render_listing(category=None):
+    # Shared by /products and /products/category/<slug>: one page query, facet counts from memory
+    filters = listing_filters()
+    query = Product.query.options(joinedload(Product.category)).filter_by(available=True)
+    if category is not None:
+        query = query.filter_by(category_id=category.id)
+    page = paginate_products(apply_filters(query, filters['price'], filters['in_stock']), filters['sort'])
+    facets = get_facets()
+    counts = facets.counts(category.id if category is not None else None, filters['price'], filters['in_stock'])
+    return render_template('products.html', products=page.items, page=page, categories=facets.categories(),
+                           current_category=category, filters=filters, facet_counts=counts,
+                           price_bands=PRICE_BANDS, sort_labels=SORT_LABELS)
 
 # --- Public Routes ---
 
-@app.route('/')
-@app.route('/home')
+# Last-modified times for conditional requests (see cache.cached_page)
+def catalog_changed(**view_args):
+    # Listings, search and the home page can show any product
+    return cache.catalog_last_modified()
+
+def product_page_changed(slug):
+    # The product and its "frequently bought together" list
+    product_id = get_snapshot().product_ids.get(slug)
+    if product_id is None:  # newer than the snapshot
+        product_id = select(Product.id).where(Product.slug == slug, Product.available.is_(True)).scalar_subquery()
+    return cache.catalog_last_modified(select(Product.id).where(or_(
+        Product.id == product_id,
+        Product.id.in_(select(RelatedProduct.related_id).where(RelatedProduct.product_id == product_id)))))
+
+@shop.route('/')
+@shop.route('/home')
+@cached_page(last_modified=catalog_changed)
+@query_budget(5)
 def home():
-    products = Product.query.filter_by(available=True).order_by(Product.created_at.desc()).limit(8).all()
-    # Pass a form instance for CSRF protection
-    form = LoginForm()
-    return render_template('index.html', products=products, form=form)
-
-@app.route('/products')
+    bestsellers = recommendations.bestsellers(limit=8)
+    products = []
+    if not bestsellers:  # no rankings yet (`flask recommendations update` not run)
+        products = Product.query.options(joinedload(Product.category)) \
+            .filter_by(available=True).order_by(Product.created_at.desc()).limit(8).all()
+    return render_template('index.html', bestsellers=bestsellers, products=products)
+
+@shop.route('/products')
+@cached_page(last_modified=catalog_changed)
+@query_budget(5)
 def products():
-    products = Product.query.filter_by(available=True).order_by(Product.name).all()
-    categories = Category.query.all()
-    # Pass a form instance for CSRF protection
-    form = LoginForm()
-    return render_template('products.html', products=products, categories=categories, form=form)
+    return render_listing()
 
-@app.route('/products/category/<string:slug>')
+@shop.route('/products/category/<string:slug>')
+@cached_page(last_modified=catalog_changed)
+@query_budget(6)
 def products_by_category(slug):
-    category = Category.query.filter_by(slug=slug).first_or_404()
-    products = Product.query.filter_by(category=category, available=True).order_by(Product.name).all()
-    categories = Category.query.all()
-    # Pass a form instance for CSRF protection
-    form = LoginForm()
-    return render_template('products.html', products=products, categories=categories, current_category=category, form=form)
+    # Categories come from the catalog snapshot; the query only runs for one it has not seen yet
+    category = get_snapshot().category_by_slug.get(slug) or Category.query.filter_by(slug=slug).first_or_404()
+    return render_listing(category)
 
-@app.route('/product/<string:slug>')
+@shop.route('/product/<string:slug>')
+@cached_page(last_modified=product_page_changed, versions=lambda slug: [cache.product_page(slug)])
+@query_budget(5)
 def product_detail(slug):
-    product = Product.query.filter_by(slug=slug, available=True).first_or_404()
-    # Pass a form instance for CSRF protection
-    form = LoginForm()
-    return render_template('product_detail.html', product=product, form=form)
+    product = Product.query.options(joinedload(Product.category)) \
+        .filter_by(slug=slug, available=True).first_or_404()
+    related = recommendations.related_products(product.id)
+    return render_template('product_detail.html', product=product, related=related)
+
+# --- Search Routes ---
+
+# Reads the shared search parameters from the query string
+def search_args():
+    def to_float(value):
+        try:
+            return float(value) if value not in (None, '') else None
+        except ValueError:
+            return None
+    category_slug = request.args.get('category')
+    category = None
+    if category_slug:
+        category = get_snapshot().category_by_slug.get(category_slug) \
+            or Category.query.filter_by(slug=category_slug).first()
+    return {
+        'query': request.args.get('q', '').strip(),
+        'category': category,
+        'min_price': to_float(request.args.get('min_price')),
+        'max_price': to_float(request.args.get('max_price')),
+        'in_stock': request.args.get('in_stock') in ('1', 'true', 'on'),
+        'limit': max(1, min(request.args.get('limit', 24, type=int) or 24, 100)),
+    }
+
+# How many ranked hits each in-stock check looks at
+IN_STOCK_CHUNK = 100
+
+# Runs a search and loads the matching products, keeping the ranking order
+def run_search(args, prefix):
+    ranking = get_index().ranking(
+        args['query'],
+        prefix=prefix,
+        category_id=args['category'].id if args['category'] else None,
+        min_price=args['min_price'],
+        max_price=args['max_price']
+    )
+    if args['in_stock']:
+        # Stock is not in the index: read the ranking a chunk at a time until a page is in stock
+        in_stock = []
+        while len(in_stock) < args['limit']:
+            chunk = list(islice(ranking, IN_STOCK_CHUNK))
+            if not chunk:
+                break
+            stocked = set(db.session.scalars(select(Product.id).where(
+                Product.id.in_([product_id for product_id, _ in chunk]), Product.stock > 0)))
+            in_stock += [hit for hit in chunk if hit[0] in stocked]
+        hits = in_stock[:args['limit']]
+    else:
+        hits = list(islice(ranking, args['limit']))
+    if not hits:
+        return []
+    by_id = {p.id: p for p in Product.query.options(joinedload(Product.category))
+             .filter(Product.id.in_([product_id for product_id, _ in hits])).all()}
+    # The rows are re-checked in case a product sold out or was withdrawn since
+    return [(by_id[product_id], score) for product_id, score in hits
+            if product_id in by_id and by_id[product_id].available
+            and (not args['in_stock'] or by_id[product_id].stock > 0)]
+
+@shop.route('/search')
+@cached_page(last_modified=catalog_changed)
+@query_budget(5)
+def search():
+    args = search_args()
+    results = run_search(args, prefix=False) if args['query'] else []
+    return render_template('search.html', products=[product for product, _ in results],
+                           categories=get_snapshot().categories, search=args)
+
+@shop.route('/api/search')
+@query_budget(4)
+def api_search():
+    # JSON endpoint for type-ahead: the last word is matched as a prefix
+    args = search_args()
+    results = run_search(args, prefix=True) if args['query'] else []
+    return jsonify({
+        'query': args['query'],
+        'results': [{
+            'id': product.id,
+            'name': product.name,
+            'slug': product.slug,
+            'price': money.as_json(product.price),
+            'category': product.category.name if product.category else None,
+            'in_stock': product.stock > 0,
+            'url': url_for('product_detail', slug=product.slug),
+            'score': round(score, 4),
+        } for product, score in results]
+    })
 
 # --- User Authentication Routes ---
 
-@app.route('/register', methods=['GET', 'POST'])
+def sign_in_refused(template, form, error):
+    # Throttled (429) or no free hashing slot (503): answered without hashing anything
+    if isinstance(error, TooManyAttempts):
+        flash('Too many attempts. Please wait a few minutes and try again.', 'danger')
+        status, retry_after = 429, error.retry_after
+    else:
+        flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'danger')
+        status, retry_after = 503, 1
+    return render_template(template, form=form), status, {'Retry-After': str(retry_after)}
+
+@shop.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('home'))
 
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User(username=form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            login_throttle.check_registration(request.remote_addr)
+            user = User(username=form.username.data, email=form.email.data)
+            user.set_password(form.password.data)
+        except (TooManyAttempts, HashingBusy) as e:
+            return sign_in_refused('register.html', form, e)
         db.session.add(user)
         db.session.commit()
         flash('Your account has been created! You can now log in.', 'success')
@@ -69,190 +284,184 @@ def register():
                 flash(f"Error in {field}: {error}", 'danger')
     return render_template('register.html', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@shop.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('home'))
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user and user.check_password(form.password.data):
+        try:
+            # Throttled before the user is even looked up, so a refused attempt costs no hash
+            login_throttle.check_login(request.remote_addr, form.username.data)
+            user = User.query.filter_by(username=form.username.data).first()
+            if user is not None:
+                authenticated = user.check_password(form.password.data)
+            else:
+                # Costs the same hash as a wrong password, so timing doesn't reveal the miss
+                password_hasher.verify(password_hasher.dummy_hash, form.password.data)
+                authenticated = False
+        except (TooManyAttempts, HashingBusy) as e:
+            return sign_in_refused('login.html', form, e)
+        if authenticated:
+            login_throttle.login_succeeded(form.username.data)
+            if user in db.session.dirty:
+                db.session.commit()  # the password was re-hashed to the configured cost
             login_user(user)
+            if guest_cart.merge_into(user.id):
+                flash('Items from your guest cart were added to your cart.', 'info')
             next_page = request.args.get('next')
             flash('Logged in successfully!', 'success')
             return redirect(next_page or url_for('home'))
         else:
+            login_throttle.login_failed(request.remote_addr, form.username.data)
             flash('Login Unsuccessful. Please check username and password', 'danger')
     return render_template('login.html', form=form)
 
-@app.route('/logout')
+@shop.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('home'))
 
-@app.route('/profile')
+@shop.route('/profile')
 @login_required
 def profile():
     return render_template('profile.html', user=current_user)
 
 # --- Cart Routes (FORM-BASED) ---
+# The no-JavaScript fallback; main.js drives the same operations through /api/cart.
+# Logged-in shoppers' carts are CartItem rows; visitors get a session cart (guest_cart.py)
+# whose lines are addressed by product id instead of CartItem id.
 
-# This route handles form submissions from the product listing and detail pages
-@app.route('/cart/add', methods=['POST'])
-@login_required
-def add_to_cart():
-    product_id = request.form.get('product_id')
-    quantity = request.form.get('quantity', 1)
-
+# Parses integer form/JSON fields, raising CartError with `message` if any is missing or invalid
+def parse_ints(source, *names, message='Invalid quantity.'):
     try:
-        product_id = int(product_id)
-        quantity = int(quantity)
-        if quantity <= 0:
-            flash('Quantity must be positive.', 'danger')
-            return redirect(request.referrer or url_for('products'))
+        return [int(source.get(name)) for name in names]
     except (ValueError, TypeError):
-        flash('Invalid product ID or quantity.', 'danger')
-        return redirect(request.referrer or url_for('products'))
-
-    product = Product.query.get(product_id)
-    if not product:
-        flash('Product not found.', 'danger')
-        return redirect(request.referrer or url_for('products'))
-    if not product.available:
-        flash('Product not available.', 'danger')
-        return redirect(request.referrer or url_for('products'))
-    if product.stock < quantity:
-        flash(f'Not enough stock for {product.name}. Available: {product.stock}.', 'danger')
-        return redirect(request.referrer or url_for('products'))
-
-    cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
-    if cart_item:
-        if product.stock < (cart_item.quantity + quantity):
-            flash(f'Adding more would exceed stock. Max available: {product.stock - cart_item.quantity}', 'danger')
-            return redirect(request.referrer or url_for('products'))
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(user_id=current_user.id, product_id=product_id, quantity=quantity)
-        db.session.add(cart_item)
+        raise CartError(message)
 
+# This route handles form submissions from the product listing and detail pages
+@shop.route('/cart/add', methods=['POST'])
+def add_to_cart():
     try:
-        db.session.commit()
-        flash(f'{product.name} added to cart successfully!', 'success')
-        return redirect(url_for('cart'))
-    except Exception:
-        db.session.rollback()
-        flash('Failed to add item to cart due to a database error.', 'danger')
+        product_id, quantity = parse_ints({'quantity': 1, **request.form.to_dict()}, 'product_id', 'quantity',
+                                          message='Invalid product ID or quantity.')
+        line = carts.add_item(product_id, quantity)
+    except CartError as e:
+        flash(str(e), 'danger')
         return redirect(request.referrer or url_for('products'))
+    flash(f"{line['name']} added to cart successfully!", 'success')
+    return redirect(url_for('cart'))
 
-@app.route('/cart/remove', methods=['POST'])
-@login_required
+@shop.route('/cart/remove', methods=['POST'])
 def remove_from_cart():
-    item_id = request.form.get('item_id')
-
-    try:
-        item_id = int(item_id)
-    except (ValueError, TypeError):
-        flash('Invalid cart item ID.', 'danger')
-        return redirect(url_for('cart'))
-
-    cart_item = CartItem.query.filter_by(id=item_id, user_id=current_user.id).first()
-    if not cart_item:
-        flash('Cart item not found.', 'danger')
-        return redirect(url_for('cart'))
-
     try:
-        db.session.delete(cart_item)
-        db.session.commit()
-        flash('Item removed from cart.', 'info')
-        return redirect(url_for('cart'))
-    except Exception:
-        db.session.rollback()
-        flash('Failed to remove item from cart due to a database error.', 'danger')
+        item_id, = parse_ints(request.form, 'item_id', message='Invalid cart item ID.')
+        carts.remove_item(item_id)
+    except CartError as e:
+        flash(str(e), 'danger')
         return redirect(url_for('cart'))
+    flash('Item removed from cart.', 'info')
+    return redirect(url_for('cart'))
 
-@app.route('/cart/update', methods=['POST'])
-@login_required
+@shop.route('/cart/update', methods=['POST'])
 def update_cart_item():
-    item_id = request.form.get('item_id')
-    quantity = request.form.get('quantity')
-
     try:
-        item_id = int(item_id)
-        quantity = int(quantity)
-        if quantity <= 0:
-            flash('Quantity must be positive.', 'danger')
-            return redirect(url_for('cart'))
-    except (ValueError, TypeError):
-        flash('Invalid quantity.', 'danger')
+        item_id, quantity = parse_ints(request.form, 'item_id', 'quantity')
+        carts.update_item(item_id, quantity)
+    except CartError as e:
+        flash(str(e), 'danger')
         return redirect(url_for('cart'))
-
-    cart_item = CartItem.query.filter_by(id=item_id, user_id=current_user.id).first()
-    if not cart_item:
-        flash('Cart item not found.', 'danger')
-        return redirect(url_for('cart'))
-
-    if cart_item.product.stock < quantity:
-        flash(f'Not enough stock for {cart_item.product.name}. Max available: {cart_item.product.stock}', 'danger')
-        return redirect(url_for('cart'))
-
-    try:
-        cart_item.quantity = quantity
-        db.session.commit()
-        flash('Cart updated.', 'success')
-    except Exception:
-        db.session.rollback()
-        flash('Failed to update cart due to a database error.', 'danger')
-
+    flash('Cart updated.', 'success')
     return redirect(url_for('cart'))
 
-@app.route('/cart')
-@login_required
+@shop.route('/cart')
+@query_budget(4)
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    cart_total = sum(item.product.price * item.quantity for item in cart_items)
+    cart_items = carts.load_items()
+    _, cart_total = carts.summary(cart_items)
     # Pass a form instance for CSRF protection
     form = LoginForm()
     return render_template('cart.html', cart_items=cart_items, cart_total=cart_total, form=form)
 
+# --- Cart API (JSON) ---
+# Same operations as the form routes, answered with the changed line plus the new
+# badge count and total so the page can update in place. CSRF-protected like every
+# other write: send the token in an X-CSRFToken header.
+
+def cart_response(status=200, **delta):
+    count, total = carts.summary()
+    return jsonify(count=count, total=money.as_json(total), **delta), status
+
+@shop.route('/api/cart', methods=['GET'])
+@query_budget(4)
+def api_cart():
+    items = carts.load_items()
+    _, total = carts.summary(items)
+    return jsonify(items=[carts.line_json(item) for item in items], count=len(items), total=money.as_json(total))
+
+@shop.route('/api/cart', methods=['POST'])
+@query_budget(5)
+def api_cart_add():
+    data = request.get_json(silent=True) or {}
+    try:
+        product_id, quantity = parse_ints({'quantity': 1, **data}, 'product_id', 'quantity',
+                                          message='Invalid product ID or quantity.')
+        line = carts.add_item(product_id, quantity)
+    except CartError as e:
+        return jsonify(error=str(e)), e.status
+    return cart_response(item=line)
+
+@shop.route('/api/cart/<int:item_id>', methods=['PATCH'])
+@query_budget(4)
+def api_cart_update(item_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        quantity, = parse_ints(data, 'quantity')
+        line = carts.update_item(item_id, quantity)
+    except CartError as e:
+        return jsonify(error=str(e)), e.status
+    return cart_response(item=line)
+
+@shop.route('/api/cart/<int:item_id>', methods=['DELETE'])
+@query_budget(4)
+def api_cart_remove(item_id):
+    try:
+        carts.remove_item(item_id)
+    except CartError as e:
+        return jsonify(error=str(e)), e.status
+    return cart_response(removed=item_id)
+
 # --- Checkout & Order Routes ---
 
-@app.route('/checkout', methods=['GET', 'POST'])
+# A checkout that sells a product out also moves the catalog version (orders.py)
+@shop.route('/checkout', methods=['GET', 'POST'])
 @login_required
+@query_budget(10)
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    cart_items = carts.load_items()
     if not cart_items:
         flash('Your cart is empty!', 'warning')
         return redirect(url_for('products'))
 
     form = CheckoutForm()
     if form.validate_on_submit():
-        total_amount = sum(item.product.price * item.quantity for item in cart_items)
         shipping_address = f"{form.address.data}, {form.city.data}, {form.postal_code.data}"
-
-        order = Order(
-            user_id=current_user.id,
-            total_amount=total_amount,
-            shipping_address=shipping_address,
-            status='Pending'
-        )
-        db.session.add(order)
-        db.session.flush()
-
-        for item in cart_items:
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-            db.session.add(order_item)
-
-            item.product.stock -= item.quantity
-            db.session.delete(item)
-
-        db.session.commit()
+        try:
+            place_order(current_user.id, shipping_address)
+            guest_cart.forget_user_count()
+        except EmptyCartError:
+            flash('Your cart is empty!', 'warning')
+            return redirect(url_for('products'))
+        except OutOfStockError as e:
+            for shortfall in e.shortfalls:
+                flash(f"Not enough stock for {shortfall['name']}. Requested: {shortfall['requested']}, "
+                      f"available: {shortfall['available']}.", 'danger')
+            return redirect(url_for('cart'))
+        except Exception:
+            flash('Failed to place your order due to a database error.', 'danger')
+            return redirect(url_for('cart'))
         flash('Your order has been placed successfully!', 'success')
         return redirect(url_for('order_history'))
     else:
@@ -262,21 +471,39 @@ def checkout():
 
     if current_user.email and not form.email.data:
         form.email.data = current_user.email
-    cart_total = sum(item.product.price * item.quantity for item in cart_items)
+    _, cart_total = carts.summary(cart_items)
     return render_template('checkout.html', form=form, cart_items=cart_items, cart_total=cart_total)
 
-@app.route('/orders')
+@shop.route('/orders')
 @login_required
+@query_budget(3)
 def order_history():
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.order_date.desc()).all()
-    return render_template('order_history.html', orders=orders)
+    # One indexed query per page; line items are loaded on the order detail page
+    page = keyset_paginate(
+        Order.query.filter_by(user_id=current_user.id),
+        columns=[Order.order_date, Order.id],
+        key=lambda o: (o.order_date, o.id),
+        per_page=current_app.config['ORDERS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        descending=True
+    )
+    return render_template('order_history.html', orders=page.items, page=page)
+
+@shop.route('/orders/<int:order_id>')
+@login_required
+@query_budget(4)
+def order_detail(order_id):
+    order = Order.query.options(selectinload(Order.order_items).joinedload(OrderItem.product)) \
+        .filter_by(id=order_id, user_id=current_user.id).first_or_404()
+    return render_template('order_detail.html', order=order)
 
 # --- Admin Routes ---
 
-@app.route('/admin/add_product', methods=['GET', 'POST'])
+@shop.route('/admin/add_product', methods=['GET', 'POST'])
 @login_required
 def admin_add_product():
-    if not current_user.is_admin:
+    if not current_user.has_admin_rights():
         abort(403)
 
     form = AddProductForm()
@@ -286,7 +513,7 @@ def admin_add_product():
         image_file = form.image_file.data
         if isinstance(image_file, FileStorage) and image_file.filename:
             filename = secure_filename(image_file.filename)
-            image_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            image_file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
             image_filename_to_save = filename
         else:
             image_filename_to_save = None
@@ -303,15 +530,102 @@ def admin_add_product():
         )
         db.session.add(product)
         db.session.commit()
+        if image_filename_to_save:
+            # Resized card/detail/zoom derivatives are generated in the background
+            image_pipeline.submit(image_filename_to_save)
         flash('Product added successfully!', 'success')
         return redirect(url_for('products'))
     return render_template('admin_add_product.html', form=form)
 
+# Rejected rows shown on the import result page; the CLI writes all of them to a file
+IMPORT_ERRORS_SHOWN = 50
+
+@shop.route('/admin/import_products', methods=['GET', 'POST'])
+@login_required
+def admin_import_products():
+    if not current_user.has_admin_rights():
+        abort(403)
+
+    form = ImportProductsForm()
+    report, errors = None, []
+    if form.validate_on_submit():
+        feed = form.feed.data
+        def on_error(line_number, message, row):
+            if len(errors) < IMPORT_ERRORS_SHOWN:
+                errors.append((line_number, message))
+        # Parse the upload as it is read instead of loading it into memory
+        stream = io.TextIOWrapper(feed.stream, encoding='utf-8', newline='')
+        report = import_products(stream, detect_format(feed.filename), on_error=on_error)
+        flash(f'Imported {report.inserted} new and {report.updated} updated products, '
+              f'{report.errors} rows rejected.', 'success' if not report.errors else 'warning')
+    return render_template('admin_import_products.html', form=form, report=report, errors=errors)
+
+@shop.route('/admin/export_products.<any(csv, jsonl):fmt>')
+@login_required
+def admin_export_products(fmt):
+    if not current_user.has_admin_rights():
+        abort(403)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_products(fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=products.{fmt}'})
+
+def sales_period():
+    days = request.args.get('days', 30, type=int)
+    return days if days in sales.PERIODS else 30
+
+@shop.route('/admin/sales')
+@login_required
+@query_budget(7)
+def admin_sales():
+    # Reads only the daily rollup tables, so the cost does not grow with the number of orders
+    if not current_user.has_admin_rights():
+        abort(403)
+    days = sales_period()
+    start = sales.period_start(days)
+    daily = sales.daily_totals(start)
+    categories = sales.category_totals(start)
+    return render_template('admin_sales.html', days=days, periods=sales.PERIODS, daily=daily,
+                           categories=categories, by_day=sales.category_daily(start),
+                           top_products=sales.top_products(start),
+                           revenue=money.total((row.revenue, 1) for row in daily),
+                           orders=sum(row.orders for row in daily), units=sum(row.units for row in daily))
+
+@shop.route('/admin/sales/<any(daily, categories, products):report>.csv')
+@login_required
+def admin_sales_csv(report):
+    if not current_user.has_admin_rights():
+        abort(403)
+    days = sales_period()
+    return Response(stream_with_context(sales.export_csv(report, sales.period_start(days))), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=sales-{report}-{days}d.csv'})
+
+# --- Internal Routes ---
+
+# Only reachable from the addresses in INTERNAL_METRICS_ALLOWED_IPS
+def require_internal_client():
+    if request.remote_addr not in current_app.config['INTERNAL_METRICS_ALLOWED_IPS']:
+        abort(404)
+
+@shop.route('/internal/metrics')
+def internal_metrics():
+    require_internal_client()
+    return jsonify({'db_pool': pool_metrics.snapshot(db.engine.pool)})
+
+@shop.route('/internal/metrics/prometheus')
+def internal_metrics_prometheus():
+    require_internal_client()
+    gauges = {f'fashionshop_db_pool_{name}': value
+              for name, value in pool_metrics.snapshot(db.engine.pool).items()}
+    gauges.update({f'fashionshop_page_cache_{name}': value
+                   for name, value in cache.page_cache.stats().items()})
+    body = request_profiler.render_prometheus(gauges)
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # Error Handlers (Optional but good practice)
-@app.errorhandler(404)
+@shop.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
-@app.errorhandler(403)
+@shop.errorhandler(403)
 def forbidden(e):
     return render_template('403.html'), 403
\ No newline at end of file
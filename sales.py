@@ -0,0 +1,249 @@
+# fashion-shop/sales.py
+
+import csv
+import io
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+import click
+from sqlalchemy import delete, func, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from models import (db, Category, Order, OrderItem, Product, ProductSalesDay, ProductSalesMonth, SalesDay,
+                    CategorySalesDay, Watermark)
+from money import from_minor_units, to_minor_units
+from orders import SETTLE_SECONDS, last_settled_order_id
+from upsert import add_to_counters
+from jobs import enqueue, handler
+
+# Daily sales rollups for the admin dashboard and CSV exports.
+# Orders are folded into per-day totals (SalesDay), per category (CategorySalesDay) and per
+# product (ProductSalesDay, and ProductSalesMonth for long periods) by walking Order.id past a high-water mark, one id range per
+# transaction. Reports then read at most (days x categories) or (days x products) rows,
+# independent of how many orders there are, and never touch Order/OrderItem.
+#
+# The rollup catches up from a `sales_rollup` job queued after checkout (jobs.py), from
+# `flask sales update` (cron) and before the bestseller ranking (recommendations.py). Runs
+# can overlap: each chunk first moves the mark with a compare-and-set UPDATE, so a range is
+# only ever added by the run that moved the mark past it.
+
+WATERMARK = 'sales_rollup'
+ORDERS_PER_CHUNK = 5000
+# CategorySalesDay.category_id for products without a category
+UNCATEGORIZED = 0
+# Periods offered on the dashboard, in days
+PERIODS = (7, 30, 90, 365)
+
+# --- Rolling up ---
+
+def _ensure_watermark():
+    if db.session.get(Watermark, WATERMARK) is None:
+        try:
+            db.session.add(Watermark(name=WATERMARK, value=0))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # created by a concurrent run
+
+def _advance_watermark(last_id, upper):
+    moved = db.session.execute(
+        update(Watermark).where(Watermark.name == WATERMARK, Watermark.value == last_id)
+        .values(value=upper).execution_options(synchronize_session=False)
+    ).rowcount
+    return moved == 1
+
+def _roll_up(last_id, upper):
+    # Adds the orders with last_id < id <= upper to the rollups; returns how many there were
+    lines = db.session.execute(
+        select(Order.id, Order.order_date, OrderItem.product_id, OrderItem.quantity, OrderItem.price,
+               Product.category_id)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+        .where(Order.id > last_id, Order.id <= upper)
+    ).all()
+    if not lines:
+        return 0
+
+    # Sums in integer cents; each value is [units, cents] (plus a set of order ids per day)
+    days = defaultdict(lambda: [0, 0, set()])
+    categories = defaultdict(lambda: [0, 0])
+    products = defaultdict(lambda: [0, 0])
+    for line in lines:
+        day = line.order_date.date() if line.order_date else date.today()
+        cents = to_minor_units(line.price) * line.quantity
+        for bucket in (days[day], categories[day, line.category_id or UNCATEGORIZED],
+                       products[line.product_id, day]):
+            bucket[0] += line.quantity
+            bucket[1] += cents
+        days[day][2].add(line.id)
+
+    add_to_counters(SalesDay, [
+        {'day': day, 'orders': len(order_ids), 'units': units, 'revenue': from_minor_units(cents)}
+        for day, (units, cents, order_ids) in days.items()
+    ], ['day'], ['orders', 'units', 'revenue'])
+    add_to_counters(CategorySalesDay, [
+        {'day': day, 'category_id': category_id, 'units': units, 'revenue': from_minor_units(cents)}
+        for (day, category_id), (units, cents) in categories.items()
+    ], ['day', 'category_id'], ['units', 'revenue'])
+    add_to_counters(ProductSalesDay, [
+        {'product_id': product_id, 'day': day, 'units': units, 'revenue': from_minor_units(cents)}
+        for (product_id, day), (units, cents) in products.items()
+    ], ['product_id', 'day'], ['units', 'revenue'])
+
+    months = defaultdict(lambda: [0, 0])
+    for (product_id, day), (units, cents) in products.items():
+        bucket = months[product_id, day.replace(day=1)]
+        bucket[0] += units
+        bucket[1] += cents
+    add_to_counters(ProductSalesMonth, [
+        {'product_id': product_id, 'month': month, 'units': units, 'revenue': from_minor_units(cents)}
+        for (product_id, month), (units, cents) in months.items()
+    ], ['product_id', 'month'], ['units', 'revenue'])
+    return len({line.id for line in lines})
+
+def catch_up(chunk_size=ORDERS_PER_CHUNK, on_chunk=None):
+    # Rolls up every settled order past the mark; returns the number of orders added
+    _ensure_watermark()
+    max_id = last_settled_order_id()
+    processed = 0
+    while True:
+        last_id = db.session.scalar(select(Watermark.value).where(Watermark.name == WATERMARK))
+        if last_id >= max_id:
+            break
+        upper = min(last_id + chunk_size, max_id)
+        if not _advance_watermark(last_id, upper):
+            db.session.rollback()
+            continue  # another run took this range; carry on from where it left the mark
+        processed += _roll_up(last_id, upper)
+        db.session.commit()
+        if on_chunk:
+            on_chunk(upper, max_id)
+    return processed
+
+def rebuild(on_chunk=None):
+    # Recomputes the rollups from all orders, in the same streaming chunks
+    for model in (SalesDay, CategorySalesDay, ProductSalesDay, ProductSalesMonth):
+        db.session.execute(delete(model))
+    _ensure_watermark()
+    db.session.execute(update(Watermark).where(Watermark.name == WATERMARK).values(value=0))
+    db.session.commit()
+    return catch_up(on_chunk=on_chunk)
+
+@handler('sales_rollup')
+def sales_rollup(payload, job):
+    catch_up()
+
+def queue_catch_up():
+    # Called after checkout. One job per minute of orders, due once the last of them has settled.
+    minute = int(time.time() // 60)
+    enqueue('sales_rollup', {}, key=f'sales_rollup:{minute}', delay=SETTLE_SECONDS + 60)
+
+# --- Reports (rollup tables only) ---
+
+def period_start(days, today=None):
+    return (today or date.today()) - timedelta(days=days - 1)
+
+def daily_totals(start):
+    return db.session.execute(
+        select(SalesDay.day, SalesDay.orders, SalesDay.units, SalesDay.revenue)
+        .where(SalesDay.day >= start).order_by(SalesDay.day.desc())
+    ).all()
+
+def category_totals(start):
+    # Per-category totals for the period, best first
+    return db.session.execute(
+        select(CategorySalesDay.category_id, Category.name,
+               func.sum(CategorySalesDay.units).label('units'),
+               func.sum(CategorySalesDay.revenue).label('revenue'))
+        .outerjoin(Category, Category.id == CategorySalesDay.category_id)
+        .where(CategorySalesDay.day >= start)
+        .group_by(CategorySalesDay.category_id, Category.name)
+        .order_by(func.sum(CategorySalesDay.revenue).desc())
+    ).all()
+
+def category_daily(start):
+    # Revenue per day per category: {day: {category_id: revenue}}
+    rows = db.session.execute(
+        select(CategorySalesDay.day, CategorySalesDay.category_id, CategorySalesDay.revenue)
+        .where(CategorySalesDay.day >= start)
+    ).all()
+    table = defaultdict(dict)
+    for day, category_id, revenue in rows:
+        table[day][category_id] = revenue
+    return table
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def top_products(start, limit=10):
+    # Whole months from ProductSalesMonth, the days before the first of them from ProductSalesDay
+    first_month = start if start.day == 1 else _next_month(start)
+    sold = union_all(
+        select(ProductSalesDay.product_id, ProductSalesDay.units, ProductSalesDay.revenue)
+        .where(ProductSalesDay.day >= start, ProductSalesDay.day < first_month),
+        select(ProductSalesMonth.product_id, ProductSalesMonth.units, ProductSalesMonth.revenue)
+        .where(ProductSalesMonth.month >= first_month),
+    ).subquery()
+    units = func.sum(sold.c.units).label('units')
+    top = select(sold.c.product_id, units, func.sum(sold.c.revenue).label('revenue')) \
+        .group_by(sold.c.product_id).order_by(units.desc()).limit(limit).subquery()
+    return db.session.execute(
+        select(top.c.product_id, Product.name, Product.slug, top.c.units, top.c.revenue)
+        .outerjoin(Product, Product.id == top.c.product_id)
+        .order_by(top.c.units.desc())
+    ).all()
+
+# --- CSV export ---
+
+REPORTS = {
+    'daily': ['day', 'orders', 'units', 'revenue'],
+    'categories': ['day', 'category_id', 'category', 'units', 'revenue'],
+    'products': ['day', 'product_id', 'product', 'units', 'revenue'],
+}
+
+def export_csv(report, start, batch_size=5000):
+    # Streams one rollup as CSV, day by day
+    if report == 'daily':
+        query = select(SalesDay.day, SalesDay.orders, SalesDay.units, SalesDay.revenue) \
+            .where(SalesDay.day >= start).order_by(SalesDay.day)
+    elif report == 'categories':
+        query = select(CategorySalesDay.day, CategorySalesDay.category_id, Category.name,
+                       CategorySalesDay.units, CategorySalesDay.revenue) \
+            .outerjoin(Category, Category.id == CategorySalesDay.category_id) \
+            .where(CategorySalesDay.day >= start).order_by(CategorySalesDay.day, CategorySalesDay.category_id)
+    else:
+        query = select(ProductSalesDay.day, ProductSalesDay.product_id, Product.name,
+                       ProductSalesDay.units, ProductSalesDay.revenue) \
+            .outerjoin(Product, Product.id == ProductSalesDay.product_id) \
+            .where(ProductSalesDay.day >= start).order_by(ProductSalesDay.day, ProductSalesDay.product_id)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORTS[report])
+    for partition in db.session.execute(query.execution_options(yield_per=batch_size)).partitions():
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def init_sales(app):
+    @app.cli.group('sales')
+    def sales():
+        """Daily sales rollups behind the admin dashboard."""
+
+    def on_chunk(upper, max_id):
+        click.echo(f'\r  orders up to #{upper} of #{max_id}', nl=False)
+
+    @sales.command('update')
+    def update_command():
+        """Roll up orders placed since the last run."""
+        processed = catch_up(on_chunk=on_chunk)
+        if processed:
+            click.echo('')
+        click.echo(f'{processed} orders rolled up.')
+
+    @sales.command('rebuild')
+    def rebuild_command():
+        """Recompute the rollups from every order, in streaming batches."""
+        started = time.perf_counter()
+        processed = rebuild(on_chunk=on_chunk)
+        click.echo(f'\n{processed} orders rolled up in {time.perf_counter() - started:.1f}s.')
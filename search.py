@@ -0,0 +1,396 @@
+# fashion-shop/search.py
+
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from itertools import islice
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, Product
+from cache import catalog_version, catalog_changes, catalog_changes_since
+from querybudget import not_counted
+
+logger = logging.getLogger(__name__)
+
+# In-process full-text search over Product.name and Product.description.
+# The inverted index is built once per process from the Product table, so queries never
+# touch the database. Writes committed in this process are applied from SQLAlchemy commit
+# hooks; other processes' writes (other workers, `flask import-products`) are noticed by
+# comparing the catalog version (cache.catalog_version) with the one the index is at, at
+# most every SNAPSHOT_CHECK_SECONDS, and the products changed since are re-read (see
+# cache.catalog_changes_since). Only a bulk rewrite rebuilds the whole index, in a
+# background thread, while requests keep searching the current one.
+#
+# Postings hold each term's BM25 impact per product: NumPy arrays from the last full build,
+# plus a small dict per term for the products written since (merged by the next rebuild).
+# A query is one weighted bincount over its terms' postings, whatever their length. The
+# impacts are normalised by the average product length at the last full build.
+# Stock is not indexed: it changes with every checkout, so callers filtering on it check
+# the rows they load.
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# BM25 parameters and how much a match in the name counts compared to the description
+K1 = 1.2
+B = 0.75
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+# Upper bound on how many index terms a type-ahead prefix may expand to
+MAX_PREFIX_EXPANSIONS = 50
+# More products changed by another process than this rebuild the index instead
+MAX_DELTA_ROWS = 5000
+# How many matches ranking() puts in order first; each further batch is 8 times bigger
+FIRST_RANKS = 32
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+def term_frequencies(name, description):
+    # term -> weighted frequency in one product
+    frequencies = defaultdict(float)
+    for term in tokenize(name):
+        frequencies[term] += NAME_WEIGHT
+    for term in tokenize(description):
+        frequencies[term] += DESCRIPTION_WEIGHT
+    return frequencies
+
+def impact(frequency, length, average_length):
+    # A term's BM25 weight in one product, before the term's idf (NumPy arrays work too)
+    return frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._base = {}          # term -> (product ids, impacts) arrays, from the last full build
+        self._delta = {}         # term -> {product_id: impact} for products written since
+        self._delta_ids = set()  # products whose postings are in _delta
+        self._doc_terms = {}     # product_id -> its terms (needed to remove a doc)
+        self._doc_freq = {}      # term -> how many products contain it
+        self._terms = []         # sorted list of every term, for prefix lookups
+        # By product id: whether its base postings still count, and what the filters look at
+        self._in_base = np.zeros(0, dtype=bool)
+        self._category = np.zeros(0, dtype=np.int64)
+        self._price = np.zeros(0)
+        self._available = np.zeros(0, dtype=bool)
+        self._average_length = 1.0  # length the impacts are normalised by, fixed at build time
+        self._stale = set()         # product ids to re-read before the next lookup
+        self._refresh_lock = threading.Lock()
+        self._rebuilding = False
+        self.ready = False
+        self.version = None         # catalog version the contents match
+        self.checked_at = 0.0
+        self.check_seconds = 5.0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    @classmethod
+    def build(cls, rows):
+        # A new index from (id, name, description, category_id, price, available) rows
+        index = cls()
+        ids, frequencies = defaultdict(list), defaultdict(list)
+        lengths, docs = {}, {}
+        for product_id, name, description, category_id, price, available in rows:
+            terms = term_frequencies(name, description)
+            for term, frequency in terms.items():
+                ids[term].append(product_id)
+                frequencies[term].append(frequency)
+            lengths[product_id] = sum(terms.values())
+            docs[product_id] = (category_id, price, available)
+            index._doc_terms[product_id] = tuple(terms)
+        index._grow(max(docs, default=0))
+        length_by_id = np.zeros(len(index._in_base))
+        length_by_id[list(lengths)] = list(lengths.values())
+        index._average_length = average = sum(lengths.values()) / len(lengths) if lengths else 1.0
+        for term, term_ids in ids.items():
+            term_ids = np.array(term_ids, dtype=np.int32)
+            index._base[term] = (term_ids, impact(np.array(frequencies[term]), length_by_id[term_ids], average))
+            index._doc_freq[term] = len(term_ids)
+        index._terms = sorted(ids)
+        for product_id, (category_id, price, available) in docs.items():
+            index._set_doc(product_id, category_id, price, available)
+        index._in_base[list(docs)] = True
+        return index
+
+    def _grow(self, product_id):
+        # The by-id arrays cover every id up to product_id
+        size = len(self._in_base)
+        if product_id < size:
+            return
+        new_size = max(product_id + 1, size * 2, 1024)
+        for name, fill in (('_in_base', False), ('_category', -1), ('_price', 0.0), ('_available', False)):
+            grown = np.full(new_size, fill, dtype=getattr(self, name).dtype)
+            grown[:size] = getattr(self, name)
+            setattr(self, name, grown)
+
+    def _set_doc(self, product_id, category_id, price, available):
+        self._category[product_id] = category_id if category_id is not None else -1
+        self._price[product_id] = float(price or 0)
+        self._available[product_id] = bool(available)
+
+    def add(self, product_id, name, description, category_id, price, available):
+        terms = term_frequencies(name, description)
+        length = sum(terms.values())
+        with self._lock:
+            self._remove(product_id)
+            self._grow(product_id)
+            for term, frequency in terms.items():
+                self._delta.setdefault(term, {})[product_id] = impact(frequency, length, self._average_length)
+                count = self._doc_freq.get(term, 0)
+                if not count:
+                    insort(self._terms, term)
+                self._doc_freq[term] = count + 1
+            self._doc_terms[product_id] = tuple(terms)
+            self._delta_ids.add(product_id)
+            self._set_doc(product_id, category_id, price, available)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        in_delta = product_id in self._delta_ids
+        if in_delta:
+            self._delta_ids.discard(product_id)
+        else:
+            self._in_base[product_id] = False
+        for term in terms:
+            if in_delta:
+                postings = self._delta[term]
+                del postings[product_id]
+                if not postings:
+                    del self._delta[term]
+            count = self._doc_freq[term] - 1
+            if count:
+                self._doc_freq[term] = count
+            else:
+                del self._doc_freq[term]
+                del self._terms[bisect_left(self._terms, term)]
+        self._available[product_id] = False
+
+    def _expand_prefix(self, prefix):
+        start = bisect_left(self._terms, prefix)
+        expanded = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            expanded.append(term)
+        return expanded
+
+    def _scores(self, query, prefix, category_id, min_price, max_price, available_only):
+        # Score by product id, 0 where it does not match; None if nothing can match
+        terms = tokenize(query)
+        if not terms:
+            return None
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            # Each query word becomes a group of index terms; the last one may be a prefix
+            groups = [[term] for term in terms]
+            if prefix:
+                groups[-1] = self._expand_prefix(terms[-1]) or [terms[-1]]
+            ids, weights, delta = [], [], []
+            for group in groups:
+                for term in group:
+                    count = self._doc_freq.get(term)
+                    if not count:
+                        continue
+                    idf = math.log(1 + (doc_count - count + 0.5) / (count + 0.5))
+                    if term in self._base:
+                        term_ids, impacts = self._base[term]
+                        ids.append(term_ids)
+                        weights.append(impacts * idf)
+                    if term in self._delta:
+                        delta.append((idf, self._delta[term]))
+            if not ids and not delta:
+                return None
+
+            # BM25 as one weighted count over every posting of every query term
+            size = len(self._in_base)
+            if ids:
+                scores = np.bincount(np.concatenate(ids), np.concatenate(weights), minlength=size)
+                scores *= self._in_base  # products removed or rewritten since the build
+            else:
+                scores = np.zeros(size)
+            for idf, postings in delta:
+                for product_id, value in postings.items():
+                    scores[product_id] += idf * value
+            if available_only:
+                scores *= self._available
+            if category_id is not None:
+                scores *= self._category == category_id
+            if min_price is not None:
+                scores *= self._price >= min_price
+            if max_price is not None:
+                scores *= self._price <= max_price
+        return scores
+
+    def search(self, query, limit=20, prefix=True, category_id=None, min_price=None,
+               max_price=None, available_only=True):
+        # Returns a list of (product_id, score), best match first; limit=None returns every match.
+        # With prefix=True the last query word also matches longer words (type-ahead).
+        ranking = self.ranking(query, prefix, category_id, min_price, max_price, available_only)
+        return list(ranking if limit is None else islice(ranking, max(limit, 0)))
+
+    def ranking(self, query, prefix=True, category_id=None, min_price=None, max_price=None,
+                available_only=True):
+        # Yields (product_id, score), best match first and ties by id, for as long as the
+        # caller reads: the matches are scored once, then ordered a few at a time, so a
+        # page of results never sorts every match
+        scores = self._scores(query, prefix, category_id, min_price, max_price, available_only)
+        if scores is None:
+            return
+        matched = np.flatnonzero(scores > 0)
+        matched_scores = scores[matched]
+        done, wanted = 0, FIRST_RANKS
+        while done < len(matched):
+            wanted = min(wanted, len(matched))
+            if wanted < len(matched):
+                # Everything scoring at least the wanted-th best, ties included, then in order
+                kth = np.partition(matched_scores, len(matched) - wanted)[len(matched) - wanted]
+                best = np.flatnonzero(matched_scores >= kth)
+            else:
+                best = np.arange(len(matched))
+            best = best[np.lexsort((matched[best], -matched_scores[best]))][:wanted]
+            for position in best[done:].tolist():
+                yield int(matched[position]), float(matched_scores[position])
+            done, wanted = wanted, wanted * 8
+
+    def rebuild(self, session, version=None):
+        # Full (re)build straight from the Product table, streamed in chunks, then swapped in
+        fresh = SearchIndex.build(session.execute(
+            select(Product.id, Product.name, Product.description, Product.category_id,
+                   Product.price, Product.available)
+            .execution_options(yield_per=1000)
+        ))
+        with self._lock:
+            for name in ('_base', '_delta', '_delta_ids', '_doc_terms', '_doc_freq', '_terms', '_in_base',
+                         '_category', '_price', '_available', '_average_length'):
+                setattr(self, name, getattr(fresh, name))
+            self._stale = set()
+            self.version = version
+            self.ready = True
+
+    def _rebuild_in_background(self, app):
+        # Lookups keep using the current contents until the new ones are swapped in
+        self._rebuilding = True
+
+        def run():
+            try:
+                with app.app_context():
+                    try:
+                        self.rebuild(db.session, catalog_version())
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception('Could not rebuild the search index')
+            finally:
+                self._rebuilding = False
+                self.checked_at = 0.0  # catch up on what changed while it was built
+
+        threading.Thread(target=run, name='search-rebuild', daemon=True).start()
+
+    def refresh(self, session):
+        # Brings the index up to date. The first build happens here; after that the catalog
+        # version is checked at most every check_seconds and the products changed since are
+        # re-read. A bulk rewrite, or more products rewritten than the base holds comfortably
+        # beside it, rebuilds it in a background thread instead.
+        with self._refresh_lock:
+            if not self.ready:
+                self.rebuild(session, catalog_version())
+                self.checked_at = time.monotonic()
+            elif not self._rebuilding and time.monotonic() - self.checked_at >= self.check_seconds:
+                since = self.version
+                version, changed = catalog_changes_since(since, MAX_DELTA_ROWS)
+                if changed is None or len(self._delta_ids) > max(MAX_DELTA_ROWS, len(self) // 10):
+                    self._rebuild_in_background(current_app._get_current_object())
+                else:
+                    with self._lock:
+                        self._stale.update(changed)
+                        if self.version == since:  # else a commit here moved it meanwhile, see follow()
+                            self.version = version
+                self.checked_at = time.monotonic()
+            with self._lock:
+                stale, self._stale = list(self._stale), set()
+            for start in range(0, len(stale), 1000):
+                chunk = stale[start:start + 1000]
+                rows = {row.id: row for row in session.execute(
+                    select(Product.id, Product.name, Product.description, Product.category_id,
+                           Product.price, Product.available)
+                    .where(Product.id.in_(chunk)))}
+                for product_id in chunk:
+                    if product_id in rows:
+                        self.add(*rows[product_id])
+                    else:
+                        self.remove(product_id)
+
+    def follow(self, before, after, product_ids):
+        # A catalog change committed by this process, moving the version from `before` to
+        # `after`: its ORM writes are already applied, and rows written by bulk statements
+        # are re-read on the next lookup. If the index was not current at `before`, or the
+        # bulk writes are not known row by row, the next lookup checks the version instead.
+        with self._lock:
+            if self.version == before and product_ids is not None:
+                self._stale.update(product_ids)
+                self.version = after
+            else:
+                self.checked_at = 0.0
+
+    def needs_refresh(self):
+        return (not self.ready or bool(self._stale)
+                or (not self._rebuilding and time.monotonic() - self.checked_at >= self.check_seconds))
+
+# One index per process
+product_index = SearchIndex()
+
+def get_index():
+    # Builds the index on first use in this process and keeps it current (see refresh)
+    if product_index.needs_refresh():
+        with not_counted():
+            product_index.refresh(db.session)
+    return product_index
+
+# --- Incremental updates ---
+# Product writes are collected on flush and applied only once the transaction commits,
+# so a rolled-back write never shows up in search results. Bulk statements bypass these
+# hooks; they are announced with cache.bump_catalog_version() and caught up with by follow().
+
+def _collect_product_changes(session, flush_context):
+    pending = session.info.setdefault('search_pending', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Product):
+            pending[obj.id] = (obj.id, obj.name, obj.description, obj.category_id,
+                               obj.price, obj.available)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            pending[obj.id] = None
+
+def _apply_product_changes(session):
+    pending = session.info.pop('search_pending', None)
+    changes = catalog_changes(session)
+    if not product_index.ready:
+        return
+    for product_id, values in (pending or {}).items():
+        if values is None:
+            product_index.remove(product_id)
+        else:
+            product_index.add(*values)
+    if changes is not None:
+        product_index.follow(*changes)
+
+def _discard_product_changes(session, previous_transaction):
+    session.info.pop('search_pending', None)
+
+def init_search(app):
+    product_index.check_seconds = app.config.get('SNAPSHOT_CHECK_SECONDS', 5.0)
+    event.listen(Session, 'after_flush', _collect_product_changes)
+    event.listen(Session, 'after_commit', _apply_product_changes)
+    event.listen(Session, 'after_soft_rollback', _discard_product_changes)
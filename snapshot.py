@@ -0,0 +1,109 @@
+# fashion-shop/snapshot.py
+
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, Product, Category
+from facets import CategoryFacet
+from cache import catalog_version, catalog_changes
+from querybudget import not_counted
+
+# Read-only catalog snapshot: the categories and the slug -> id maps the catalog views
+# look things up in on every request.
+# A snapshot is built once and never changed: tuples and read-only mappings, replaced as a
+# whole by a newer one. Under gunicorn the first one is built in the master before the
+# workers are forked (warmup.py), so they all share its memory pages instead of each
+# loading its own copy on its first request.
+#
+# Freshness: catalog writes committed in this process mark the snapshot stale at once;
+# another worker's are noticed by a version check at most every SNAPSHOT_CHECK_SECONDS.
+# The version is the catalog change time that bulk writes and imports move
+# (cache.bump_catalog_version), not Product.updated_at, which every checkout moves.
+# Lookups that miss (a category or product newer than the snapshot) fall back to the
+# database, and a hit is only used to find the row, so a stale entry costs a query,
+# never a wrong page.
+
+CatalogSnapshot = namedtuple('CatalogSnapshot', 'version categories category_by_slug product_ids')
+
+def build_snapshot(session, version):
+    categories = tuple(sorted(
+        (CategoryFacet(*row) for row in session.execute(select(Category.id, Category.name, Category.slug))),
+        key=lambda c: c.name))
+    product_ids = {slug: product_id for slug, product_id in session.execute(
+        select(Product.slug, Product.id).where(Product.available.is_(True))
+        .execution_options(yield_per=5000))}
+    return CatalogSnapshot(
+        version=version,
+        categories=categories,
+        category_by_slug=MappingProxyType({c.slug: c for c in categories}),
+        product_ids=MappingProxyType(product_ids),
+    )
+
+class SnapshotStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.check_seconds = 5.0
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.stale = False
+        self.builds = 0
+
+    def init_app(self, app):
+        self.check_seconds = app.config.get('SNAPSHOT_CHECK_SECONDS', 5.0)
+
+    def load(self):
+        # Builds a snapshot of the current catalog, whatever the version check says
+        with self._lock:
+            self._replace(catalog_version())
+        return self.snapshot
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is not None and not self.stale and time.monotonic() - self.checked_at < self.check_seconds:
+            return snapshot
+        with self._lock, not_counted():
+            if self.snapshot is snapshot:  # not already refreshed by another thread
+                version = catalog_version()
+                if snapshot is None or self.stale or version != snapshot.version:
+                    self._replace(version)
+                self.checked_at = time.monotonic()
+        return self.snapshot
+
+    def _replace(self, version):
+        self.stale = False
+        self.snapshot = build_snapshot(db.session, version)
+        self.checked_at = time.monotonic()
+        self.builds += 1
+
+# One store per process
+snapshot_store = SnapshotStore()
+
+def get_snapshot():
+    return snapshot_store.get()
+
+# --- Invalidation ---
+# Product/Category writes in this process are noted on flush, and bulk writes announced
+# with cache.bump_catalog_version() show up in cache.catalog_changes(); once they commit,
+# the next lookup rebuilds the snapshot without waiting for the version check.
+
+def _note_catalog_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Product, Category)):
+            session.info['snapshot_dirty'] = True
+            return
+
+def _mark_stale(session):
+    if session.info.pop('snapshot_dirty', False) or catalog_changes(session) is not None:
+        snapshot_store.stale = True
+
+def _forget_catalog_writes(session, previous_transaction):
+    session.info.pop('snapshot_dirty', None)
+
+def init_snapshot(app):
+    snapshot_store.init_app(app)
+    event.listen(Session, 'after_flush', _note_catalog_writes)
+    event.listen(Session, 'after_commit', _mark_stale)
+    event.listen(Session, 'after_soft_rollback', _forget_catalog_writes)
@@ -1,150 +1,110 @@
 // fashion-shop/static/js/main.js
 
-// Function to handle adding items to cart
-async function handleAddToCart(productId, quantity = 1) {
-    try {
-        const response = await fetch(FLASK_URLS.addToCart, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-Requested-With': 'XMLHttpRequest' // Identify as AJAX request
-            },
-            body: JSON.stringify({ product_id: productId, quantity: quantity })
-        });
-
-        const data = await response.json();
+// Cart forms are progressively enhanced: with JavaScript, add/remove go through the JSON
+// cart API (FLASK_URLS.cartApi) and the page is updated in place; without it the same
+// forms post to the form-based routes and redirect as before.
 
-        if (data.success) {
-            alert(data.message); // Replace with a nicer notification later
-            updateCartCountDisplay(data.cart_count); // Update cart count in header
-        } else {
-            alert('Error: ' + data.message);
-        }
+// Send a request to the cart API; the CSRF token comes from the form being submitted
+async function cartApiRequest(method, url, csrfToken, body) {
+    const response = await fetch(url, {
+        method: method,
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken,
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        credentials: 'same-origin',
+        body: body === undefined ? undefined : JSON.stringify(body)
+    });
+    let data = null;
+    try {
+        data = await response.json();
     } catch (error) {
-        console.error('Error adding to cart:', error);
-        alert('An error occurred. Please try again.');
+        // CSRF failures and server errors come back as HTML pages
     }
+    return { ok: response.ok, status: response.status, data: data };
 }
 
-// Function to handle updating cart item quantity
-async function handleUpdateCartItem(itemId, newQuantity) {
-    try {
-        const response = await fetch(FLASK_URLS.updateCart, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-Requested-With': 'XMLHttpRequest'
-            },
-            body: JSON.stringify({ item_id: itemId, quantity: newQuantity })
-        });
-
-        const data = await response.json();
+// Show a message in the same style as the server-rendered flash messages
+function showCartMessage(message, category) {
+    const styles = {
+        success: 'bg-green-100 text-green-800',
+        danger: 'bg-red-100 text-red-800',
+        info: 'bg-blue-100 text-blue-800'
+    };
+    let container = document.getElementById('cart-messages');
+    if (!container) {
+        container = document.createElement('div');
+        container.id = 'cart-messages';
+        container.className = 'mb-6';
+        const main = document.querySelector('main');
+        main.insertBefore(container, main.firstChild);
+    }
+    const alert = document.createElement('div');
+    alert.className = 'p-3 rounded-lg text-sm ' + (styles[category] || styles.info);
+    alert.textContent = message;
+    container.replaceChildren(alert);
+}
 
-        if (data.success) {
-            // Update the displayed total and potentially individual item costs on the cart page
-            const cartTotalElement = document.getElementById('cart-total');
-            if (cartTotalElement) {
-                cartTotalElement.innerText = data.cart_total.toFixed(2);
-            }
-            // Optionally, update the specific item's subtotal if displayed
-            // alert(data.message); // For debugging, remove later
-        } else {
-            alert('Error updating cart: ' + data.message);
-            // Revert quantity input if update failed (e.g., stock issue)
-            const inputElement = document.querySelector(`input[data-item-id="${itemId}"]`);
-            if (inputElement) {
-                // This is tricky without knowing the previous valid state.
-                // A full page reload or re-fetching cart might be simpler for now.
-                window.location.reload();
-            }
-        }
-    } catch (error) {
-        console.error('Error updating cart:', error);
-        alert('An error occurred. Please try again.');
+// Apply the count/total that every cart API response carries
+function applyCartTotals(data) {
+    updateCartCountDisplay(data.count);
+    const cartTotalElement = document.getElementById('cart-total');
+    if (cartTotalElement) {
+        cartTotalElement.innerText = '$' + data.total; // already two decimals, as a string
     }
 }
 
-// Function to handle removing items from cart
-async function handleRemoveFromCart(itemId) {
-    if (!confirm('Are you sure you want to remove this item?')) {
+async function handleAddToCart(form) {
+    const result = await cartApiRequest('POST', FLASK_URLS.cartApi, form.elements.csrf_token.value, {
+        product_id: parseInt(form.elements.product_id.value),
+        quantity: parseInt(form.elements.quantity.value) || 1
+    });
+    if (result.data === null) {
+        form.submit(); // Fall back to the form route, which reports the problem itself
         return;
     }
-    try {
-        const response = await fetch(FLASK_URLS.removeFromCart, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-Requested-With': 'XMLHttpRequest'
-            },
-            body: JSON.stringify({ item_id: itemId })
-        });
-
-        const data = await response.json();
-
-        if (data.success) {
-            alert(data.message); // Replace with a nicer notification
-            // Remove the item's row from the display
-            const itemRow = document.getElementById(`cart-item-${itemId}`);
-            if (itemRow) {
-                itemRow.remove();
-            }
-            // Update cart total and count
-            const cartTotalElement = document.getElementById('cart-total');
-            if (cartTotalElement) {
-                cartTotalElement.innerText = data.cart_total.toFixed(2);
-            }
-            updateCartCountDisplay(currentCartCount - 1); // Simple decrement, assumes one item removed
-            // Or re-fetch the cart to get exact count: window.location.reload();
-        } else {
-            alert('Error removing item: ' + data.message);
-        }
-    } catch (error) {
-        console.error('Error removing from cart:', error);
-        alert('An error occurred. Please try again.');
+    if (result.ok) {
+        applyCartTotals(result.data);
+        showCartMessage(result.data.item.name + ' added to cart successfully!', 'success');
+    } else {
+        showCartMessage(result.data.error, 'danger');
     }
 }
 
-// Event listeners for Add to Cart buttons on product pages
-document.addEventListener('click', function(event) {
-    // UPDATED: Use event.target.closest() to find the parent button
-    const removeButton = event.target.closest('.remove-from-cart-btn');
-    if (removeButton) {
-        const itemId = removeButton.dataset.itemId;
-        if (itemId) {
-            handleRemoveFromCart(itemId);
-        }
+async function handleRemoveFromCart(form) {
+    const itemId = form.dataset.itemId;
+    const result = await cartApiRequest('DELETE', FLASK_URLS.cartApi + '/' + itemId, form.elements.csrf_token.value);
+    if (result.data === null) {
+        form.submit();
+        return;
     }
-
-    // Keep the update and remove cart item listeners as they are used on the cart page
-    const quantityInput = event.target.closest('.cart-quantity-input');
-    if (quantityInput) {
-        const itemId = quantityInput.dataset.itemId;
-        const newQuantity = parseInt(quantityInput.value);
-        if (itemId && !isNaN(newQuantity)) {
-            handleUpdateCartItem(itemId, newQuantity);
-        }
+    if (!result.ok) {
+        showCartMessage(result.data.error, 'danger');
+        return;
     }
-});
-
-// Event listeners for quantity changes in cart (retained for update functionality)
-document.addEventListener('change', function(event) {
-    if (event.target.classList.contains('cart-quantity-input')) {
-        const itemId = event.target.dataset.itemId;
-        const newQuantity = parseInt(event.target.value);
-        if (itemId && !isNaN(newQuantity)) {
-            handleUpdateCartItem(itemId, newQuantity);
-        }
+    applyCartTotals(result.data);
+    const itemRow = document.getElementById('cart-item-' + itemId);
+    if (itemRow) {
+        itemRow.remove();
     }
-});
+    if (result.data.count === 0) {
+        window.location.reload(); // Show the empty-cart page
+        return;
+    }
+    showCartMessage('Item removed from cart.', 'info');
+}
 
-// Event listeners for remove from cart buttons (retained for click functionality)
-// fashion-shop/static/js/main.js (snippet)
-document.addEventListener('click', function(event) {
-    const removeButton = event.target.closest('.remove-from-cart-btn');
-    if (removeButton) {
-        const itemId = removeButton.dataset.itemId;
-        if (itemId) {
-            handleRemoveFromCart(itemId);
-        }
+document.addEventListener('submit', function(event) {
+    const form = event.target;
+    const action = form.dataset.cartForm;
+    if (!action || !window.fetch) {
+        return;
     }
-});
\ No newline at end of file
+    event.preventDefault();
+    const handler = action === 'add' ? handleAddToCart : handleRemoveFromCart;
+    handler(form).catch(function(error) {
+        console.error('Cart request failed:', error);
+        form.submit();
+    });
+});
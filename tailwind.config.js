@@ -0,0 +1,10 @@
+// fashion-shop/tailwind.config.js
+// Used by `flask assets build`: only classes found in these files end up in the stylesheet.
+// Python files are included because some helpers (e.g. images.py) render class names.
+module.exports = {
+  content: ['./templates/**/*.html', './static/js/**/*.js', './*.py'],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
@@ -0,0 +1,46 @@
+# fashion-shop/tests/conftest.py
+
+import os
+import sys
+import pytest
+
+# The application modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config, engine_options
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # One application on a throwaway SQLite database for the whole run: the catalog
+    # snapshot and indexes are per-process singletons, so a second app would see them
+    from app import create_app, seed_defaults
+    from models import db, Category, Product, User
+
+    database_uri = f"sqlite:///{tmp_path_factory.mktemp('db') / 'shop.db'}"
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = database_uri
+        SQLALCHEMY_ENGINE_OPTIONS = engine_options(database_uri)
+        WTF_CSRF_ENABLED = False
+        QUERY_BUDGET_ENFORCE = True
+        CACHE_BACKEND = 'none'  # every request runs its view, so its queries are counted
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+        MAIL_FILE_DIR = str(tmp_path_factory.mktemp('outbox'))
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        seed_defaults()
+        categories = Category.query.order_by(Category.id).all()
+        for i in range(60):
+            db.session.add(Product(name=f'Linen shirt {i}', slug=f'linen-shirt-{i}', description='A linen shirt',
+                                   price=10 + i, stock=i % 4, category_id=categories[i % len(categories)].id))
+        user = User(username='shopper', email='shopper@example.com')
+        user.set_password('secret-password')
+        db.session.add(user)
+        db.session.commit()
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
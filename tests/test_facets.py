@@ -0,0 +1,52 @@
+# fashion-shop/tests/test_facets.py
+
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from facets import facet_index, get_facets
+
+# The facet counts following writes made by another process: the products it changed are
+# re-read, and a bulk rewrite rebuilds the index in the background.
+
+@pytest.fixture
+def other_process(app, monkeypatch):
+    # Writes on a separate connection, announced the way bump_catalog_version() does
+    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    monkeypatch.setattr(facet_index, 'check_seconds', 0.0)
+
+    def write(statement, product_ids):
+        with engine.begin() as conn:
+            conn.execute(text(statement))
+            version = conn.scalar(text("SELECT value FROM watermark WHERE name = 'catalog_changed'")) + 1
+            conn.execute(text("UPDATE watermark SET value = :version WHERE name = 'catalog_changed'"),
+                         {'version': version})
+            conn.execute(text('INSERT INTO catalog_change (version, product_id) VALUES (:version, :product_id)'),
+                         [{'version': version, 'product_id': product_id} for product_id in product_ids])
+    yield write
+    engine.dispose()
+
+def in_stock(app):
+    with app.app_context():
+        return get_facets().counts()['in_stock']
+
+def test_rows_changed_elsewhere_are_re_read(app, other_process):
+    before = in_stock(app)
+    loaded = facet_index._docs
+    other_process('UPDATE product SET stock = 0 WHERE id = 2', [2])  # stock was 1
+    assert in_stock(app) == before - 1
+    assert facet_index._docs is loaded  # no rebuild
+    other_process('UPDATE product SET stock = 1 WHERE id = 2', [2])
+    assert in_stock(app) == before
+
+def test_bulk_rewrite_elsewhere_rebuilds_in_the_background(app, other_process):
+    before = in_stock(app)
+    loaded = facet_index._docs
+    other_process('UPDATE product SET stock = 0 WHERE id = 3', [None])  # stock was 2
+    in_stock(app)  # notices, and starts the rebuild
+    deadline = time.monotonic() + 10
+    while facet_index._rebuilding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert in_stock(app) == before - 1
+    assert facet_index._docs is not loaded
+    other_process('UPDATE product SET stock = 2 WHERE id = 3', [3])
+    assert in_stock(app) == before
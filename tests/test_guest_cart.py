@@ -0,0 +1,56 @@
+# fashion-shop/tests/test_guest_cart.py
+
+import pytest
+from sqlalchemy import delete, select, update
+from models import db, CartItem, Product, User
+
+# A visitor's session cart held to the same stock and availability rules as a signed-in
+# shopper's cart, when it is changed and when it is merged into their cart on login.
+
+def product_id(app, slug):
+    with app.app_context():
+        return db.session.scalar(select(Product.id).where(Product.slug == slug))
+
+def set_product(app, slug, **values):
+    with app.app_context():
+        db.session.execute(update(Product).where(Product.slug == slug).values(**values))
+        db.session.commit()
+
+@pytest.fixture
+def shopper_cart(app):
+    # The shopper's CartItem rows, as {product_id: quantity}; emptied afterwards
+    with app.app_context():
+        user_id = db.session.scalar(select(User.id).where(User.username == 'shopper'))
+
+    def lines():
+        with app.app_context():
+            return dict(db.session.execute(select(CartItem.product_id, CartItem.quantity)
+                                           .where(CartItem.user_id == user_id)).all())
+    yield lines
+    with app.app_context():
+        db.session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+        db.session.commit()
+
+def test_merge_on_login_keeps_to_stock_and_availability(app, client, shopper_cart):
+    in_stock, sold_out, withdrawn = (product_id(app, slug) for slug in
+                                     ('linen-shirt-7', 'linen-shirt-8', 'linen-shirt-11'))
+    with client.session_transaction() as session:
+        session['cart'] = {str(in_stock): 9, str(sold_out): 1, str(withdrawn): 2}
+    set_product(app, 'linen-shirt-11', available=False)
+    try:
+        response = client.post('/login', data={'username': 'shopper', 'password': 'secret-password'})
+        assert response.status_code == 302
+    finally:
+        set_product(app, 'linen-shirt-11', available=True)
+    assert shopper_cart() == {in_stock: 3}  # linen-shirt-7 has 3 in stock
+
+def test_guest_cannot_set_a_withdrawn_product(app, client):
+    withdrawn = product_id(app, 'linen-shirt-5')
+    with client.session_transaction() as session:
+        session['cart'] = {str(withdrawn): 1}
+    set_product(app, 'linen-shirt-5', available=False)
+    try:
+        response = client.patch(f'/api/cart/{withdrawn}', json={'quantity': 1})
+        assert response.status_code == 409
+    finally:
+        set_product(app, 'linen-shirt-5', available=True)
@@ -0,0 +1,75 @@
+# fashion-shop/tests/test_identity.py
+
+import re
+import pytest
+from sqlalchemy import create_engine, event, text
+from identity import identity_cache, USERS_CHANGED
+from models import db
+
+# The cached identity following User writes made by another process (another worker, a
+# shell), which this process only learns about from the database; and the signed-in cart
+# badge, which is remembered between cart writes instead of counted on every page.
+
+@pytest.fixture
+def other_process(app):
+    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    def write(statement, **params):
+        with engine.begin() as conn:
+            conn.execute(text(statement), params)
+    yield write
+    engine.dispose()
+
+def sign_in(client, username, password):
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+
+def test_revoked_admin_is_refused_at_once(client, other_process):
+    sign_in(client, 'admin', '741852963')
+    assert client.get('/admin/sales').status_code == 200
+    other_process("UPDATE user SET is_admin = 0 WHERE username = 'admin'")
+    try:
+        assert client.get('/admin/sales').status_code == 403
+    finally:
+        other_process("UPDATE user SET is_admin = 1 WHERE username = 'admin'")
+
+def test_user_written_elsewhere_drops_cached_snapshots(app, other_process, monkeypatch):
+    monkeypatch.setattr(identity_cache, 'check_seconds', 0.0)
+    with app.app_context():
+        user_id = db.session.scalar(text("SELECT id FROM user WHERE username = 'shopper'"))
+        assert identity_cache.load(user_id).email == 'shopper@example.com'
+        other_process("UPDATE user SET email = 'moved@example.com' WHERE id = :id", id=user_id)
+        other_process('INSERT INTO watermark (name, value) VALUES (:name, 1) '
+                      'ON CONFLICT (name) DO UPDATE SET value = value + 1', name=USERS_CHANGED)
+        try:
+            assert identity_cache.load(user_id).email == 'moved@example.com'
+        finally:
+            other_process("UPDATE user SET email = 'shopper@example.com' WHERE id = :id", id=user_id)
+            identity_cache.evict(user_id)
+
+def badge(response):
+    return re.search(r'id="cart-count"[^>]*>\s*(\S*)\s*<', response.get_data(as_text=True)).group(1)
+
+def test_cart_badge_is_not_counted_on_every_page(app, client):
+    sign_in(client, 'shopper', 'secret-password')
+    counts = []
+
+    def note_count(conn, cursor, statement, *args):
+        if 'count(cart_item.id)' in statement.lower():
+            counts.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', note_count)
+    try:
+        assert badge(client.get('/products')) == '0'  # counted once for the session
+        del counts[:]
+        for path in ('/products', '/product/linen-shirt-1', '/orders'):
+            assert client.get(path).status_code == 200
+        assert counts == []
+        response = client.post('/api/cart', json={'product_id': 4, 'quantity': 1})
+        assert response.status_code == 200 and response.get_json()['count'] == 1
+        assert badge(client.get('/products')) == '1'
+    finally:
+        event.remove(engine, 'before_cursor_execute', note_count)
+        client.delete(f"/api/cart/{client.get('/api/cart').get_json()['items'][0]['id']}")
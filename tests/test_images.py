@@ -0,0 +1,34 @@
+# fashion-shop/tests/test_images.py
+
+import json
+import multiprocessing
+import os
+import pytest
+import images
+from images import ImagePipeline
+
+# The derivative manifest written by several processes at once (gunicorn workers and
+# `flask images backfill`): every entry has to survive the others' read-merge-replace.
+
+WRITERS = 4
+ENTRIES_PER_WRITER = 50
+
+def write_entries(upload_folder, writer):
+    pipeline = ImagePipeline()
+    pipeline.upload_folder = upload_folder
+    for i in range(ENTRIES_PER_WRITER):
+        pipeline._save_entry(f'{writer}-{i}.jpg', {'hash': f'{writer:06}{i:06}', 'widths': [400]})
+
+@pytest.mark.skipif(images.fcntl is None, reason='manifest writes are locked with fcntl')
+def test_concurrent_writers_keep_every_entry(tmp_path):
+    os.makedirs(tmp_path / images.DERIVED_DIR)
+    context = multiprocessing.get_context('fork')
+    writers = [context.Process(target=write_entries, args=(str(tmp_path), writer)) for writer in range(WRITERS)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join(60)
+        assert process.exitcode == 0
+    with open(tmp_path / images.DERIVED_DIR / images.MANIFEST_NAME, encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert len(manifest) == WRITERS * ENTRIES_PER_WRITER
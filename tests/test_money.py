@@ -0,0 +1,95 @@
+# fashion-shop/tests/test_money.py
+
+import json
+import random
+from decimal import Decimal
+import pytest
+import money
+from money import (as_json, from_minor_units, line_total, to_minor_units, to_money, total,
+                   totals_by_group)
+
+# Exactness properties of the money helpers, checked over seeded random amounts so a
+# failure always reproduces. The reference for every sum is plain integer cents.
+
+SAMPLES = 2000
+
+def random_cents(rng):
+    # Mostly shop-sized prices, sometimes large amounts where float error would show
+    return rng.choice([rng.randint(0, 100_000), rng.randint(0, 10**12)])
+
+def cents_to_decimal(cents):
+    return Decimal(cents).scaleb(-2)
+
+def test_float_prices_keep_their_cents():
+    rng = random.Random(1)
+    for _ in range(SAMPLES):
+        cents = rng.randint(0, 10**9)
+        assert to_money(cents / 100) == cents_to_decimal(cents)
+
+def test_rounds_half_up_to_cents():
+    rng = random.Random(2)
+    for _ in range(SAMPLES):
+        mills = rng.randint(0, 10**9)  # thousandths
+        expected = (mills + 5) // 10  # half-up, non-negative amounts
+        assert to_money(Decimal(mills).scaleb(-3)) == cents_to_decimal(expected)
+    assert to_money('0.005') == Decimal('0.01')
+    assert to_money('-0.005') == Decimal('-0.01')
+
+def test_minor_units_round_trip():
+    rng = random.Random(3)
+    for _ in range(SAMPLES):
+        cents = random_cents(rng)
+        amount = cents_to_decimal(cents)
+        assert to_minor_units(amount) == cents
+        assert from_minor_units(cents) == amount
+
+def test_total_is_exact():
+    rng = random.Random(4)
+    for _ in range(SAMPLES // 10):
+        lines = [(random_cents(rng), rng.randint(1, 20)) for _ in range(rng.randint(0, 50))]
+        expected = cents_to_decimal(sum(cents * quantity for cents, quantity in lines))
+        assert total((cents_to_decimal(cents), quantity) for cents, quantity in lines) == expected
+        # Prices given as floats (as a form or a JSON client might) total the same
+        assert total((cents / 100, quantity) for cents, quantity in lines if cents < 10**9) == \
+            cents_to_decimal(sum(cents * quantity for cents, quantity in lines if cents < 10**9))
+
+def test_line_total_is_exact():
+    rng = random.Random(5)
+    for _ in range(SAMPLES):
+        cents, quantity = random_cents(rng), rng.randint(0, 100)
+        assert line_total(cents_to_decimal(cents), quantity) == cents_to_decimal(cents * quantity)
+
+@pytest.mark.parametrize('vectorised', [True, False])
+def test_totals_by_group_is_exact(monkeypatch, vectorised):
+    if vectorised and money.np is None:
+        pytest.skip('NumPy is not installed')
+    if not vectorised:
+        monkeypatch.setattr(money, 'np', None)
+    rng = random.Random(6)
+    for _ in range(20):
+        # Few groups of large amounts pass 2**53 cents, where a float sum drops cents, and
+        # the largest pass 2**63, where int64 would overflow
+        groups, scale = rng.choice([3, 50]), rng.choice([1, 10, 10**6])
+        lines = [(rng.randint(1, groups), random_cents(rng) * scale, rng.randint(1, 10))
+                 for _ in range(rng.randint(0, 2000))]
+        expected = {}
+        for group_id, cents, quantity in lines:
+            expected[group_id] = expected.get(group_id, 0) + cents * quantity
+        result = totals_by_group([line[0] for line in lines], [cents_to_decimal(line[1]) for line in lines],
+                                 [line[2] for line in lines])
+        assert result == {group_id: cents_to_decimal(cents) for group_id, cents in expected.items()}
+        assert all(type(group_id) is int for group_id in result)
+
+def test_json_amounts_are_exact_strings():
+    rng = random.Random(7)
+    for _ in range(SAMPLES):
+        amount = cents_to_decimal(random_cents(rng))
+        encoded = as_json(amount)
+        assert isinstance(encoded, str)
+        assert Decimal(json.loads(json.dumps(encoded))) == amount
+    assert as_json(Decimal('19.9')) == '19.90'
+
+@pytest.mark.parametrize('value', ['abc', '', 'NaN', 'Infinity', float('nan'), float('inf'), object()])
+def test_rejects_what_is_not_an_amount(value):
+    with pytest.raises(ValueError):
+        to_money(value)
@@ -0,0 +1,62 @@
+# fashion-shop/tests/test_page_cache.py
+
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, text
+import cache
+from cache import LRUCache, shared_versions
+
+# Cached pages must follow writes made by other processes (another gunicorn worker, an
+# import, a cron job). Those are made here on a separate connection, so this process
+# only learns about them from the database, as another worker would.
+
+@pytest.fixture
+def lru_cache(app, monkeypatch):
+    monkeypatch.setattr(cache, 'page_cache', LRUCache())
+    monkeypatch.setattr(shared_versions, 'check_seconds', 0.0)
+    monkeypatch.setattr(shared_versions, 'products_since', None)
+    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    yield engine
+    engine.dispose()
+
+def other_process(engine, statement, **params):
+    with engine.begin() as conn:
+        conn.execute(text(statement), params)
+
+def get(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.headers['X-Page-Cache'], response.get_data(as_text=True)
+
+def test_stock_sold_elsewhere_reaches_the_product_page(client, lru_cache):
+    path = '/product/linen-shirt-2'
+    get(client, path)
+    assert get(client, path)[0] == 'HIT'
+    other_process(lru_cache, 'UPDATE product SET stock = 17, updated_at = :now WHERE slug = :slug',
+                  now=datetime.utcnow(), slug='linen-shirt-2')
+    state, html = get(client, path)
+    assert state == 'MISS' and '17' in html
+    assert get(client, path)[0] == 'HIT'
+    other_process(lru_cache, 'UPDATE product SET stock = 2, updated_at = :now WHERE slug = :slug',
+                  now=datetime.utcnow(), slug='linen-shirt-2')
+
+@pytest.mark.parametrize('watermark', [cache.CATALOG_CHANGED, cache.PAGES_CHANGED])
+def test_version_moved_elsewhere_drops_cached_pages(client, lru_cache, watermark):
+    get(client, '/products')
+    assert get(client, '/products')[0] == 'HIT'
+    other_process(lru_cache, "UPDATE product SET name = 'Linen shirt 0 (renamed)' WHERE slug = 'linen-shirt-0'")
+    # Without an updated_at move only the version tells other processes
+    other_process(lru_cache, 'INSERT INTO watermark (name, value) VALUES (:name, 1) '
+                             'ON CONFLICT (name) DO UPDATE SET value = value + 1', name=watermark)
+    state, html = get(client, '/products')
+    assert state == 'MISS' and 'renamed' in html
+    other_process(lru_cache, "UPDATE product SET name = 'Linen shirt 0' WHERE slug = 'linen-shirt-0'")
+
+def test_recommendations_update_without_changes_keeps_cached_pages(app):
+    import recommendations
+    from models import Watermark
+    with app.app_context():
+        recommendations.update()
+        versions = Watermark.get(cache.CATALOG_CHANGED), Watermark.get(cache.PAGES_CHANGED)
+        assert recommendations.update() == (0, 0)
+        assert (Watermark.get(cache.CATALOG_CHANGED), Watermark.get(cache.PAGES_CHANGED)) == versions
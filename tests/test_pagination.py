@@ -0,0 +1,48 @@
+# fashion-shop/tests/test_pagination.py
+
+import base64
+import json
+import re
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from models import Order, Product
+from pagination import decode_cursor, encode_cursor
+
+# Cursors come from the query string: whatever they hold, a listing either continues after
+# a real sort key or starts over at the first page.
+
+PRODUCT_LINK = re.compile(r'href="/product/([^"]+)"')
+
+def crafted(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def test_cursors_round_trip_as_the_columns_types():
+    when = datetime(2026, 5, 1, 12, 30)
+    assert decode_cursor(encode_cursor((Decimal('19.90'), 7)), [Product.price, Product.id]) == [Decimal('19.90'), 7]
+    assert decode_cursor(encode_cursor(('Linen shirt', 7)), [Product.name, Product.id]) == ['Linen shirt', 7]
+    assert decode_cursor(encode_cursor((when, 7)), [Order.order_date, Order.id]) == [when, 7]
+
+@pytest.mark.parametrize('values', [
+    ['a', {'x': 1}], [[1], 2], [None, None], ['a'], ['a', 1, 2], ['a', True], ['a', 1.5], ['a', '1'],
+    [1, 2], [{'dt': 'yesterday'}, 1], {'a': 1}, 'a',
+])
+def test_crafted_cursors_are_rejected(values):
+    assert decode_cursor(crafted(values), [Product.name, Product.id]) is None
+
+@pytest.mark.parametrize('price', ['NaN', 'Infinity', 'cheap', 1.5, ''])
+def test_prices_must_be_finite_amounts(price):
+    assert decode_cursor(crafted([price, 1]), [Product.price, Product.id]) is None
+
+@pytest.mark.parametrize('cursor', [
+    crafted(['a', {'x': 1}]), crafted([[1], 2]), crafted([None, None]), crafted([1.5, True]),
+    crafted([{'dt': 'yesterday'}, 1]), 'not a cursor', '%%%', crafted([[[[[[1]]]]], 1]),
+])
+@pytest.mark.parametrize('sort', ['name', 'price_asc', 'newest'])
+def test_crafted_cursors_show_the_first_page(client, sort, cursor):
+    first = PRODUCT_LINK.findall(client.get('/products', query_string={'sort': sort}).get_data(as_text=True))
+    assert first
+    for direction in ('after', 'before'):
+        response = client.get('/products', query_string={'sort': sort, direction: cursor})
+        assert response.status_code == 200
+        assert PRODUCT_LINK.findall(response.get_data(as_text=True)) == first
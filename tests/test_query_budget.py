@@ -0,0 +1,110 @@
+# fashion-shop/tests/test_query_budget.py
+
+import logging
+import pytest
+from flask import g
+from sqlalchemy import delete, select
+from models import db, CartItem, Category, Order, OrderItem, Product, User
+from pagination import encode_cursor
+from querybudget import QueryBudgetExceeded, query_count
+
+# The query budget hook, and the catalog pages held to their budgets. The test app runs
+# with QUERY_BUDGET_ENFORCE on and no page cache, so a page over its budget fails here.
+
+def _respond_after(app, budget, queries):
+    # Runs `queries` statements in a request with the given budget, then the after_request hooks
+    with app.test_request_context('/'):
+        g._query_budget = budget
+        for _ in range(queries):
+            db.session.execute(select(1))
+        assert query_count() == queries
+        return app.process_response(app.response_class('ok'))
+
+def test_over_budget_raises_when_enforced(app):
+    with pytest.raises(QueryBudgetExceeded, match=r'ran 3 queries \(budget 2\)'):
+        _respond_after(app, budget=2, queries=3)
+    assert _respond_after(app, budget=3, queries=3).status_code == 200
+
+def test_over_budget_is_logged_otherwise(app, caplog, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_BUDGET_ENFORCE', False)
+    with caplog.at_level(logging.WARNING, logger='querybudget'):
+        assert _respond_after(app, budget=2, queries=3).status_code == 200
+    assert 'ran 3 queries (budget 2)' in caplog.text
+
+def catalog_paths(app):
+    with app.app_context():
+        category = db.session.scalars(select(Category.slug).order_by(Category.id)).first()
+        # Sort keys in the middle of the listings, as the Next/Previous links carry them
+        by_name = db.session.execute(select(Product.name, Product.id).order_by(Product.name, Product.id)
+                                     .offset(app.config['PRODUCTS_PER_PAGE'] - 1).limit(1)).one()
+        by_price = db.session.execute(select(Product.price, Product.id).order_by(Product.price, Product.id)
+                                      .offset(30).limit(1)).one()
+    return [
+        '/', '/products', f'/products?after={encode_cursor(by_name)}', f'/products?before={encode_cursor(by_name)}',
+        f'/products?sort=price_desc&after={encode_cursor(by_price)}', '/products?price=25-50&in_stock=1',
+        f'/products/category/{category}', f'/products/category/{category}?in_stock=1',
+        '/product/linen-shirt-1', '/product/no-such-product',
+        '/search?q=linen', '/search?q=linen+shirt&in_stock=1&limit=5', '/api/search?q=lin',
+    ]
+
+@pytest.mark.parametrize('signed_in', [False, True])
+def test_catalog_pages_stay_under_budget(app, client, signed_in):
+    if signed_in:
+        response = client.post('/login', data={'username': 'shopper', 'password': 'secret-password'})
+        assert response.status_code == 302
+    for path in catalog_paths(app):
+        # Twice: the first request may also load the per-process catalog data
+        for _ in range(2):
+            response = client.get(path)
+            assert response.status_code in (200, 404), path
+
+# Signed-in pages over multi-line carts and orders: /cart and checkout load every line, so a
+# per-line query would show up here. Products with 3 in stock, one of each bought per order.
+CART_SLUGS = ['linen-shirt-3', 'linen-shirt-7', 'linen-shirt-11', 'linen-shirt-15', 'linen-shirt-19']
+CHECKOUT_FORM = {'first_name': 'Sam', 'last_name': 'Shopper', 'email': 'shopper@example.com',
+                 'address': '1 Test Street', 'postal_code': '00000', 'city': 'Testville'}
+
+@pytest.fixture
+def shopper(app, client):
+    response = client.post('/login', data={'username': 'shopper', 'password': 'secret-password'})
+    assert response.status_code == 302
+    with app.app_context():
+        user_id = db.session.scalar(select(User.id).where(User.username == 'shopper'))
+        product_ids = db.session.scalars(select(Product.id).where(Product.slug.in_(CART_SLUGS))).all()
+
+    def fill_cart():
+        with app.app_context():
+            db.session.add_all(CartItem(user_id=user_id, product_id=product_id, quantity=1)
+                               for product_id in product_ids)
+            db.session.commit()
+
+    yield fill_cart
+    with app.app_context():
+        order_ids = select(Order.id).where(Order.user_id == user_id)
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        db.session.execute(delete(Order).where(Order.user_id == user_id))
+        db.session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+        for product in Product.query.filter(Product.id.in_(product_ids)):
+            product.stock = 3
+        db.session.commit()
+
+def test_cart_checkout_and_orders_stay_under_budget(app, client, shopper):
+    for _ in range(2):
+        shopper()
+        for path in ('/cart', '/api/cart', '/checkout'):
+            response = client.get(path)
+            assert response.status_code == 200, path
+            assert b'Linen shirt 19' in response.get_data(), path
+        response = client.post('/checkout', data=CHECKOUT_FORM)
+        assert response.status_code == 302 and response.headers['Location'].endswith('/orders')
+
+    with app.app_context():
+        orders = db.session.execute(select(Order.order_date, Order.id).join(User)
+                                    .where(User.username == 'shopper').order_by(Order.id)).all()
+    assert len(orders) == 2
+    paths = ['/orders', f'/orders?after={encode_cursor(orders[1])}', f'/orders?before={encode_cursor(orders[0])}']
+    paths += [f'/orders/{order.id}' for order in orders]
+    for path in paths:
+        response = client.get(path)
+        assert response.status_code == 200, path
+    assert b'Linen shirt 19' in client.get(f'/orders/{orders[0].id}').get_data()
@@ -0,0 +1,116 @@
+# fashion-shop/tests/test_search.py
+
+import math
+import random
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from search import SearchIndex, product_index, get_index, tokenize
+
+# The index's ranking against scoring every product by hand, over seeded random catalogs
+# with incremental writes on top of the build; and the index following writes made by
+# another process, by re-reading the rows they changed or by a background rebuild.
+
+WORDS = 'classic slim linen cotton denim silk wool summer shirt dress jeans coat cap'.split()
+
+def random_product(rng, product_id):
+    return (product_id, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))),
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 6))),
+            rng.randint(1, 3), rng.randint(1, 5), rng.random() < 0.8)
+
+def postings(index, term):
+    found = {}
+    if term in index._base:
+        ids, impacts = index._base[term]
+        found.update({int(i): float(v) for i, v in zip(ids, impacts) if index._in_base[i]})
+    found.update(index._delta.get(term, {}))
+    return found
+
+def expected_ranking(index, products, query, prefix, category_id, min_price, max_price, available_only):
+    terms = tokenize(query)
+    groups = [[term] for term in terms]
+    if prefix:
+        groups[-1] = index._expand_prefix(terms[-1]) or [terms[-1]]
+    weighted = []
+    for term in (term for group in groups for term in group):
+        found = postings(index, term)
+        if found:
+            weighted.append((math.log(1 + (len(products) - len(found) + 0.5) / (len(found) + 0.5)), found))
+    ranked = []
+    for product_id in set().union(*(found for _, found in weighted)):
+        category, price, available = products[product_id]
+        if (available_only and not available) or (category_id is not None and category != category_id) \
+                or (min_price is not None and price < min_price) or (max_price is not None and price > max_price):
+            continue
+        ranked.append((-sum(idf * found.get(product_id, 0.0) for idf, found in weighted), product_id))
+    return [product_id for _, product_id in sorted(ranked)]
+
+def test_ranking_matches_scoring_every_product():
+    rng = random.Random(1)
+    for _ in range(30):
+        rows = [random_product(rng, product_id) for product_id in range(1, rng.randint(1, 300))]
+        products = {row[0]: row[3:] for row in rows}
+        index = SearchIndex.build(rows)
+        for _ in range(rng.randint(0, 60)):
+            product_id = rng.randint(1, 2000)
+            if rng.random() < 0.3:
+                index.remove(product_id)
+                products.pop(product_id, None)
+            else:
+                row = random_product(rng, product_id)
+                index.add(*row)
+                products[product_id] = row[3:]
+        assert len(index) == len(products)
+        for _ in range(30):
+            query = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+            prefix = rng.random() < 0.4
+            if prefix:
+                query = query[:-rng.randint(0, 3)] or query
+            filters = (rng.choice([None, 1, 2]), rng.choice([None, 2]), rng.choice([None, 4]), rng.random() < 0.7)
+            expected = expected_ranking(index, products, query, prefix, *filters)
+            assert [hit[0] for hit in index.search(query, None, prefix, *filters)] == expected
+            for limit in (1, 7, 40):
+                assert [hit[0] for hit in index.search(query, limit, prefix, *filters)] == expected[:limit]
+
+@pytest.fixture
+def other_process(app, monkeypatch):
+    # Writes on a separate connection, announced the way bump_catalog_version() does
+    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    monkeypatch.setattr(product_index, 'check_seconds', 0.0)
+
+    def write(statement, product_ids, **params):
+        with engine.begin() as conn:
+            conn.execute(text(statement), params)
+            version = conn.scalar(text("SELECT value FROM watermark WHERE name = 'catalog_changed'")) + 1
+            conn.execute(text("UPDATE watermark SET value = :version WHERE name = 'catalog_changed'"),
+                         {'version': version})
+            conn.execute(text('INSERT INTO catalog_change (version, product_id) VALUES (:version, :product_id)'),
+                         [{'version': version, 'product_id': product_id} for product_id in product_ids])
+    yield write
+    engine.dispose()
+
+def names_found(app, query):
+    with app.app_context():
+        return {product_id for product_id, _ in get_index().search(query)}
+
+def test_rows_changed_elsewhere_are_re_read(app, other_process):
+    names_found(app, 'linen')  # built
+    base = product_index._base
+    other_process("UPDATE product SET name = 'Velvet shirt 5' WHERE id = 5", [5])
+    assert names_found(app, 'velvet') == {5}
+    assert product_index._base is base  # no rebuild
+    other_process("UPDATE product SET name = 'Linen shirt 5' WHERE id = 5", [5])
+    assert names_found(app, 'velvet') == set()
+
+def test_bulk_rewrite_elsewhere_rebuilds_in_the_background(app, other_process):
+    names_found(app, 'linen')
+    other_process("UPDATE product SET name = 'Tweed shirt 7' WHERE id = 7", [None])
+    base = product_index._base
+    names_found(app, 'linen')  # notices, and starts the rebuild
+    deadline = time.monotonic() + 10
+    while product_index._rebuilding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert names_found(app, 'tweed') == {7}
+    assert product_index._base is not base
+    other_process("UPDATE product SET name = 'Linen shirt 7' WHERE id = 7", [7])
+    assert names_found(app, 'tweed') == set()
@@ -0,0 +1,92 @@
+# fashion-shop/throttle.py
+
+import hashlib
+import math
+import mmap
+import multiprocessing
+import struct
+import time
+
+# Attempt counters over a sliding window, in a fixed amount of memory.
+# Counts live in a hash table of buckets x ways slots in an anonymous shared mapping,
+# created when the application is built. Under gunicorn with preload_app that happens in
+# the master, so every forked worker updates the same table; without preload each worker
+# has its own.
+#
+# A slot holds a key fingerprint and the counts of the current and the previous fixed
+# window. The sliding count weights the previous window by how much of it still overlaps
+# the last `window` seconds (the usual sliding-window-counter estimate). A key that finds
+# its bucket full takes the slot with the lowest count, so memory never grows and the keys
+# actually being hammered are the ones that stay.
+
+SLOT = struct.Struct('<QQII')  # fingerprint, window number, previous count, current count
+
+class SlidingWindowCounter:
+    def __init__(self, window=300, buckets=4096, ways=4):
+        self.window = window
+        self.buckets = buckets
+        self.ways = ways
+        self._table = mmap.mmap(-1, buckets * ways * SLOT.size)
+        self._lock = multiprocessing.Lock()
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        fingerprint = int.from_bytes(digest, 'little') or 1  # 0 marks an empty slot
+        bucket = fingerprint % self.buckets
+        return fingerprint, [(bucket * self.ways + way) * SLOT.size for way in range(self.ways)]
+
+    def _now(self):
+        position = time.time() / self.window
+        return int(position), position % 1
+
+    @staticmethod
+    def _estimate(slot_window, previous, current, window, elapsed):
+        if slot_window == window:
+            return previous * (1 - elapsed) + current
+        if slot_window == window - 1:
+            return current * (1 - elapsed)
+        return 0.0
+
+    def count(self, key):
+        # Attempts in the last `window` seconds (fractional: the estimate is weighted)
+        fingerprint, offsets = self._locate(key)
+        window, elapsed = self._now()
+        with self._lock:
+            for offset in offsets:
+                slot_fingerprint, slot_window, previous, current = SLOT.unpack_from(self._table, offset)
+                if slot_fingerprint == fingerprint:
+                    return self._estimate(slot_window, previous, current, window, elapsed)
+        return 0.0
+
+    def add(self, key):
+        # Records one attempt; returns the new count
+        fingerprint, offsets = self._locate(key)
+        window, elapsed = self._now()
+        with self._lock:
+            victim, victim_count = None, None
+            for offset in offsets:
+                slot_fingerprint, slot_window, previous, current = SLOT.unpack_from(self._table, offset)
+                if slot_fingerprint == fingerprint:
+                    if slot_window == window - 1:
+                        previous, current = current, 0
+                    elif slot_window != window:
+                        previous, current = 0, 0
+                    SLOT.pack_into(self._table, offset, fingerprint, window, previous, current + 1)
+                    return self._estimate(window, previous, current + 1, window, elapsed)
+                count = self._estimate(slot_window, previous, current, window, elapsed) if slot_fingerprint else -1.0
+                if victim is None or count < victim_count:
+                    victim, victim_count = offset, count
+            SLOT.pack_into(self._table, victim, fingerprint, window, 0, 1)
+            return 1.0
+
+    def reset(self, key):
+        fingerprint, offsets = self._locate(key)
+        with self._lock:
+            for offset in offsets:
+                if SLOT.unpack_from(self._table, offset)[0] == fingerprint:
+                    SLOT.pack_into(self._table, offset, 0, 0, 0, 0)
+
+    def retry_after(self):
+        # Seconds until the current window ends and the attempts in it start to age out
+        _, elapsed = self._now()
+        return max(1, math.ceil((1 - elapsed) * self.window))
@@ -0,0 +1,31 @@
+# fashion-shop/upsert.py
+
+from models import db
+
+# Additive upserts for counter tables (recommendation pair counts, sales rollups):
+# INSERT the row, or if its key already exists add the new values onto the stored ones.
+# One statement per batch on MySQL (ON DUPLICATE KEY UPDATE), PostgreSQL and SQLite
+# (ON CONFLICT DO UPDATE), so no row is read back into Python first.
+
+WRITE_BATCH = 5000
+
+def add_to_counters(model, rows, key_columns, counter_columns):
+    # rows: list of dicts with every key and counter column
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in counter_columns})
+    else:
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=key_columns,
+                                          set_={c: table.c[c] + stmt.excluded[c] for c in counter_columns})
+    for start in range(0, len(rows), WRITE_BATCH):
+        db.session.execute(stmt, rows[start:start + WRITE_BATCH])
@@ -0,0 +1,68 @@
+# fashion-shop/warmup.py
+
+import gc
+import time
+import click
+from models import db
+from facets import get_facets, facet_index
+from search import get_index, product_index
+from snapshot import snapshot_store
+from cache import shared_versions
+
+# Loads what every worker would otherwise build on its first requests: the catalog
+# snapshot (snapshot.py), the facet and search indexes and the compiled templates.
+# Under gunicorn with preload_app (gunicorn.conf.py) this runs once in the master, before
+# the workers are forked, so they start warm and share those pages copy-on-write:
+#   before_fork  warm-up, then close every database connection and gc.freeze() what was
+#                loaded, so the workers' garbage collector never writes to (and so copies)
+#                those pages
+#   after_fork   each worker drops the pool it inherited and opens its own connections
+# The snapshot and both indexes record the catalog version they were loaded at. Once forked,
+# each worker keeps its copies current on its own: its own writes are applied as they
+# commit, and the version check (at most every SNAPSHOT_CHECK_SECONDS) picks up every other
+# process's, so all workers converge on the same answers. The page cache keys check the
+# same version (cache.shared_versions).
+
+def _compile_templates(app):
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+def warm_up(app):
+    # Returns {step: seconds}
+    steps = [
+        ('catalog snapshot', snapshot_store.load),
+        ('facet index', get_facets),
+        ('search index', get_index),
+        ('templates', lambda: _compile_templates(app)),
+    ]
+    timings = {}
+    with app.app_context():
+        for name, step in steps:
+            started = time.perf_counter()
+            step()
+            timings[name] = time.perf_counter() - started
+        db.session.remove()
+    return timings
+
+def before_fork(app):
+    timings = warm_up(app)
+    with app.app_context():
+        db.engine.dispose()  # no connection may be shared with a forked worker
+    gc.freeze()
+    return timings
+
+def after_fork(app):
+    with app.app_context():
+        # close=False: the master's connections (if any) belong to the master
+        db.engine.dispose(close=False)
+    # What the master loaded may be much older than this worker (workers are re-forked after
+    # a crash or max_requests), so the first lookup checks the catalog version
+    for store in (snapshot_store, product_index, facet_index, shared_versions):
+        store.checked_at = 0.0
+
+def init_warmup(app):
+    @app.cli.command('warm-up')
+    def warm_up_command():
+        """Load the catalog snapshot, indexes and templates, and time each step."""
+        for name, seconds in warm_up(app).items():
+            click.echo(f'{name:<18} {seconds * 1000:8.1f} ms')